@@ -0,0 +1,64 @@
+"""
+Measure how long it takes to import the helmupdater CLI.
+
+Runs `python -X importtime` several times in fresh interpreters and reports the
+median cumulative import time of the slowest modules.
+
+Usage:
+    python benchmarks/import_time.py [--runs N] [--top N] [--module MODULE]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Return cumulative import time in microseconds for every imported module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=dict(os.environ, PYTHONPATH=str(SRC_DIR)),
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time: self [us] | cumulative | imported package"
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--module", default="helmupdater.cli")
+    args = parser.parse_args()
+
+    samples: dict[str, list[int]] = defaultdict(list)
+    for _ in range(args.runs):
+        for name, cumulative in import_times(args.module).items():
+            samples[name].append(cumulative)
+
+    medians = {name: statistics.median(values) for name, values in samples.items()}
+    total = medians[args.module] / 1000
+    print(f"{args.module}: {total:.1f} ms (median of {args.runs} runs)")
+    print()
+    print(f"{'cumulative ms':>14}  module")
+    slowest = sorted(medians.items(), key=lambda item: item[1], reverse=True)
+    for name, value in slowest[: args.top]:
+        print(f"{value / 1000:>14.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
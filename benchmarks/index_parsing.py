@@ -0,0 +1,120 @@
+"""
+Measure parallel parsing of large repository indexes on every executor kind.
+
+Generates synthetic index.yaml documents shaped like large repositories (many
+charts with many versions), parses them one after the other in the calling
+thread, then concurrently on every executor available to this interpreter
+(see `helmupdater.parsing`) with a growing number of workers. Reports the
+speedup over parsing inline and the speedup per core.
+
+Usage:
+    python benchmarks/index_parsing.py [--indexes N] [--charts N]
+        [--versions N] [--runs N] [--max-workers N]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from helmupdater.parsing import (  # noqa: E402
+    ExecutorKind,
+    create_executor,
+    parse_yaml,
+    resolve_kind,
+)
+
+
+def generate_index(charts: int, versions: int, seed: int) -> str:
+    """Create an index.yaml with `charts` charts of `versions` versions each."""
+    lines = ["apiVersion: v1", "entries:"]
+    for chart in range(charts):
+        name = f"chart-{seed}-{chart}"
+        lines.append(f"  {name}:")
+        for version in range(versions):
+            lines += [
+                "  - apiVersion: v2",
+                f"    appVersion: {version // 10}.{version % 10}.0",
+                f'    created: "2026-01-{version % 28 + 1:02}T00:00:00Z"',
+                f"    description: Synthetic chart {name} for parsing benchmarks",
+                f"    digest: {(seed * 7919 + chart * 104729 + version):064x}",
+                f"    name: {name}",
+                "    urls:",
+                f"    - https://example.com/charts/{name}-1.{version}.0.tgz",
+                f"    version: 1.{version}.0",
+            ]
+    lines.append('generated: "2026-01-01T00:00:00Z"')
+    return "\n".join(lines) + "\n"
+
+
+def available_kinds() -> list[ExecutorKind]:
+    kinds = [ExecutorKind.THREADS, ExecutorKind.PROCESSES]
+    if resolve_kind() == ExecutorKind.INTERPRETERS:
+        kinds.insert(1, ExecutorKind.INTERPRETERS)
+    return kinds
+
+
+def time_inline(documents: list[str]) -> float:
+    started = time.perf_counter()
+    for document in documents:
+        parse_yaml(document)
+    return time.perf_counter() - started
+
+
+def time_executor(kind: ExecutorKind, workers: int, documents: list[str]) -> float:
+    """Parse documents concurrently, not counting the start of the workers."""
+    with create_executor(kind, workers) as executor:
+        list(executor.map(parse_yaml, ["entries: {}"] * workers))
+        started = time.perf_counter()
+        list(executor.map(parse_yaml, documents))
+        return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--indexes", type=int, default=8)
+    parser.add_argument("--charts", type=int, default=200)
+    parser.add_argument("--versions", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-workers", type=int, default=os.process_cpu_count())
+    args = parser.parse_args()
+
+    documents = [
+        generate_index(args.charts, args.versions, seed) for seed in range(args.indexes)
+    ]
+    size = sum(len(document) for document in documents) / 2**20
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(
+        f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}, "
+        f"{os.process_cpu_count()} cores"
+    )
+    print(f"{args.indexes} indexes, {size:.1f} MiB in total")
+    print()
+
+    inline = statistics.median(time_inline(documents) for _ in range(args.runs))
+    print(
+        f"{'executor':<14} {'workers':>7} {'seconds':>8} {'speedup':>8} {'per core':>9}"
+    )
+    print(f"{'inline':<14} {1:>7} {inline:>8.2f} {1:>8.2f} {1:>9.2f}")
+
+    workers = [1]
+    while workers[-1] * 2 <= min(args.max_workers, args.indexes):
+        workers.append(workers[-1] * 2)
+    for kind in available_kinds():
+        for count in workers:
+            seconds = statistics.median(
+                time_executor(kind, count, documents) for _ in range(args.runs)
+            )
+            speedup = inline / seconds
+            print(
+                f"{kind:<14} {count:>7} {seconds:>8.2f} {speedup:>8.2f} "
+                f"{speedup / count:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
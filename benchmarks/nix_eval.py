@@ -0,0 +1,268 @@
+"""
+Measure how nix evaluation of the flake scales with the number of charts.
+
+Generates synthetic chart trees of the given sizes next to a copy of the flake,
+from the chart files in `charts/`, then times `nix eval` of `chartsMetadata`
+and the instantiation of every derivation in `chartsDerivations`. Memory and
+evaluator counters are taken from `NIX_SHOW_STATS`.
+
+Trees are laid out with a chart file per chart ("files"), or with the metadata
+of all charts in charts.lock.json and no chart files ("lock").
+
+Every measurement is printed and, with --output, appended to a JSON lines file.
+With --baseline, results are compared with a file written before (e.g. on
+another branch), by target, layout and number of charts.
+
+Usage:
+    python benchmarks/nix_eval.py [--sizes N,N,...] [--charts-per-repo N]
+        [--runs N] [--targets metadata,derivations] [--layouts files,lock]
+        [--output FILE] [--baseline FILE] [--keep]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from helmupdater import chart, charts_lock  # noqa: E402
+
+# Files the flake needs to evaluate, besides charts/
+FLAKE_FILES = ("flake.nix", "flake.lock", "pyproject.toml", "uv.lock")
+
+TARGETS = ("metadata", "derivations")
+
+LAYOUTS = ("files", "lock")
+
+# Counters kept from NIX_SHOW_STATS, by the name they are reported under
+STATS = {
+    "cpu_seconds": ("cpuTime",),
+    "heap_bytes": ("gc", "heapSize"),
+    "allocated_bytes": ("gc", "totalBytes"),
+    "thunks": ("nrThunks",),
+    "envs": ("envs", "number"),
+    "values": ("values", "number"),
+    "function_calls": ("nrFunctionCalls",),
+}
+
+
+def generate_tree(
+    directory: Path, size: int, charts_per_repo: int, layout: str = "files"
+) -> None:
+    """
+    Create a flake with `size` charts, cycling through the charts in `charts/`.
+
+    Charts are spread over repositories of `charts_per_repo` charts each, which
+    is roughly how the real collection is laid out.
+    """
+    sources = sorted(ROOT_DIR.glob("charts/*/*/default.nix"))
+    if not sources:
+        sys.exit("no charts found in charts/")
+
+    directory.mkdir(parents=True)
+    for name in FLAKE_FILES:
+        shutil.copy(ROOT_DIR / name, directory / name)
+    entries: dict[str, dict[str, dict[str, str]]] = {}
+    for index in range(size):
+        repo_name = f"repo{index // charts_per_repo:04}"
+        chart_name = f"chart{index % charts_per_repo:04}"
+        source = sources[index % len(sources)]
+        if layout == "lock":
+            chart_info = chart.parse_chart_file(source.read_text())
+            if chart_info is None:
+                sys.exit(f"{source} needs evaluation, can't be put in the lock file")
+            entries.setdefault(repo_name, {})[chart_name] = chart_info.model_dump()
+            continue
+        chart_dir = directory / "charts" / repo_name / chart_name
+        chart_dir.mkdir(parents=True)
+        shutil.copy(source, chart_dir / "default.nix")
+    if layout == "lock":
+        (directory / charts_lock.LOCK_FILE).write_text(charts_lock.render(entries))
+
+
+def current_system() -> str:
+    return subprocess.run(
+        ["nix", "eval", "--impure", "--raw", "--expr", "builtins.currentSystem"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def eval_command(directory: Path, target: str, system: str) -> list[str]:
+    # path: flakes don't need a git repository. The evaluation cache would
+    # answer repeated runs without evaluating anything.
+    flake = f"path:{directory}"
+    command = ["nix", "eval", "--json", "--option", "eval-cache", "false"]
+    if target == "metadata":
+        return [*command, f"{flake}#chartsMetadata"]
+    # drvPath instantiates the derivation, without building anything
+    return [
+        *command,
+        f"{flake}#chartsDerivations.{system}",
+        "--apply",
+        "repos: builtins.mapAttrs "
+        "(_: charts: builtins.mapAttrs (_: chart: chart.drvPath) charts) repos",
+    ]
+
+
+def measure(command: list[str], stats_path: Path) -> dict[str, float]:
+    """Run a nix command once, returning its wall time and NIX_SHOW_STATS counters."""
+    env = {
+        "NIX_SHOW_STATS": "1",
+        "NIX_SHOW_STATS_PATH": str(stats_path),
+    }
+    started = time.perf_counter()
+    subprocess.run(
+        command,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, **env},
+    )
+    result = {"seconds": time.perf_counter() - started}
+
+    stats = json.loads(stats_path.read_text())
+    for name, path in STATS.items():
+        value = stats
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None:
+            result[name] = value
+    return result
+
+
+def measure_target(
+    directory: Path, target: str, system: str, runs: int
+) -> dict[str, float]:
+    """Evaluate a target of a tree `runs` times, returning median measurements."""
+    command = eval_command(directory, target, system)
+    stats_path = directory.parent / "stats.json"
+    # The first run copies the tree to the store and fetches inputs
+    measure(command, stats_path)
+    samples = [measure(command, stats_path) for _ in range(runs)]
+    return {
+        name: statistics.median(sample[name] for sample in samples)
+        for name in samples[0]
+    }
+
+
+def git_commit() -> str | None:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip() or None
+
+
+def nix_version() -> str:
+    return subprocess.run(
+        ["nix", "--version"], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def load_baseline(path: Path) -> dict[tuple[str, str, int], dict]:
+    """
+    Read results written with --output, the last one of every target, layout
+    and size.
+    """
+    baseline = {}
+    for line in path.read_text().splitlines():
+        if line.strip():
+            record = json.loads(line)
+            layout = record.get("layout", "files")
+            baseline[record["target"], layout, record["charts"]] = record
+    return baseline
+
+
+def _format_bytes(size: float) -> str:
+    return f"{size / 2**20:.0f} MiB"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="121,500,1000,2000,4000")
+    parser.add_argument("--charts-per-repo", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--layouts", default=",".join(LAYOUTS))
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--keep", action="store_true", help="Keep generated trees")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    targets = args.targets.split(",")
+    if unknown := set(targets) - set(TARGETS):
+        sys.exit(f"unknown targets: {', '.join(sorted(unknown))}")
+    layouts = args.layouts.split(",")
+    if unknown := set(layouts) - set(LAYOUTS):
+        sys.exit(f"unknown layouts: {', '.join(sorted(unknown))}")
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+
+    system = current_system()
+    context = {
+        "commit": git_commit(),
+        "nix": nix_version(),
+        "system": system,
+        "charts_per_repo": args.charts_per_repo,
+        "runs": args.runs,
+    }
+    print(f"{context['nix']}, {system}, commit {context['commit']}")
+    print()
+    print(
+        f"{'target':<12} {'layout':<6} {'charts':>7} {'seconds':>8} {'cpu s':>7} "
+        f"{'heap':>9} {'thunks':>11} {'vs baseline':>12}"
+    )
+
+    workdir = Path(tempfile.mkdtemp(prefix="helmupdater-nix-eval-"))
+    try:
+        for size in sizes:
+            for layout in layouts:
+                directory = workdir / f"{layout}-{size}"
+                generate_tree(directory, size, args.charts_per_repo, layout)
+                for target in targets:
+                    record = {
+                        "target": target,
+                        "layout": layout,
+                        "charts": size,
+                        **measure_target(directory, target, system, args.runs),
+                        **context,
+                        "date": datetime.now(UTC).isoformat(timespec="seconds"),
+                    }
+
+                    compared = ""
+                    if (target, layout, size) in baseline:
+                        previous = baseline[target, layout, size]
+                        compared = f"{record['seconds'] / previous['seconds']:.2f}x"
+                    print(
+                        f"{target:<12} {layout:<6} {size:>7} "
+                        f"{record['seconds']:>8.2f} "
+                        f"{record.get('cpu_seconds', 0):>7.2f} "
+                        f"{_format_bytes(record.get('heap_bytes', 0)):>9} "
+                        f"{record.get('thunks', 0):>11} {compared:>12}"
+                    )
+                    if args.output is not None:
+                        with args.output.open("a") as f:
+                            f.write(json.dumps(record) + "\n")
+    finally:
+        if args.keep:
+            print(f"\ngenerated trees kept in {workdir}")
+        else:
+            shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
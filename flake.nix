@@ -44,11 +44,42 @@
       pyproject-build-systems,
       ...
     }:
+    let
+      # Metadata of all charts, maintained by helmupdater (see `helmupdater lock`)
+      lockedCharts =
+        if builtins.pathExists ./charts.lock.json then
+          (builtins.fromJSON (builtins.readFile ./charts.lock.json)).charts
+        else
+          { };
+
+      # Charts that aren't in the lock file (yet)
+      chartFiles =
+        if builtins.pathExists ./charts then
+          haumea.lib.load {
+            src = ./charts;
+            transformer = haumea.lib.transformers.liftDefault;
+          }
+        else
+          { };
+
+      # A chart is either in the lock file or has a chart file, never both
+      mergeCharts =
+        lockedCharts: chartFiles:
+        chartFiles
+        // builtins.mapAttrs (
+          repo: charts:
+          (chartFiles.${repo} or { })
+          // builtins.mapAttrs (
+            chart: attrs:
+            if (chartFiles.${repo} or { }) ? ${chart} then
+              throw "${repo}/${chart}: defined both in charts.lock.json and in a chart file, run `helmupdater lock` to move the chart file into charts.lock.json"
+            else
+              attrs
+          ) charts
+        ) lockedCharts;
+    in
     {
-      chartsMetadata = haumea.lib.load {
-        src = ./charts;
-        transformer = haumea.lib.transformers.liftDefault;
-      };
+      chartsMetadata = mergeCharts lockedCharts chartFiles;
 
       charts =
         { pkgs }:
@@ -56,11 +87,9 @@
           kubelib = nix-kube-generators.lib { inherit pkgs; };
           trimBogusVersion = attrs: builtins.removeAttrs attrs [ "bogusVersion" ];
         in
-        haumea.lib.load {
-          src = ./charts;
-          loader = { ... }: p: kubelib.downloadHelmChart (trimBogusVersion (import p));
-          transformer = haumea.lib.transformers.liftDefault;
-        };
+        builtins.mapAttrs (
+          _: builtins.mapAttrs (_: chart: kubelib.downloadHelmChart (trimBogusVersion chart))
+        ) self.chartsMetadata;
     }
     // flake-utils.lib.eachDefaultSystem (
       system:
@@ -99,6 +128,32 @@
           default = self.apps.${system}.helmupdater;
         };
 
+        # The tree has no lock file, check merging one with chart files
+        checks.chartsLock =
+          let
+            chart = name: {
+              repo = "https://example.com/charts";
+              chart = name;
+              version = "1.0.0";
+              chartHash = "sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=";
+            };
+            merged = mergeCharts { local.nginx = chart "nginx"; } {
+              local.podinfo = chart "podinfo";
+              other.redis = chart "redis";
+            };
+            conflict = mergeCharts { local.nginx = chart "nginx"; } { local.nginx = chart "nginx"; };
+          in
+          assert
+            merged == {
+              local = {
+                nginx = chart "nginx";
+                podinfo = chart "podinfo";
+              };
+              other.redis = chart "redis";
+            };
+          assert !(builtins.tryEval conflict.local.nginx).success;
+          pkgs.runCommand "charts-lock-check" { } "touch $out";
+
         formatter = pkgs.nixfmt-tree;
 
         devShell =
@@ -0,0 +1,245 @@
+"""Selecting several charts and checking them concurrently in one run."""
+
+# Chart models pull in pydantic, registries pull in requests, yaml and oras
+from __future__ import annotations
+
+import fnmatch
+import re
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
+
+from helmupdater import (
+    chart,
+    history,
+    locks,
+    metrics,
+    nix,
+    profiling,
+    registry,
+    utils,
+)
+
+if TYPE_CHECKING:
+    from helmupdater.chart.chart_metadata import ChartMetadata
+    from helmupdater.registry import Registry
+
+# Prefix of selectors that are regular expressions, e.g. "re:bitnami/(redis|valkey)"
+REGEX_PREFIX = "re:"
+
+ChartKey = tuple[str, str]
+
+
+def is_selector(name: str) -> bool:
+    """
+    Check if a name selects charts by a pattern rather than naming one.
+
+    Args:
+        name: Chart name or selector
+
+    Returns:
+        True for glob patterns and regular expressions
+    """
+    return name.startswith(REGEX_PREFIX) or utils.is_pattern(name)
+
+
+def select(available: Iterable[ChartKey], selectors: list[str]) -> list[ChartKey]:
+    """
+    Select charts by names and patterns.
+
+    Selectors are matched against "repo/chart":
+
+    - a name in format "repo/chart" selects that chart
+    - a glob pattern selects matching charts (e.g. "bitnami/*", "*/postgres*")
+    - a regular expression prefixed with "re:" selects charts it fully matches
+      (e.g. "re:grafana/(loki|tempo).*")
+
+    Args:
+        available: Existing charts, as (repo_name, chart_name) tuples
+        selectors: Names and patterns
+
+    Returns:
+        Selected charts, in order of the selectors and without duplicates
+
+    Raises:
+        ValueError: If a selector is malformed or selects no chart
+
+    Examples:
+        >>> select([("bitnami", "redis"), ("grafana", "loki")], ["bitnami/*"])
+        [('bitnami', 'redis')]
+    """
+    charts = sorted(available)
+    selected: dict[ChartKey, None] = {}
+    for selector in selectors:
+        if selector.startswith(REGEX_PREFIX):
+            try:
+                pattern = re.compile(selector.removeprefix(REGEX_PREFIX))
+            except re.error as e:
+                raise ValueError(f"Invalid regular expression '{selector}': {e}") from e
+            matches = [c for c in charts if pattern.fullmatch(f"{c[0]}/{c[1]}")]
+        elif utils.is_pattern(selector):
+            utils.parse_chart_name(selector)
+            matches = [
+                c for c in charts if fnmatch.fnmatchcase(f"{c[0]}/{c[1]}", selector)
+            ]
+        else:
+            key = utils.parse_chart_name(selector)
+            matches = [key] if key in charts else []
+        if not matches:
+            raise ValueError(f"No charts match '{selector}'")
+        selected.update(dict.fromkeys(matches))
+    return list(selected)
+
+
+def resolve(selectors: list[str]) -> dict[ChartKey, ChartMetadata]:
+    """
+    Select charts and get their metadata.
+
+    Charts named explicitly are read from the lock file or their files (see
+    `chart.read`). Patterns are matched against all
+    charts, whose metadata is evaluated once (see `nix.get_charts`).
+
+    Args:
+        selectors: Names and patterns (see `select`)
+
+    Returns:
+        Metadata of selected charts, in order of the selectors
+
+    Raises:
+        ValueError: If a selector is malformed or selects no chart
+    """
+    with profiling.phase("metadata"):
+        if not any(is_selector(selector) for selector in selectors):
+            keys = dict.fromkeys(map(utils.parse_chart_name, selectors))
+            return {key: _read_chart(*key) for key in keys}
+
+        charts = nix.get_charts()
+    available = [
+        (repo_name, chart_name)
+        for repo_name, repo_charts in charts.items()
+        for chart_name in repo_charts
+    ]
+    return {
+        (repo_name, chart_name): charts[repo_name][chart_name]
+        for repo_name, chart_name in select(available, selectors)
+    }
+
+
+def _read_chart(repo_name: str, chart_name: str) -> ChartMetadata:
+    if not chart.exists(repo_name, chart_name):
+        raise ValueError(f"No charts match '{repo_name}/{chart_name}'")
+    return chart.read(repo_name, chart_name)
+
+
+class Batch:
+    """
+    Charts checked concurrently within one run.
+
+    Charts share registry instances (so an index.yaml is fetched once per
+    repository) and the run history. Every chart is locked while it is checked
+    and gets its own record in the history.
+    """
+
+    def __init__(self, command: str, jobs: int = 4) -> None:
+        """
+        Args:
+            command: Command of the run, as recorded in the history
+            jobs: Maximum number of charts checked at a time
+        """
+        self.jobs = jobs
+        self._history = history.RunHistory(command)
+        self._registries: dict[tuple[str, str], Registry] = {}
+        self._lock = threading.Lock()
+
+    def registry(self, repo_url: str, repo_name: str) -> Registry:
+        """
+        Get the registry of a repository, shared by all charts of the batch.
+
+        Args:
+            repo_url: Repository URL
+            repo_name: Repository name
+
+        Returns:
+            Registry created on first use
+        """
+        with self._lock:
+            if (repo_url, repo_name) not in self._registries:
+                self._registries[repo_url, repo_name] = registry.create(
+                    repo_url, repo_name
+                )
+            return self._registries[repo_url, repo_name]
+
+    def run(
+        self,
+        charts: dict[ChartKey, ChartMetadata],
+        check: Callable[[str, str, ChartMetadata], ChartMetadata],
+    ) -> dict[ChartKey, ChartMetadata | Exception]:
+        """
+        Check charts concurrently.
+
+        A single chart is checked on the calling thread.
+
+        Args:
+            charts: Current metadata of the charts to check
+            check: Function taking repository name, chart name and current
+                metadata, returning the new metadata of the chart
+
+        Returns:
+            New metadata or error for every chart, in the order of `charts`
+
+        Examples:
+            >>> batch.run(charts, lambda r, c, info: chart.rehash(r, c))
+            {('local', 'nginx'): ChartMetadata(...)}
+        """
+
+        def check_chart(key: ChartKey) -> ChartMetadata:
+            repo_name, chart_name = key
+            chart_info = charts[key]
+            with (
+                locks.chart_lock(repo_name, chart_name),
+                self._history.chart(
+                    repo_name, chart_name, chart_info.repo, chart_info.version
+                ) as record,
+            ):
+                try:
+                    new_chart_info = check(repo_name, chart_name, chart_info)
+                except Exception as e:
+                    record.error = str(e)
+                    raise
+                record.resolve(new_chart_info.version)
+                return new_chart_info
+
+        results: dict[ChartKey, ChartMetadata | Exception] = {}
+        with ExitStack() as stack:
+            if len(charts) == 1:
+                futures = {key: _run_inline(check_chart, key) for key in charts}
+            else:
+                executor = stack.enter_context(ThreadPoolExecutor(self.jobs))
+                futures = {key: executor.submit(check_chart, key) for key in charts}
+            for key, future in futures.items():
+                metrics.inc("charts", result="checked")
+                try:
+                    result = future.result()
+                except Exception as e:
+                    results[key] = e
+                    metrics.inc("charts", result="failed")
+                    continue
+                results[key] = result
+                if result.version != charts[key].version:
+                    metrics.inc("charts", result="updated")
+        return results
+
+    def close(self) -> None:
+        """Close the run history."""
+        self._history.close()
+
+
+def _run_inline[T](function: Callable[[ChartKey], T], key: ChartKey) -> Future[T]:
+    future: Future[T] = Future()
+    try:
+        future.set_result(function(key))
+    except Exception as e:
+        future.set_exception(e)
+    return future
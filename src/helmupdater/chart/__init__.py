@@ -1,17 +1,49 @@
 """Chart operations for version management and file I/O."""
 
-from pathlib import Path
-
-import chevron
+# Chart models pull in pydantic, import them only when used (see `__getattr__`)
+from __future__ import annotations
 
-from helmupdater import git, nix, registry
+import fnmatch
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from subprocess import CalledProcessError
+from typing import TYPE_CHECKING
+
+from helmupdater import (
+    charts_lock,
+    eval_cache,
+    git,
+    hash_memo,
+    history,
+    nix,
+    profiling,
+    registry,
+    utils,
+)
 from helmupdater.logging import get_logger
 
-from .chart_metadata import ChartMetadata
-from .chart_version import ChartVersion
+if TYPE_CHECKING:
+    from helmupdater.registry import Registry
+
+    from .chart_metadata import ChartMetadata
 
 log = get_logger()
 
+
+def __getattr__(name: str):
+    if name == "ChartMetadata":
+        from .chart_metadata import ChartMetadata
+
+        return ChartMetadata
+    if name == "ChartVersion":
+        from .chart_version import ChartVersion
+
+        return ChartVersion
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 CHART_TEMPLATE = """{
   repo = "{{ repo }}";
   chart = "{{ chart }}";
@@ -23,6 +55,14 @@ CHART_TEMPLATE = """{
 PLACEHOLDER_HASH = "sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA="
 PLACEHOLDER_VERSION = "0.0.0"
 
+CHART_FILES_PATHSPEC = ":(glob)charts/*/*/default.nix"
+
+# Attributes of a chart file written from CHART_TEMPLATE
+_CHART_ATTR = re.compile(r'^\s*(\w+)\s*=\s*"([^"$\\]*)";\s*$', re.MULTILINE)
+
+# Charts updated concurrently scan git history once
+_seed_lock = threading.Lock()
+
 
 def get_chart_path(repo_name: str, chart_name: str) -> Path:
     """
@@ -42,6 +82,27 @@ def get_chart_path(repo_name: str, chart_name: str) -> Path:
     return Path.cwd() / "charts" / repo_name / chart_name / "default.nix"
 
 
+def parse_chart_path(chart_path: Path | str) -> tuple[str, str] | None:
+    """
+    Get repository and chart names from a path to chart's default.nix file.
+
+    Args:
+        chart_path: Path relative to the repository root
+
+    Returns:
+        Tuple of (repo_name, chart_name), or None if the path is not a chart file
+
+    Examples:
+        >>> parse_chart_path("charts/local/nginx/default.nix")
+        ('local', 'nginx')
+        >>> parse_chart_path("charts/local/nginx/README.md")
+    """
+    parts = Path(chart_path).parts
+    if len(parts) != 4 or parts[0] != "charts" or parts[3] != "default.nix":
+        return None
+    return parts[1], parts[2]
+
+
 def create_chart_directory(repo_name: str, chart_name: str) -> Path:
     """
     Create chart directory structure if it doesn't exist.
@@ -70,6 +131,8 @@ def exists(repo_name: str, chart_name: str) -> bool:
     """
     Check if the provided chart exists.
 
+    A chart exists if it has a chart file or an entry in the lock file.
+
     Args:
         repo_name: Repository name
         chart_name: Chart name
@@ -77,7 +140,87 @@ def exists(repo_name: str, chart_name: str) -> bool:
     Returns:
         True if chart exists, False otherwise.
     """
-    return Path.exists(get_chart_path(repo_name, chart_name))
+    return (
+        Path.exists(get_chart_path(repo_name, chart_name))
+        or charts_lock.get(repo_name, chart_name) is not None
+    )
+
+
+def read(repo_name: str, chart_name: str) -> ChartMetadata:
+    """
+    Read chart metadata, without nix if possible.
+
+    The chart's entry in the lock file is used if there is one. Otherwise the
+    chart file is parsed, and evaluated with nix if it isn't laid out like
+    CHART_TEMPLATE.
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+
+    Returns:
+        Chart metadata
+
+    Raises:
+        ConflictError: If the chart is in the lock file and has a chart file
+
+    Examples:
+        >>> read("local", "nginx")
+        ChartMetadata(repo='http://localhost:45010/', chart='nginx', ...)
+    """
+    chart_info = charts_lock.get(repo_name, chart_name)
+    if chart_info is not None:
+        return chart_info
+    content = get_chart_path(repo_name, chart_name).read_text()
+    return parse_chart_file(content) or nix.get_chart(repo_name, chart_name)
+
+
+def lock_entries() -> charts_lock.Entries:
+    """
+    Collect entries of the lock file from the chart files.
+
+    Charts without a chart file keep their current entry in the lock file.
+
+    Returns:
+        Nested dict {repo_name: {chart_name: {field: value}}}
+
+    Examples:
+        >>> charts_lock.write(lock_entries())
+    """
+    entries = {
+        repo_name: dict(repo_charts)
+        for repo_name, repo_charts in (charts_lock.load() or {}).items()
+    }
+    for chart_path in sorted((Path.cwd() / "charts").glob("*/*/default.nix")):
+        repo_name, chart_name = chart_path.parts[-3:-1]
+        chart_info = parse_chart_file(chart_path.read_text()) or nix.eval_chart_file(
+            chart_path
+        )
+        entries.setdefault(repo_name, {})[chart_name] = chart_info.model_dump()
+    return entries
+
+
+def parse_chart_file(content: str) -> ChartMetadata | None:
+    """
+    Read chart metadata from the content of a chart file, without nix.
+
+    Args:
+        content: Content of a chart's default.nix
+
+    Returns:
+        Chart metadata, or None if the file isn't laid out like CHART_TEMPLATE
+        (e.g. uses nix expressions) and has to be evaluated
+
+    Examples:
+        >>> parse_chart_file(Path("charts/local/nginx/default.nix").read_text())
+        ChartMetadata(repo='http://localhost:45010/', chart='nginx', ...)
+    """
+    from .chart_metadata import ChartMetadata
+
+    attrs = dict(_CHART_ATTR.findall(content))
+    if not {"repo", "chart", "version", "chartHash"} <= attrs.keys():
+        return None
+    return ChartMetadata(**attrs)
 
 
 def write_chart_file(
@@ -87,6 +230,10 @@ def write_chart_file(
     """
     Write chart metadata to Nix file using template.
 
+    If the lock file is in use, the chart's entry in it is written instead, and
+    a chart file the chart had before the lock file is removed (see
+    `charts_lock.enabled`).
+
     Args:
         chart_path: Path to chart's default.nix file
         chart_info: Chart metadata dict
@@ -100,6 +247,8 @@ def write_chart_file(
         ... }
         >>> write_chart_file("charts/local/nginx/default.nix", chart_info)
     """
+    import chevron
+
     chart_path = Path(chart_path)
 
     content = chevron.render(
@@ -112,7 +261,34 @@ def write_chart_file(
         ),
     )
 
-    chart_path.write_text(content)
+    eval_cache.invalidate("chartsMetadata")
+    if charts_lock.enabled():
+        repo_name, chart_name = chart_path.parts[-3:-1]
+        charts_lock.put(repo_name, chart_name, chart_info)
+        if chart_path.exists():
+            remove_chart_file(chart_path)
+        return
+
+    git.track_write(chart_path, content)
+    utils.write_atomic(chart_path, content)
+
+
+def remove_chart_file(chart_path: Path) -> None:
+    """
+    Remove a chart file, and the chart and repository directories if empty.
+
+    Args:
+        chart_path: Path to chart's default.nix file
+
+    Examples:
+        >>> remove_chart_file(get_chart_path("local", "nginx"))
+    """
+    git.track_write(chart_path, None)
+    chart_path.unlink()
+    for directory in (chart_path.parent, chart_path.parent.parent):
+        if any(directory.iterdir()):
+            return
+        directory.rmdir()
 
 
 def create(
@@ -144,10 +320,12 @@ def create(
         ChartMetadata(repo='http://localhost:45010/', chart='nginx', ...)
     """
 
+    from .chart_metadata import ChartMetadata
+
     if exists(repo_name, chart_name):
         raise ValueError(f"chart {repo_name}/{chart_name} already exists")
 
-    chart_path = create_chart_directory(repo_name, chart_name) / "default.nix"
+    chart_path = _new_chart_path(repo_name, chart_name)
 
     if chart_info:
         write_chart_file(chart_path, chart_info)
@@ -163,7 +341,9 @@ def create(
         raise ValueError("either repo_url or chart_info should be specified")
 
     if update_to_latest:
-        with git.staged_file(chart_path):
+        # The flake only sees a new chart file once it's staged
+        new_files = [chart_path] if chart_path.exists() else []
+        with git.staged_files(new_files):
             try:
                 chart_info = update(
                     repo_name,
@@ -180,10 +360,157 @@ def create(
     return chart_info
 
 
+def create_many(
+    repo_name: str,
+    repo_url: str,
+    chart_names: list[str],
+    jobs: int = 4,
+) -> dict[str, ChartMetadata | Exception]:
+    """
+    Create several chart entries from the same repository.
+
+    Chart names can be glob patterns (e.g. "*" or "kube-*"), which are matched
+    against the charts listed in the repository.
+
+    The repository index is fetched once. Every chart is written at its latest
+    version with a placeholder hash, then all hashes are resolved concurrently,
+    running at most `jobs` nix builds at a time. Charts that fail are removed
+    again, their errors are returned instead of metadata.
+
+    Args:
+        repo_name: Repository name (e.g., "bitnami")
+        repo_url: Repository URL
+        chart_names: Names of (or patterns for) the charts to create
+        jobs: Maximum number of concurrent nix builds
+
+    Returns:
+        Created chart metadata or error for every selected chart
+
+    Raises:
+        ValueError: If chart names are patterns and the repository can't be
+            listed
+
+    Examples:
+        >>> create_many("local", "http://localhost:45010/", ["nginx", "podinfo"])
+        {'nginx': ChartMetadata(...), 'podinfo': ChartMetadata(...)}
+    """
+    from .chart_metadata import ChartMetadata
+
+    results: dict[str, ChartMetadata | Exception] = {}
+    placeholders: dict[str, ChartMetadata] = {}
+
+    repo = registry.create(repo_url, repo_name)
+    if any(utils.is_pattern(chart_name) for chart_name in chart_names):
+        available_charts = repo.list_charts()
+        selected: dict[str, None] = {}
+        for pattern in chart_names:
+            if not utils.is_pattern(pattern):
+                selected[pattern] = None
+                continue
+            matches = fnmatch.filter(available_charts, pattern)
+            if not matches:
+                log.warning(f"{repo_name}/{pattern}: no charts match the pattern")
+            selected.update(dict.fromkeys(matches))
+        chart_names = list(selected)
+
+    for chart_name in chart_names:
+        if exists(repo_name, chart_name):
+            results[chart_name] = ValueError(
+                f"chart {repo_name}/{chart_name} already exists"
+            )
+            continue
+        try:
+            available_versions = repo.get_versions(chart_name)
+            if len(available_versions) == 0:
+                raise ValueError(f"No versions available for {repo_name}/{chart_name}.")
+        except Exception as e:
+            results[chart_name] = e
+            continue
+
+        placeholders[chart_name] = ChartMetadata(
+            repo=repo_url,
+            chart=chart_name,
+            version=max(available_versions).version,
+            chartHash=PLACEHOLDER_HASH,
+        )
+        chart_path = _new_chart_path(repo_name, chart_name)
+        write_chart_file(chart_path, placeholders[chart_name])
+
+    chart_paths = [get_chart_path(repo_name, name) for name in placeholders]
+    new_files = [chart_path for chart_path in chart_paths if chart_path.exists()]
+    with git.staged_files(new_files), ThreadPoolExecutor(jobs) as executor:
+        hashes = {
+            chart_name: executor.submit(nix.get_hash, repo_name, chart_name)
+            for chart_name in placeholders
+        }
+        for chart_name, future in hashes.items():
+            chart_path = get_chart_path(repo_name, chart_name)
+            try:
+                chart_info = placeholders[chart_name].model_copy(
+                    update={"chartHash": future.result()}
+                )
+            except Exception as e:
+                results[chart_name] = e
+                if chart_path.exists():
+                    remove_chart_file(chart_path)
+                charts_lock.remove(repo_name, chart_name)
+                continue
+
+            write_chart_file(chart_path, chart_info)
+            results[chart_name] = chart_info
+
+    return {chart_name: results[chart_name] for chart_name in chart_names}
+
+
+def commit(repo_name: str, chart_name: str, message: str) -> None:
+    """
+    Commit changes of a chart, if there are any.
+
+    If the lock file is in use, the commit contains the chart's entry in it
+    (and the removal of the chart's former chart file), leaving other changes
+    of the lock file out (see `git.commit_contents`). A lock file that isn't
+    committed yet is committed as a whole.
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+        message: Commit message
+
+    Examples:
+        >>> commit("local", "nginx", "local/nginx: update to 1.0.1")
+    """
+    chart_path = get_chart_path(repo_name, chart_name)
+    if not charts_lock.enabled():
+        git.add_and_commit(chart_path, message)
+        return
+
+    charts_lock.flush()
+    lock_content = charts_lock.committed_content(repo_name, chart_name)
+    if lock_content is None:
+        lock_content = charts_lock.get_path().read_text()
+    git.commit_contents(
+        message,
+        {
+            charts_lock.LOCK_FILE: lock_content,
+            chart_path.relative_to(Path.cwd()).as_posix(): (
+                chart_path.read_text() if chart_path.exists() else None
+            ),
+        },
+    )
+
+
+def _new_chart_path(repo_name: str, chart_name: str) -> Path:
+    # Charts in the lock file don't get a chart file
+    if charts_lock.enabled():
+        return get_chart_path(repo_name, chart_name)
+    return create_chart_directory(repo_name, chart_name) / "default.nix"
+
+
 def update(
     repo_name: str,
     chart_name: str,
     chart_info: ChartMetadata | None = None,
+    repo: Registry | None = None,
 ) -> ChartMetadata:
     """
     Update a single chart to the latest version.
@@ -192,24 +519,34 @@ def update(
         repo_name: Repository name
         chart_name: Chart name
         chart_info: Current chart metadata
+        repo: Registry of the chart, created from the chart's repository URL if
+            not given
 
     Returns:
         ChartMetadata: The updated chart metadata
     """
+    from .chart_version import ChartVersion
+
+    name = f"{repo_name}/{chart_name}"
     if not chart_info:
-        chart_info = nix.get_chart(repo_name, chart_name)
+        with profiling.phase("metadata", name):
+            chart_info = nix.get_chart(repo_name, chart_name)
 
     repo_url = chart_info.repo
-    current_version = ChartVersion(
-        version=chart_info.version, repo=repo_name, chart=chart_name
-    )
 
-    repo = registry.create(repo_url, repo_name)
-    available_versions = repo.get_versions(chart_name)
+    with profiling.phase("registry", name):
+        if repo is None:
+            repo = registry.create(repo_url, repo_name)
+        available_versions = repo.get_versions(chart_name)
     if len(available_versions) == 0:
         raise ValueError(f"No versions available for {repo_name}/{chart_name}.")
+    history.add("versions", len(available_versions))
 
-    latest_version = max(available_versions)
+    with profiling.phase("versions", name):
+        current_version = ChartVersion(
+            version=chart_info.version, repo=repo_name, chart=chart_name
+        )
+        latest_version = max(available_versions)
 
     if current_version == latest_version:
         return chart_info
@@ -226,8 +563,24 @@ def update(
     placeholder_chart_info = chart_info.model_copy(
         update={"version": latest_version.version, "chartHash": PLACEHOLDER_HASH}
     )
+
+    # A version seen before (e.g. a rollback) or an archive hashed for another
+    # chart doesn't need nix
+    with profiling.phase("hashing", name):
+        _seed_hash_memo()
+        _, known_hash = _memoized_hash(
+            repo, chart_name, placeholder_chart_info, history=True
+        )
+    if known_hash is not None:
+        log.info(f"{repo_name}/{chart_name}: hash of {latest_version} is known")
+        updated_chart_info = placeholder_chart_info.model_copy(
+            update={"chartHash": known_hash}
+        )
+        write_chart_file(chart_path, updated_chart_info)
+        return updated_chart_info
+
     write_chart_file(chart_path, placeholder_chart_info)
-    updated_chart_info = rehash(repo_name, chart_name)
+    updated_chart_info = rehash(repo_name, chart_name, repo=repo)
 
     return updated_chart_info
 
@@ -235,17 +588,21 @@ def update(
 def rehash(
     repo_name: str,
     chart_name: str,
+    repo: Registry | None = None,
 ) -> ChartMetadata:
     """
     Recalculate and update the hash for an existing chart.
 
-    This function triggers a Nix build with a placeholder hash to extract
-    the correct hash from the build output, then updates the chart file
-    with the correct hash value.
+    The hash is looked up by the digest of the upstream archive first (see
+    `helmupdater.hash_memo`). Otherwise, this function triggers a Nix build
+    with a placeholder hash to extract the correct hash from the build output.
+    The chart file is then updated with the correct hash value.
 
     Args:
         repo_name: Repository name
         chart_name: Chart name
+        repo: Registry of the chart, created from the chart's repository URL if
+            not given
 
     Returns:
         ChartMetadata: Updated chart metadata with correct hash
@@ -255,12 +612,112 @@ def rehash(
         ChartMetadata(repo='...', chart='nginx', version='1.0.0', chartHash='sha256-...'
         )
     """
-    current_chart = nix.get_chart(repo_name, chart_name)
-    correct_hash = nix.get_hash(repo_name, chart_name)
+    name = f"{repo_name}/{chart_name}"
+    chart_path = get_chart_path(repo_name, chart_name)
+    with profiling.phase("metadata", name):
+        current_chart = read(repo_name, chart_name)
+    if repo is None:
+        repo = registry.create(current_chart.repo, repo_name)
+
+    with profiling.phase("hashing", name):
+        digest, correct_hash = _memoized_hash(
+            repo, chart_name, current_chart, history=False
+        )
+        if correct_hash is None:
+            with history.timed("hash_seconds"):
+                correct_hash = nix.get_hash(repo_name, chart_name)
+            hash_memo.record(
+                current_chart.repo,
+                current_chart.chart,
+                current_chart.version,
+                digest,
+                correct_hash,
+            )
 
     corrected_chart = current_chart.model_copy(update={"chartHash": correct_hash})
-
-    chart_path = get_chart_path(repo_name, chart_name)
     write_chart_file(chart_path, corrected_chart)
 
     return corrected_chart
+
+
+def _memoized_hash(
+    repo: Registry,
+    chart_name: str,
+    chart_info: ChartMetadata,
+    history: bool,
+) -> tuple[str | None, str | None]:
+    """Get the digest of the chart's archive and its hash, if computed before."""
+    try:
+        digest = repo.get_digest(chart_name, chart_info.version)
+    except Exception as e:
+        log.debug(f"{chart_info.chart}: failed to get archive digest", error=str(e))
+        digest = None
+
+    known_hash = hash_memo.lookup(
+        chart_info.repo, chart_info.chart, chart_info.version, digest, history
+    )
+    if known_hash == PLACEHOLDER_HASH:
+        known_hash = None
+    return digest, known_hash
+
+
+def _seed_hash_memo() -> None:
+    """Remember hashes of chart versions committed since the last scan."""
+    with _seed_lock:
+        head = git.head_commit()
+        since = hash_memo.seeded_commit()
+        if head is None or head == since:
+            return
+        try:
+            contents = git.file_history(CHART_FILES_PATHSPEC, since)
+        except CalledProcessError:
+            # The commit scanned last is gone (e.g. history was rewritten)
+            contents = git.file_history(CHART_FILES_PATHSPEC)
+        charts = [info for info in map(parse_chart_file, contents) if info is not None]
+        hash_memo.seed(head, charts)
+
+
+def verify_many(
+    charts: list[tuple[str, str]],
+    eval_jobs: int = 4,
+    fetch_jobs: int = 8,
+) -> dict[tuple[str, str], str | None | Exception]:
+    """
+    Check stored hashes of several charts against their upstream archives.
+
+    Every chart goes through two steps: evaluating its derivation (bound by nix
+    evaluation, at most `eval_jobs` at a time) and downloading the archive again
+    to compare hashes (bound by the network, at most `fetch_jobs` at a time).
+    Charts in different steps run concurrently.
+
+    Args:
+        charts: List of (repo_name, chart_name) tuples
+        eval_jobs: Maximum number of concurrent nix evaluations
+        fetch_jobs: Maximum number of concurrent downloads
+
+    Returns:
+        For every chart: None if the stored hash matches, the actual hash if it
+        doesn't, or the error that prevented the check
+
+    Examples:
+        >>> verify_many([("local", "nginx")])
+        {('local', 'nginx'): None}
+    """
+    eval_slots = threading.Semaphore(eval_jobs)
+    fetch_slots = threading.Semaphore(fetch_jobs)
+
+    def verify(repo_name: str, chart_name: str) -> str | None:
+        with eval_slots:
+            drv_path = nix.get_derivation_path(repo_name, chart_name)
+        with fetch_slots:
+            return nix.check_derivation(drv_path)
+
+    results: dict[tuple[str, str], str | None | Exception] = {}
+    with ThreadPoolExecutor(eval_jobs + fetch_jobs) as executor:
+        futures = {chart: executor.submit(verify, *chart) for chart in charts}
+        for chart, future in futures.items():
+            try:
+                results[chart] = future.result()
+            except Exception as e:
+                results[chart] = e
+    return results
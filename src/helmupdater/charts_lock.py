@@ -0,0 +1,365 @@
+"""Metadata of all charts in a single sorted lock file."""
+
+# Chart models pull in pydantic, import them only when used
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections.abc import Iterable
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from helmupdater import git, locks, utils
+
+if TYPE_CHECKING:
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+LOCK_FILE = "charts.lock.json"
+
+FORMAT_VERSION = 1
+
+# Fields of a chart entry, as in the chart files
+_FIELDS = ("repo", "chart", "version", "chartHash")
+
+Entries = dict[str, dict[str, dict[str, str]]]
+
+_lock = threading.RLock()
+# Entries as read from the file, with changes of this process applied
+_entries: Entries | None = None
+# (path, mtime, size) of the file the entries were read from
+_stat: tuple[str, int, int] | None = None
+# Entries changed by this process and not written yet, None for removed ones
+_changed: dict[tuple[str, str], dict[str, str] | None] = {}
+_deferred = 0
+
+
+class ConflictError(ValueError):
+    """Charts are in the lock file and have a chart file as well."""
+
+    def __init__(self, charts: Iterable[tuple[str, str]]) -> None:
+        names = ", ".join(
+            f"{repo_name}/{chart_name}" for repo_name, chart_name in charts
+        )
+        super().__init__(
+            f"{names}: defined both in {LOCK_FILE} and in a chart file, "
+            f"run `helmupdater lock` to move the chart file into {LOCK_FILE}"
+        )
+
+
+def get_path() -> Path:
+    """
+    Get path to the lock file.
+
+    Returns:
+        Path to charts.lock.json in the repository root
+    """
+    return Path.cwd() / LOCK_FILE
+
+
+def enabled() -> bool:
+    """
+    Check if the lock file is in use.
+
+    The lock file is opt-in: charts are only kept in it once it exists (see
+    `write`). From then on it is the only source of the charts it has, they
+    don't have chart files.
+
+    Returns:
+        True if the lock file exists or is about to be written
+
+    Raises:
+        ValueError: If the lock file can't be used (see `load`)
+    """
+    with _lock:
+        return bool(_changed) or load() is not None
+
+
+def load() -> Entries | None:
+    """
+    Read chart entries from the lock file.
+
+    The file is read once and kept in memory, it is read again if it changed on
+    disk since (e.g. by `git checkout` or another process). Changes not written
+    yet are applied on top.
+
+    Returns:
+        Nested dict {repo_name: {chart_name: {field: value}}}, or None if there
+        is no lock file
+
+    Raises:
+        ValueError: If the lock file isn't tracked by git, so the flake doesn't
+            see it, or has an unknown format version
+    """
+    global _entries, _stat
+    with _lock:
+        path = get_path()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _entries = _stat = None
+            return None
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        if _entries is None or _stat != key:
+            if not git.is_tracked(path):
+                raise ValueError(
+                    f"{LOCK_FILE} isn't tracked by git, so the flake ignores it, "
+                    f"`git add` or remove it"
+                )
+            _entries = _apply(parse(path.read_text()), _changed)
+            _stat = key
+        return _entries
+
+
+def get(repo_name: str, chart_name: str) -> ChartMetadata | None:
+    """
+    Get metadata of a chart from the lock file.
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+
+    Returns:
+        Chart metadata, or None if there is no lock file or the chart isn't in it
+
+    Raises:
+        ConflictError: If the chart has a chart file as well
+    """
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+    entries = load()
+    entry = (entries or {}).get(repo_name, {}).get(chart_name)
+    if entry is None:
+        return None
+    if (Path.cwd() / "charts" / repo_name / chart_name / "default.nix").exists():
+        raise ConflictError([(repo_name, chart_name)])
+    return ChartMetadata(**entry)
+
+
+def put(repo_name: str, chart_name: str, chart_info: ChartMetadata) -> None:
+    """
+    Store metadata of a chart in the lock file, if it's in use.
+
+    The file is rewritten atomically, unless writes are deferred (see
+    `deferred`).
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+        chart_info: New metadata of the chart
+    """
+    with _lock:
+        entries = load()
+        if entries is None:
+            return
+        _changed[repo_name, chart_name] = _entry(chart_info)
+        _apply(entries, {(repo_name, chart_name): _changed[repo_name, chart_name]})
+        if not _deferred:
+            flush()
+
+
+def remove(repo_name: str, chart_name: str) -> None:
+    """
+    Remove a chart from the lock file, if it's there.
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+    """
+    with _lock:
+        entries = load()
+        if entries is None or chart_name not in entries.get(repo_name, {}):
+            return
+        _changed[repo_name, chart_name] = None
+        _apply(entries, {(repo_name, chart_name): None})
+        if not _deferred:
+            flush()
+
+
+def write(entries: Entries) -> None:
+    """
+    Replace all entries of the lock file, creating it if needed.
+
+    Args:
+        entries: Nested dict {repo_name: {chart_name: {field: value}}}
+    """
+    with _lock, locks.lock_file_lock():
+        _changed.clear()
+        _write(
+            {repo_name: dict(repo_charts) for repo_name, repo_charts in entries.items()}
+        )
+
+
+def flush() -> None:
+    """
+    Write pending changes to the lock file, if any.
+
+    The file is read again under a lock (see `helmupdater.locks`), and only the
+    entries changed by this process are replaced, so processes updating
+    different charts at the same time keep each other's changes.
+    """
+    with _lock:
+        if not _changed:
+            return
+        with locks.lock_file_lock():
+            path = get_path()
+            # Changes only apply to an existing lock file, see `enabled`
+            if path.exists():
+                _write(_apply(parse(path.read_text()), _changed))
+            _changed.clear()
+
+
+def _write(entries: Entries) -> None:
+    global _entries, _stat
+    path = get_path()
+    utils.write_atomic(path, render(entries))
+    stat = os.stat(path)
+    _entries = entries
+    _stat = (str(path), stat.st_mtime_ns, stat.st_size)
+
+
+@contextmanager
+def deferred():
+    """
+    Keep changes to the lock file in memory until the end of the block.
+
+    Changes are still written before anything evaluates the charts (see
+    `helmupdater.nix`) and when a chart is committed, so that the working tree
+    never lags behind HEAD. A run that needs neither (e.g. all hashes are
+    known) rewrites the file once, at the end.
+
+    Examples:
+        >>> with deferred():
+        ...     put("local", "nginx", chart_info)
+        ...     put("local", "podinfo", chart_info)
+    """
+    global _deferred
+    with _lock:
+        _deferred += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _deferred -= 1
+            if not _deferred:
+                flush()
+
+
+def parse(content: str) -> Entries:
+    """
+    Parse the content of a lock file.
+
+    Args:
+        content: Content of charts.lock.json
+
+    Returns:
+        Nested dict {repo_name: {chart_name: {field: value}}}
+
+    Raises:
+        ValueError: If the file has an unknown format version
+    """
+    data = json.loads(content)
+    if data.get("version") != FORMAT_VERSION:
+        raise ValueError(
+            f"{LOCK_FILE} has format version {data.get('version')}, "
+            f"expected {FORMAT_VERSION}"
+        )
+    return data["charts"]
+
+
+def render(entries: Entries) -> str:
+    """
+    Render a lock file, sorted by repository and chart.
+
+    Every field is on its own line, so updating a chart changes two lines and
+    concurrent changes to different charts merge cleanly.
+
+    Args:
+        entries: Nested dict {repo_name: {chart_name: {field: value}}}
+
+    Returns:
+        Content of charts.lock.json
+
+    Examples:
+        >>> print(render({"local": {"nginx": {"repo": "...", "chart": "nginx", ...}}}))
+        {
+          "charts": {
+            "local": {
+              "nginx": {
+                "chart": "nginx",
+                ...
+    """
+    data = {"charts": entries, "version": FORMAT_VERSION}
+    return json.dumps(data, indent=2, sort_keys=True) + "\n"
+
+
+def committed_content(repo_name: str, chart_name: str) -> str | None:
+    """
+    Get the lock file as committed, with one chart's entry as it is now.
+
+    Committing this content records the change of a single chart, leaving
+    changes of other charts made by the same run out of the commit.
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+
+    Returns:
+        Content of charts.lock.json, or None if it isn't committed yet
+    """
+    committed = git.show_file(LOCK_FILE)
+    if committed is None:
+        return None
+    entries = parse(committed)
+    with _lock:
+        entry = ((load() or {}).get(repo_name) or {}).get(chart_name)
+    repo_entries = entries.setdefault(repo_name, {})
+    if entry is None:
+        repo_entries.pop(chart_name, None)
+        if not repo_entries:
+            del entries[repo_name]
+    else:
+        repo_entries[chart_name] = dict(entry)
+    return render(entries)
+
+
+def changed_since(ref: str) -> list[tuple[str, str]]:
+    """
+    List charts added or modified in the lock file since a commit.
+
+    Args:
+        ref: Git ref to compare the working tree against
+
+    Returns:
+        List of (repo_name, chart_name) tuples, sorted
+    """
+    current = load()
+    if current is None:
+        return []
+    content = git.show_file(LOCK_FILE, ref)
+    previous = parse(content) if content is not None else {}
+    return [
+        (repo_name, chart_name)
+        for repo_name, repo_charts in sorted(current.items())
+        for chart_name, entry in sorted(repo_charts.items())
+        if previous.get(repo_name, {}).get(chart_name) != entry
+    ]
+
+
+def _apply(
+    entries: Entries, changes: dict[tuple[str, str], dict[str, str] | None]
+) -> Entries:
+    for (repo_name, chart_name), entry in changes.items():
+        repo_entries = entries.setdefault(repo_name, {})
+        if entry is None:
+            repo_entries.pop(chart_name, None)
+        else:
+            repo_entries[chart_name] = entry
+        if not repo_entries:
+            del entries[repo_name]
+    return entries
+
+
+def _entry(chart_info: ChartMetadata) -> dict[str, str]:
+    return {field: getattr(chart_info, field) for field in _FIELDS}
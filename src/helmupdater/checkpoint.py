@@ -0,0 +1,128 @@
+"""Checkpoint of per-chart outcomes for resumable update runs."""
+
+from __future__ import annotations
+
+import signal
+import threading
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Literal
+
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+
+from helmupdater.utils import write_atomic
+
+
+class ChartOutcome(BaseModel):
+    """Outcome of processing a chart in an update run."""
+
+    status: Literal["done", "failed", "skipped"]
+    """done: chart was checked (and updated if needed), failed: update raised an
+    error, skipped: chart was not due for a check"""
+
+    version: str | None = None
+    """Version the chart was resolved to (done only)"""
+
+    chartHash: str | None = None
+    """Hash of the resolved version (done only)"""
+
+    error: str | None = None
+    """Error message (failed only)"""
+
+    model_config = ConfigDict(frozen=True)
+
+
+_OUTCOMES = TypeAdapter(dict[str, ChartOutcome])
+
+# Outcomes recorded between two writes of the checkpoint file
+SAVE_INTERVAL = 20
+
+
+class Checkpoint:
+    """
+    Per-chart outcomes of an update run, persisted in batches.
+
+    A run that gets interrupted can be resumed from the same checkpoint file:
+    charts that already have an outcome are not processed again. The file is
+    written every `SAVE_INTERVAL` outcomes and when the run ends (see
+    `saved`), so a run that is killed outright checks at most that many charts
+    again.
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        """
+        Load the checkpoint, or start an empty one if the file doesn't exist.
+
+        Args:
+            path: Path to the checkpoint file
+        """
+        self.path = Path(path)
+        self.outcomes: dict[str, ChartOutcome] = {}
+        self._unsaved = 0
+        if self.path.exists():
+            self.outcomes = _OUTCOMES.validate_json(self.path.read_text())
+
+    def get(self, repo_name: str, chart_name: str) -> ChartOutcome | None:
+        """
+        Get the recorded outcome of a chart.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+
+        Returns:
+            ChartOutcome, or None if the chart wasn't processed yet
+        """
+        return self.outcomes.get(f"{repo_name}/{chart_name}")
+
+    def record(self, repo_name: str, chart_name: str, outcome: ChartOutcome) -> None:
+        """
+        Record the outcome of a chart, saving the checkpoint every
+        `SAVE_INTERVAL` outcomes.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+            outcome: Outcome to record
+        """
+        self.outcomes[f"{repo_name}/{chart_name}"] = outcome
+        self._unsaved += 1
+        if self._unsaved >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        """Write the checkpoint file atomically."""
+        write_atomic(
+            self.path,
+            _OUTCOMES.dump_json(self.outcomes, indent=2, exclude_none=True).decode(),
+        )
+        self._unsaved = 0
+
+    @contextmanager
+    def saved(self) -> Generator[Checkpoint]:
+        """
+        Save the checkpoint when the block ends, however it ends.
+
+        SIGTERM (e.g. a CI job being cancelled) exits the block too, instead of
+        killing the process before the outcomes are written.
+
+        Examples:
+            >>> with Checkpoint("update-all.json").saved() as progress:
+            ...     progress.record("local", "nginx", ChartOutcome(status="skipped"))
+        """
+        # Signal handlers can only be set on the main thread
+        main_thread = threading.current_thread() is threading.main_thread()
+        if main_thread:
+            handler = signal.signal(signal.SIGTERM, _exit_on_signal)
+        try:
+            yield self
+        finally:
+            if main_thread:
+                signal.signal(signal.SIGTERM, handler or signal.SIG_DFL)
+            if self._unsaved:
+                self.save()
+
+
+def _exit_on_signal(signum: int, frame: object) -> None:
+    raise SystemExit(128 + signum)
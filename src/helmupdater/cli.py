@@ -1,25 +1,115 @@
 """Command-line interface for helmupdater."""
 
+from __future__ import annotations
+
+import contextlib
 import logging
-from typing import Annotated
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Annotated
 
 import typer
 
-from helmupdater import chart, git, nix, utils
-from helmupdater.logging import configure_logging, get_logger
+from helmupdater import (
+    batch,
+    chart,
+    charts_lock,
+    git,
+    hash_memo,
+    history,
+    locks,
+    metrics,
+    nix,
+    profiling,
+    schedule,
+    utils,
+)
+from helmupdater.logging import LogFormat, configure_logging, event, get_logger
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from helmupdater.chart import ChartMetadata
+    from helmupdater.checkpoint import Checkpoint
 
 log = get_logger()
 app = typer.Typer(add_completion=False)
 
 
+def _positive(value: float | None) -> float | None:
+    if value is not None and not value > 0:
+        raise typer.BadParameter(f"{value} is not greater than 0")
+    return value
+
+
 @app.callback()
 def main(
+    ctx: typer.Context,
     verbose: Annotated[
         bool, typer.Option("--verbose", "-v", help="Enable debug logging")
     ] = False,
+    log_format: Annotated[
+        LogFormat,
+        typer.Option(help="Format of log lines, json adds events marking progress"),
+    ] = LogFormat.CONSOLE,
+    nix_engine: Annotated[
+        nix.Engine | None,
+        typer.Option(help="How to evaluate charts [env: HELMUPDATER_NIX_ENGINE]"),
+    ] = None,
+    host_concurrency: Annotated[
+        int | None,
+        typer.Option(
+            min=1,
+            help="Maximum concurrent requests per registry host "
+            "[env: HELMUPDATER_HOST_CONCURRENCY]",
+        ),
+    ] = None,
+    host_rate: Annotated[
+        float | None,
+        typer.Option(
+            callback=_positive,
+            help="Maximum requests per second per registry host "
+            "[env: HELMUPDATER_HOST_RATE]",
+        ),
+    ] = None,
+    profile: Annotated[
+        Path | None,
+        typer.Option(
+            help="Write CPU and memory profiles of every phase of every chart "
+            "to a directory"
+        ),
+    ] = None,
+    metrics_file: Annotated[
+        Path | None,
+        typer.Option(
+            help="Write metrics of the run to a file in the Prometheus text format"
+        ),
+    ] = None,
 ) -> None:
     """Helmupdater - Helm chart version management for Nix."""
-    configure_logging(level=logging.DEBUG if verbose else None)
+    configure_logging(level=logging.DEBUG if verbose else None, log_format=log_format)
+    ctx.with_resource(charts_lock.deferred())
+    if profile is not None:
+        profiling.start(profile)
+        ctx.call_on_close(profiling.stop)
+    if metrics_file is not None:
+        metrics.start(metrics_file)
+        ctx.call_on_close(metrics.stop)
+    if nix_engine is not None:
+        nix.engine = nix_engine
+    # Limits from the environment and the lock file are checked here, before
+    # any command uses them
+    try:
+        from helmupdater.registry.ratelimit import scheduler
+
+        charts_lock.load()
+    except ValueError as e:
+        log.error(str(e))
+        raise typer.Exit(1) from e
+    if host_concurrency is not None:
+        scheduler.concurrency = host_concurrency
+    if host_rate is not None:
+        scheduler.rate = host_rate
 
 
 @app.command()
@@ -38,126 +128,750 @@ def init(
     """
     repo_name, chart_name = utils.parse_chart_name(name)
 
-    if chart.exists(repo_name, chart_name):
-        log.error(f"{repo_name}/{chart_name}: chart already exists")
+    with locks.chart_lock(repo_name, chart_name):
+        if chart.exists(repo_name, chart_name):
+            log.error(f"{repo_name}/{chart_name}: chart already exists")
+            raise typer.Exit(1)
+
+        chart_info = chart.create(repo_name, chart_name, repo_url)
+
+        if commit:
+            chart.commit(
+                repo_name,
+                chart_name,
+                f"{repo_name}/{chart_name}: init at {chart_info.version}",
+            )
+
+
+@app.command()
+def init_many(
+    repo_url: str,
+    names: Annotated[list[str] | None, typer.Argument()] = None,
+    file: Annotated[Path | None, typer.Option()] = None,
+    commit: bool = typer.Option(False),
+    jobs: int = typer.Option(4),
+) -> None:
+    """
+    Initialize several charts from the same repository.
+
+    Charts are selected by names in format "repo/chart", where the chart part
+    can be a glob pattern matched against the repository index (e.g. "repo/*"),
+    and/or by a file with one name per line.
+
+    Args:
+        repo_url: URL of the Helm repository
+        names: Chart names or patterns in format "repo/chart"
+        file: Path to a file with chart names, one per line
+        commit: Whether to create a git commit for every chart
+        jobs: Maximum number of concurrent nix builds
+    """
+    selectors = list(names or [])
+    if file is not None:
+        selectors += [
+            line.strip() for line in file.read_text().splitlines() if line.strip()
+        ]
+    if not selectors:
+        log.error("no charts specified")
         raise typer.Exit(1)
 
-    chart_info = chart.create(repo_name, chart_name, repo_url)
+    parsed = [utils.parse_chart_name(selector) for selector in selectors]
+    repo_names = {repo_name for repo_name, _ in parsed}
+    if len(repo_names) != 1:
+        log.error("all charts should belong to the same repository")
+        raise typer.Exit(1)
+    repo_name = repo_names.pop()
 
-    if commit:
-        git.add_and_commit(
-            chart.get_chart_path(repo_name, chart_name),
-            f"{repo_name}/{chart_name}: init at {chart_info.version}",
+    try:
+        results = chart.create_many(
+            repo_name, repo_url, [chart_name for _, chart_name in parsed], jobs=jobs
         )
+    except ValueError as e:
+        log.error(str(e))
+        raise typer.Exit(1) from e
+
+    failed = 0
+    for chart_name, result in results.items():
+        if isinstance(result, Exception):
+            failed += 1
+            log.error(f"{repo_name}/{chart_name}: failed to init", error=str(result))
+            continue
+
+        log.info(f"{repo_name}/{chart_name}: init at {result.version}")
+        if commit:
+            chart.commit(
+                repo_name,
+                chart_name,
+                f"{repo_name}/{chart_name}: init at {result.version}",
+            )
+
+    if failed:
+        raise typer.Exit(1)
 
 
 @app.command()
 def update(
-    name: str,
+    names: Annotated[list[str], typer.Argument()],
     commit: bool = typer.Option(False),
     build: bool = typer.Option(False),
+    jobs: int = typer.Option(4),
 ) -> None:
     """
-    Update an existing chart version to latest.
+    Update existing charts to their latest versions.
+
+    Charts are selected by names in format "repo/chart", glob patterns (e.g.
+    "bitnami/*", "*/postgres*") or regular expressions prefixed with "re:"
+    (see `batch.select`). Selected charts are checked concurrently, sharing
+    registries, and built in a single nix invocation.
 
     Args:
-        name: Chart name in format "repo/chart"
-        commit: Whether to create a git commit
-        build: Whether to build a derivation with nix
+        names: Chart names or selectors
+        commit: Whether to create a git commit for every chart
+        build: Whether to build derivations with nix
+        jobs: Maximum number of charts checked at a time
     """
-
-    repo_name, chart_name = utils.parse_chart_name(name)
-    chart_info = chart.update(
-        repo_name,
-        chart_name,
-    )
-    if build:
-        nix.build_chart(repo_name, chart_name)
-    if commit:
-        git.add_and_commit(
-            chart.get_chart_path(repo_name, chart_name),
-            f"{repo_name}/{chart_name}: update to {chart_info.version}",
+    charts = _resolve(names)
+    run = batch.Batch("update", jobs)
+    try:
+        results = run.run(
+            charts,
+            lambda repo_name, chart_name, chart_info: chart.update(
+                repo_name,
+                chart_name,
+                chart_info=chart_info,
+                repo=run.registry(chart_info.repo, repo_name),
+            ),
         )
+    finally:
+        run.close()
+    _finish_batch(
+        results,
+        commit,
+        build,
+        jobs,
+        action="update",
+        message=lambda chart_info: f"update to {chart_info.version}",
+    )
 
 
 @app.command()
 def update_all(
+    ctx: typer.Context,
     commit: bool = typer.Option(False),
     build: bool = typer.Option(False),
+    check_all: bool = typer.Option(False, "--all"),
+    time_budget: float | None = typer.Option(None),
+    checkpoint: Annotated[Path | None, typer.Option()] = None,
 ) -> None:
     """
     Update all existing charts versions to latest.
 
-    This sequentially updates every chart. If an error occurs while updating a chart,
-    specific chart is skipped.
+    This sequentially updates every chart that is due for a check. Charts are
+    checked more or less often depending on how often they were released in the
+    past (see `helmupdater.schedule`), and the most likely to change go first.
+    If an error occurs while updating a chart, specific chart is skipped. Charts
+    being updated by another helmupdater process in the same checkout are
+    skipped as well, so several processes can share the work.
+
+    Charts that keep failing or are missing upstream are skipped for a growing
+    period (see `schedule.NegativeCache`), unless --all is given. Once a registry
+    host fails several requests in a row, the rest of its charts are skipped.
+    Skipped charts are listed in the summary at the end of the run.
+
+    With --checkpoint, the outcome of every chart is recorded in a file, written
+    in batches and when the run ends (also on SIGTERM). Running the command again
+    with the same file resumes the run: charts with a recorded outcome are not
+    checked again, and resolved versions that are missing from the tree are
+    re-applied with the recorded hash.
 
     Args:
+        ctx: Typer context, keeping the checkpoint until the command ends
         commit: Whether to create a git commit
         build: Whether to build a derivation with nix
+        check_all: Whether to check every chart regardless of the schedule
+        time_budget: Stop starting new charts after this many seconds
+        checkpoint: Path to a checkpoint file to record outcomes in
     """
 
-    charts = nix.get_charts()
-    for repo_name, repo_charts in charts.items():
-        for chart_name, current_chart_info in repo_charts.items():
+    from helmupdater.checkpoint import ChartOutcome, Checkpoint
+    from helmupdater.registry import ChartNotFoundError
+    from helmupdater.registry.ratelimit import HostUnavailableError
+
+    started = time.monotonic()
+    with profiling.phase("metadata"):
+        charts = _get_charts()
+    scheduler = schedule.Scheduler()
+    failures = schedule.NegativeCache()
+    progress = ctx.with_resource(Checkpoint(checkpoint).saved()) if checkpoint else None
+    run_history = ctx.with_resource(
+        contextlib.closing(history.RunHistory("update-all"))
+    )
+
+    if progress is None or not progress.outcomes:
+        due_charts = scheduler.plan(charts, check_all=check_all)
+        due = set(due_charts)
+        not_due = [
+            (repo_name, chart_name, chart_info)
+            for repo_name, repo_charts in charts.items()
+            for chart_name, chart_info in repo_charts.items()
+            if (repo_name, chart_name) not in due
+        ]
+        run_history.skip(
+            [
+                (repo_name, chart_name, chart_info.repo, chart_info.version)
+                for repo_name, chart_name, chart_info in not_due
+            ],
+            "not due for a check",
+        )
+        if progress is not None:
+            for repo_name, chart_name, _ in not_due:
+                progress.record(repo_name, chart_name, ChartOutcome(status="skipped"))
+    else:
+        _reapply_checkpoint(progress, charts, commit=commit, build=build)
+        due_charts = [
+            (repo_name, chart_name)
+            for repo_name, chart_name in scheduler.plan(charts, check_all=True)
+            if progress.get(repo_name, chart_name) is None
+        ]
+
+    # Reasons for not checking due charts, reported in the summary
+    skipped: dict[str, str] = {}
+    if not check_all:
+        for repo_name, chart_name in due_charts:
+            until = failures.skipped_until(repo_name, chart_name)
+            if until is None:
+                continue
+            reason = (
+                f"failing until {time.strftime('%Y-%m-%d', time.gmtime(until))}: "
+                f"{failures.error(repo_name, chart_name)}"
+            )
+            skipped[f"{repo_name}/{chart_name}"] = reason
+            chart_info = charts[repo_name][chart_name]
+            run_history.skip(
+                [(repo_name, chart_name, chart_info.repo, chart_info.version)], reason
+            )
+            if progress is not None:
+                progress.record(repo_name, chart_name, ChartOutcome(status="skipped"))
+        due_charts = [c for c in due_charts if f"{c[0]}/{c[1]}" not in skipped]
+
+    log.info(
+        f"{len(due_charts)} of {sum(len(c) for c in charts.values())} "
+        "charts are due for a check"
+    )
+
+    updated = []
+    failed = []
+    checked = 0
+    try:
+        for index, (repo_name, chart_name) in enumerate(due_charts):
+            if time_budget is not None and time.monotonic() - started >= time_budget:
+                log.warning(
+                    "time budget exhausted, "
+                    f"{len(due_charts) - index} chart(s) left unchecked"
+                )
+                break
+
             log.info(f"{repo_name}/{chart_name}: checking for updates")
+            chart_info = charts[repo_name][chart_name]
+            record = run_history.chart(
+                repo_name, chart_name, chart_info.repo, chart_info.version
+            )
 
             try:
-                new_chart_info = chart.update(
-                    repo_name,
-                    chart_name,
-                    chart_info=current_chart_info,
+                with (
+                    locks.chart_lock(repo_name, chart_name, blocking=False),
+                    record as chart_record,
+                ):
+                    checked += 1
+                    try:
+                        new_chart_info = chart.update(
+                            repo_name,
+                            chart_name,
+                            chart_info=chart_info,
+                        )
+                        _finish_update(
+                            repo_name, chart_name, new_chart_info, commit, build
+                        )
+                    except Exception as e:
+                        chart_record.error = str(e)
+                        # The summary lists charts of unavailable hosts as skipped
+                        if isinstance(e, HostUnavailableError):
+                            chart_record.outcome = "skipped"
+                        raise
+                    chart_record.resolve(new_chart_info.version)
+                scheduler.mark_checked(repo_name, chart_name)
+                failures.record_success(repo_name, chart_name)
+                if new_chart_info.version != chart_info.version:
+                    updated.append(f"{repo_name}/{chart_name}")
+                outcome = ChartOutcome(
+                    status="done",
+                    version=new_chart_info.version,
+                    chartHash=new_chart_info.chartHash,
                 )
 
-                if build:
-                    nix.build_chart(repo_name, chart_name)
-                if commit:
-                    git.add_and_commit(
-                        chart.get_chart_path(repo_name, chart_name),
-                        f"{repo_name}/{chart_name}: update to {new_chart_info.version}",
-                    )
+            except locks.LockedError:
+                reason = "locked by another process"
+                skipped[f"{repo_name}/{chart_name}"] = reason
+                run_history.skip(
+                    [(repo_name, chart_name, chart_info.repo, chart_info.version)],
+                    reason,
+                )
+                continue
+
+            except HostUnavailableError as e:
+                skipped[f"{repo_name}/{chart_name}"] = str(e)
+                outcome = ChartOutcome(status="failed", error=str(e))
 
             except Exception as e:
                 log.error(
                     f"{repo_name}/{chart_name}: failed to update chart",
                     error=str(e),
                 )
+                failed.append(f"{repo_name}/{chart_name}")
+                # Connection errors and timeouts are the host's problem, the
+                # circuit breaker takes care of those.
+                if not isinstance(e, OSError):
+                    failures.record_failure(
+                        repo_name,
+                        chart_name,
+                        str(e),
+                        missing=isinstance(e, ChartNotFoundError),
+                    )
+                outcome = ChartOutcome(status="failed", error=str(e))
+
+            if progress is not None:
+                progress.record(repo_name, chart_name, outcome)
+    finally:
+        for result, count in [
+            ("checked", checked),
+            ("updated", len(updated)),
+            ("failed", len(failed)),
+            ("skipped", len(skipped)),
+        ]:
+            metrics.inc("charts", count, result=result)
+        scheduler.save()
+        failures.save()
+        _log_summary(updated, failed, skipped)
+        event(
+            "run.finished",
+            command="update-all",
+            checked=checked,
+            updated=len(updated),
+            failed=len(failed),
+            skipped=len(skipped),
+            seconds=time.monotonic() - started,
+        )
+
+
+def _log_summary(
+    updated: list[str], failed: list[str], skipped: dict[str, str]
+) -> None:
+    for name, reason in sorted(skipped.items()):
+        log.info(f"{name}: skipped, {reason}")
+        repo_name, chart_name = utils.parse_chart_name(name)
+        event("chart.skipped", repo=repo_name, chart=chart_name, reason=reason)
+    log.info(
+        f"{len(updated)} chart(s) updated, {len(failed)} failed, "
+        f"{len(skipped)} skipped",
+        updated=updated,
+        failed=failed,
+    )
+
+
+def _finish_update(
+    repo_name: str,
+    chart_name: str,
+    chart_info: ChartMetadata,
+    commit: bool,
+    build: bool,
+) -> None:
+    if build:
+        with history.timed("build_seconds"):
+            nix.build_chart(repo_name, chart_name)
+    if commit:
+        with profiling.phase("git", f"{repo_name}/{chart_name}"):
+            chart.commit(
+                repo_name,
+                chart_name,
+                f"{repo_name}/{chart_name}: update to {chart_info.version}",
+            )
+
+
+def _resolve(names: list[str]) -> dict[tuple[str, str], ChartMetadata]:
+    try:
+        return batch.resolve(names)
+    except ValueError as e:
+        log.error(str(e))
+        raise typer.Exit(1) from e
+
+
+def _get_charts() -> dict[str, dict[str, ChartMetadata]]:
+    try:
+        return nix.get_charts()
+    except charts_lock.ConflictError as e:
+        log.error(str(e))
+        raise typer.Exit(1) from e
+
+
+def _finish_batch(
+    results: dict[tuple[str, str], ChartMetadata | Exception],
+    commit: bool,
+    build: bool,
+    jobs: int,
+    action: str,
+    message: Callable[[ChartMetadata], str],
+) -> None:
+    for (repo_name, chart_name), result in results.items():
+        if isinstance(result, Exception):
+            log.error(
+                f"{repo_name}/{chart_name}: failed to {action}", error=str(result)
+            )
+    done = {
+        key: result
+        for key, result in results.items()
+        if not isinstance(result, Exception)
+    }
+
+    if build and done:
+        built = nix.build_charts(list(done), max_jobs=jobs)
+        for repo_name, chart_name in [key for key in done if not built[key]]:
+            log.error(f"{repo_name}/{chart_name}: build failed")
+        done = {key: result for key, result in done.items() if built[key]}
+
+    if commit:
+        for (repo_name, chart_name), result in done.items():
+            with profiling.phase("git", f"{repo_name}/{chart_name}"):
+                chart.commit(
+                    repo_name,
+                    chart_name,
+                    f"{repo_name}/{chart_name}: {message(result)}",
+                )
+
+    if len(done) < len(results):
+        raise typer.Exit(1)
+
+
+def _reapply_checkpoint(
+    progress: Checkpoint,
+    charts: dict[str, dict[str, ChartMetadata]],
+    commit: bool,
+    build: bool,
+) -> None:
+    # A previous run may have resolved a chart without its change surviving
+    # (e.g. the job was killed before pushing). Write the recorded version and
+    # hash back instead of resolving the chart again.
+    for repo_name, repo_charts in charts.items():
+        for chart_name, chart_info in repo_charts.items():
+            outcome = progress.get(repo_name, chart_name)
+            if (
+                outcome is None
+                or outcome.status != "done"
+                or outcome.version is None
+                or outcome.chartHash is None
+                or (outcome.version, outcome.chartHash)
+                == (chart_info.version, chart_info.chartHash)
+            ):
+                continue
+
+            log.info(
+                f"{repo_name}/{chart_name}: re-applying {outcome.version} "
+                "from checkpoint"
+            )
+            new_chart_info = chart_info.model_copy(
+                update={"version": outcome.version, "chartHash": outcome.chartHash}
+            )
+            with locks.chart_lock(repo_name, chart_name):
+                chart.write_chart_file(
+                    chart.get_chart_path(repo_name, chart_name), new_chart_info
+                )
+                _finish_update(repo_name, chart_name, new_chart_info, commit, build)
+
+
+@app.command()
+def verify_all(
+    fix: bool = typer.Option(False),
+    commit: bool = typer.Option(False),
+    eval_jobs: int = typer.Option(4),
+    fetch_jobs: int = typer.Option(8),
+    report: Annotated[Path | None, typer.Option()] = None,
+) -> None:
+    """
+    Check hashes of all charts against their upstream archives.
+
+    Detects charts that were re-published upstream without a version change, which
+    breaks the fixed-output hash. With --fix, the hashes of such charts are
+    updated, as `rehash` would do.
+
+    Args:
+        fix: Whether to update mismatched hashes
+        commit: Whether to create a git commit for every fixed chart
+        eval_jobs: Maximum number of concurrent nix evaluations
+        fetch_jobs: Maximum number of concurrent chart downloads
+        report: Path to write a JSON report of mismatches and errors to
+    """
+    import json
+
+    charts = _get_charts()
+    selected = [
+        (repo_name, chart_name)
+        for repo_name, repo_charts in charts.items()
+        for chart_name in repo_charts
+    ]
+    log.info(f"verifying {len(selected)} charts")
+    results = chart.verify_many(selected, eval_jobs=eval_jobs, fetch_jobs=fetch_jobs)
+
+    mismatches = {}
+    errors = {}
+    for (repo_name, chart_name), result in results.items():
+        chart_info = charts[repo_name][chart_name]
+        if isinstance(result, Exception):
+            errors[f"{repo_name}/{chart_name}"] = str(result)
+            log.error(f"{repo_name}/{chart_name}: failed to verify", error=str(result))
+            continue
+        if result is None:
+            continue
+
+        mismatches[f"{repo_name}/{chart_name}"] = {
+            "version": chart_info.version,
+            "expected": chart_info.chartHash,
+            "actual": result,
+        }
+        log.warning(
+            f"{repo_name}/{chart_name}: hash mismatch at {chart_info.version}",
+            expected=chart_info.chartHash,
+            actual=result,
+        )
+        if fix:
+            # The archive changed, the hash of this version known so far is wrong
+            hash_memo.record(
+                chart_info.repo, chart_info.chart, chart_info.version, None, result
+            )
+            with locks.chart_lock(repo_name, chart_name):
+                chart.write_chart_file(
+                    chart.get_chart_path(repo_name, chart_name),
+                    chart_info.model_copy(update={"chartHash": result}),
+                )
+                if commit:
+                    chart.commit(
+                        repo_name,
+                        chart_name,
+                        f"{repo_name}/{chart_name}: "
+                        f"hash updated at {chart_info.version}",
+                    )
+
+    log.info(
+        f"verified {len(selected)} charts: "
+        f"{len(mismatches)} mismatch(es), {len(errors)} error(s)"
+    )
+    if report is not None:
+        report.write_text(
+            json.dumps({"mismatches": mismatches, "errors": errors}, indent=2)
+        )
+    if (mismatches and not fix) or errors:
+        raise typer.Exit(1)
 
 
 @app.command()
 def rehash(
-    name: str,
+    names: Annotated[list[str], typer.Argument()],
     commit: bool = typer.Option(False),
     build: bool = typer.Option(False),
+    jobs: int = typer.Option(4),
 ) -> None:
     """
-    Update a hash for an existing chart without changing the version.
+    Update hashes of existing charts without changing their versions.
+
+    Charts are selected as by `update`, and hashed concurrently.
 
     Args:
-        name: Chart name in format "repo/chart"
-        commit: Whether to create a git commit
-        build: Whether to build a derivation with nix
+        names: Chart names or selectors
+        commit: Whether to create a git commit for every chart
+        build: Whether to build derivations with nix
+        jobs: Maximum number of charts hashed at a time
+    """
+    charts = _resolve(names)
+    run = batch.Batch("rehash", jobs)
+    try:
+        results = run.run(
+            charts,
+            lambda repo_name, chart_name, chart_info: chart.rehash(
+                repo_name, chart_name, repo=run.registry(chart_info.repo, repo_name)
+            ),
+        )
+    finally:
+        run.close()
+    _finish_batch(
+        results,
+        commit,
+        build,
+        jobs,
+        action="rehash",
+        message=lambda chart_info: f"hash updated at {chart_info.version}",
+    )
+
+
+@app.command()
+def build(
+    names: Annotated[list[str] | None, typer.Argument()] = None,
+    changed_since: str | None = typer.Option(None),
+    max_jobs: int = typer.Option(4),
+) -> None:
     """
+    Build nix derivations of existing charts.
 
-    repo_name, chart_name = utils.parse_chart_name(name)
+    Charts are selected as by `update`. With --changed-since, every chart whose
+    default.nix or entry in the lock file was added or modified since the given
+    git ref is built instead.
+    Several charts are built in a single nix invocation.
 
-    chart_info = chart.rehash(repo_name, chart_name)
-    if build:
-        nix.build_chart(repo_name, chart_name)
+    Args:
+        names: Chart names or selectors
+        changed_since: Git ref to compare charts against
+        max_jobs: Maximum number of derivations built in parallel
+    """
+
+    if (not names) == (changed_since is None):
+        log.error("either chart names or --changed-since should be specified")
+        raise typer.Exit(1)
+
+    if names:
+        if len(names) == 1 and not batch.is_selector(names[0]):
+            repo_name, chart_name = utils.parse_chart_name(names[0])
+            nix.build_chart(repo_name, chart_name)
+            return
+        charts = list(_resolve(names))
+        log.info(f"building {len(charts)} chart(s)")
+    else:
+        assert changed_since is not None
+        changed = [
+            parsed
+            for path in git.changed_files(changed_since)
+            if (parsed := chart.parse_chart_path(path)) is not None
+        ]
+        charts = list(dict.fromkeys(changed + charts_lock.changed_since(changed_since)))
+        if not charts:
+            log.info(f"no charts changed since {changed_since}")
+            return
+        log.info(f"building {len(charts)} chart(s) changed since {changed_since}")
+
+    results = nix.build_charts(charts, max_jobs=max_jobs)
+
+    for (repo_name, chart_name), passed in results.items():
+        if passed:
+            log.info(f"{repo_name}/{chart_name}: build passed")
+        else:
+            log.error(f"{repo_name}/{chart_name}: build failed")
+
+    if not all(results.values()):
+        raise typer.Exit(1)
+
+
+@app.command()
+def lock(
+    check: bool = typer.Option(False),
+    commit: bool = typer.Option(False),
+) -> None:
+    """
+    Write the metadata of all charts to the lock file.
+
+    charts.lock.json holds the metadata of every chart in one sorted file. Once
+    it exists, the flake and helmupdater read charts from it, and helmupdater
+    keeps charts in it instead of in chart files. Chart files (e.g. of charts
+    added by hand) are moved into the lock file and removed.
+
+    Args:
+        check: Only check that all charts are in the lock file and have no chart
+            file, exit with 1 if they aren't
+        commit: Whether to create a git commit
+    """
+    chart_paths = sorted((Path.cwd() / "charts").glob("*/*/default.nix"))
+    entries = chart.lock_entries()
+    if check:
+        if charts_lock.load() != entries or chart_paths:
+            log.error(f"{charts_lock.LOCK_FILE} is out of date, run `helmupdater lock`")
+            raise typer.Exit(1)
+        return
+
+    charts_lock.write(entries)
+    for chart_path in chart_paths:
+        chart.remove_chart_file(chart_path)
+    count = sum(len(repo_charts) for repo_charts in entries.values())
+    log.info(f"{count} chart(s) written to {charts_lock.LOCK_FILE}")
+
+    removed = [path.relative_to(Path.cwd()).as_posix() for path in chart_paths]
+    # The flake only sees the lock file once it's tracked
+    git.add_file(charts_lock.LOCK_FILE)
+    git.remove_files(removed)
     if commit:
-        git.add_and_commit(
-            chart.get_chart_path(repo_name, chart_name),
-            f"{repo_name}/{chart_name}: hash updated at {chart_info.version}",
+        git.commit_contents(
+            "charts.lock.json: update",
+            {
+                charts_lock.LOCK_FILE: charts_lock.get_path().read_text(),
+                **dict.fromkeys(removed),
+            },
         )
 
 
 @app.command()
-def build(name: str) -> None:
+def stats(
+    days: int = typer.Option(30),
+    top: int = typer.Option(10),
+) -> None:
     """
-    Build a nix derivation of an existing chart.
+    Show statistics of past update runs.
+
+    Every `update` and `update-all` run records what checking each chart took
+    (see `helmupdater.history`). This shows registry latency percentiles by host
+    and how they changed since the period before, and the charts that cost the
+    most nix and registry time or failed the most.
 
     Args:
-        name: Chart name in format "repo/chart"
+        days: Length of the period to show, in days
+        top: Number of charts listed in every ranking
     """
+    now = time.time()
+    since = now - days * schedule.DAY
+    with contextlib.closing(history.connect()) as connection:
+        counts = history.outcomes(connection, since)
+        current = history.host_latency(connection, since, now)
+        previous = history.host_latency(connection, since - days * schedule.DAY, since)
+        rankings = history.top_charts(connection, since, top)
+
+    if not counts:
+        typer.echo(f"No chart checks in the last {days} days.")
+        return
+    typer.echo(
+        f"Chart checks in the last {days} days: "
+        + ", ".join(f"{count} {outcome}" for outcome, count in counts.items())
+    )
 
-    repo_name, chart_name = utils.parse_chart_name(name)
-    nix.build_chart(repo_name, chart_name)
+    typer.echo(
+        "\nRegistry latency, seconds per request (p50, p95, p50 change since "
+        f"the previous {days} days):"
+    )
+    for host, latency in sorted(
+        current.items(), key=lambda item: -history.percentile(item[1], 50)
+    ):
+        p50 = history.percentile(latency, 50)
+        trend = ""
+        if host in previous:
+            before = history.percentile(previous[host], 50)
+            trend = f"{(p50 - before) / before:+.0%}" if before > 0 else ""
+        typer.echo(
+            f"  {host:<40} {p50:8.3f} {history.percentile(latency, 95):8.3f} "
+            f"{trend:>6}  ({len(latency)} checks)"
+        )
+
+    titles = {
+        "nix": "Most nix time (hashing and builds)",
+        "registry": "Most registry time",
+        "failures": "Most failures",
+    }
+    for name, title in titles.items():
+        if not rankings[name]:
+            continue
+        typer.echo(f"\n{title}:")
+        for row in rankings[name]:
+            total = (
+                f"{row['total']:.0f}" if name == "failures" else f"{row['total']:.1f}s"
+            )
+            typer.echo(f"  {row['chart']:<50} {total:>10}  ({row['checks']} checks)")
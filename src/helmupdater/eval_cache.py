@@ -0,0 +1,62 @@
+"""Nix evaluation results kept between runs."""
+
+import json
+from typing import Any
+
+from helmupdater.utils import cache_dir, write_atomic
+
+_FILE_NAME = "eval.json"
+
+
+def get(name: str, key: str | None) -> Any | None:
+    """
+    Look up a cached evaluation result.
+
+    Args:
+        name: Name of the result (e.g. "chartsMetadata")
+        key: Key the result must have been stored with
+
+    Returns:
+        The stored value, or None if there is none for this key
+    """
+    if key is None:
+        return None
+    entry = _load().get(name)
+    if entry is None or entry.get("key") != key:
+        return None
+    return entry["value"]
+
+
+def put(name: str, key: str | None, value: Any) -> None:
+    """
+    Store an evaluation result, replacing any previous one with the same name.
+
+    Args:
+        name: Name of the result (e.g. "chartsMetadata")
+        key: Key identifying the inputs of the evaluation, nothing is stored if None
+        value: JSON-serialisable value
+    """
+    if key is None:
+        return
+    entries = _load()
+    entries[name] = {"key": key, "value": value}
+    write_atomic(cache_dir() / _FILE_NAME, json.dumps(entries))
+
+
+def invalidate(name: str) -> None:
+    """
+    Drop a cached evaluation result.
+
+    Args:
+        name: Name of the result (e.g. "chartsMetadata")
+    """
+    entries = _load()
+    if entries.pop(name, None) is not None:
+        write_atomic(cache_dir() / _FILE_NAME, json.dumps(entries))
+
+
+def _load() -> dict[str, dict[str, Any]]:
+    try:
+        return json.loads((cache_dir() / _FILE_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
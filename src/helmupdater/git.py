@@ -1,13 +1,32 @@
 """Git operations for helmupdater."""
 
+# Used for forward references to StatusSnapshot
+from __future__ import annotations
+
+import hashlib
+import tempfile
+import time
+from collections.abc import Iterable
 from contextlib import contextmanager
 from pathlib import Path
+from subprocess import CalledProcessError, CompletedProcess
+from typing import Any
 
+from helmupdater import locks
 from helmupdater.logging import get_logger
 from helmupdater.utils import run_cmd
 
 log = get_logger()
 
+CHARTS_PATHSPEC = "charts/"
+
+# Retries of a git command failing on `.git/index.lock` held by another git
+# process (e.g. one started by the user), with exponential backoff.
+INDEX_LOCK_RETRIES = 5
+INDEX_LOCK_BACKOFF = 0.1
+
+_snapshot: StatusSnapshot | None = None
+
 
 def add_file(file_path: Path | str) -> None:
     """
@@ -19,23 +38,64 @@ def add_file(file_path: Path | str) -> None:
     Examples:
         >>> add_file("charts/local/nginx/default.nix")
     """
-    run_cmd("git", "add", str(file_path))
+    _run_index_cmd("git", "add", str(file_path))
+
+
+def remove_files(file_paths: Iterable[Path | str]) -> None:
+    """
+    Stage the removal of files deleted from the working tree.
+
+    Files that aren't in the index are ignored.
+
+    Args:
+        file_paths: Paths to removed files
+
+    Examples:
+        >>> remove_files(["charts/local/nginx/default.nix"])
+    """
+    paths = [str(file_path) for file_path in file_paths]
+    if paths:
+        _run_index_cmd("git", "rm", "--cached", "-q", "--ignore-unmatch", "--", *paths)
+
+
+def is_tracked(file_path: Path | str) -> bool:
+    """
+    Check if a file is in the index, and so seen by nix flakes.
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        True if the file is tracked (or staged), False otherwise
+
+    Examples:
+        >>> is_tracked("charts.lock.json")
+        True
+    """
+    result = run_cmd(
+        "git", "ls-files", "--error-unmatch", "--", str(file_path), raise_on_error=False
+    )
+    return result.returncode == 0
 
 
-def commit(message: str) -> None:
+def commit(message: str, *file_paths: Path | str) -> None:
     """
     Create git commit with message.
 
     Args:
         message: Commit message
+        *file_paths: If given, commit only these files, leaving anything else
+            staged by other processes out of the commit
 
     Raises:
         CalledProcessError: If git commit fails
 
     Examples:
         >>> commit("local/nginx: update to 1.0.1")
+        >>> commit("local/nginx: update to 1.0.1", "charts/local/nginx/default.nix")
     """
-    run_cmd("git", "commit", "-m", message)
+    paths = [str(file_path) for file_path in file_paths]
+    _run_index_cmd("git", "commit", "-m", message, *(["--", *paths] if paths else []))
 
 
 def add_and_commit(file_path: Path | str, message: str) -> None:
@@ -60,7 +120,158 @@ def add_and_commit(file_path: Path | str, message: str) -> None:
         log.debug(f"no changes in file {file_path}")
         return
     add_file(file_path)
-    commit(message)
+    commit(message, file_path)
+    if _snapshot is not None:
+        _snapshot.record_commit(file_path)
+
+
+def commit_contents(message: str, contents: dict[str, str | None]) -> bool:
+    """
+    Commit given contents of files, regardless of the working tree and index.
+
+    The commit is prepared in a temporary index read from HEAD, so files and
+    staged changes not listed are left out of it. This allows committing a part
+    of a file's changes, e.g. a single chart's entry in the lock file while
+    other charts of the run are still being updated. The index entries of the
+    committed files are then reset to the new HEAD.
+
+    HEAD is only moved if it still points to the commit the new one is based on.
+    If another commit was made in the meantime, the commit is prepared again on
+    top of it, so that it doesn't revert the other commit's changes.
+
+    The commit is made like `git commit -m` would: the pre-commit,
+    prepare-commit-msg, commit-msg and post-commit hooks run (against the
+    temporary index), and it is signed if `commit.gpgSign` is set. Like with
+    `-m`, the commit template isn't used.
+
+    Args:
+        message: Commit message
+        contents: New content of every file, by path relative to the
+            repository root, None for files to remove
+
+    Returns:
+        True if a commit was created, False if all contents match HEAD
+
+    Raises:
+        CalledProcessError: If a git command fails
+
+    Examples:
+        >>> commit_contents(
+        ...     "local/nginx: update to 1.0.1",
+        ...     {"charts.lock.json": '{"version": 1, ...}'},
+        ... )
+        True
+    """
+    attempt = 0
+    while True:
+        parent = head_commit()
+        changed = {
+            path: content
+            for path, content in contents.items()
+            if parent is None or show_file(path, parent) != content
+        }
+        if not changed:
+            log.debug(f"no changes in files {', '.join(contents)}")
+            return False
+
+        commit = _commit_tree(message, parent, changed)
+        # An empty old value makes sure the branch doesn't exist yet
+        moved = run_cmd(
+            "git",
+            "update-ref",
+            "-m",
+            f"commit: {message.splitlines()[0]}",
+            "HEAD",
+            commit,
+            parent or "",
+            raise_on_error=attempt == INDEX_LOCK_RETRIES,
+        )
+        if moved.returncode == 0:
+            # Like `git commit`, the outcome of post-commit is ignored
+            run_cmd(
+                "git",
+                "hook",
+                "run",
+                "--ignore-missing",
+                "post-commit",
+                raise_on_error=False,
+            )
+            break
+        delay = INDEX_LOCK_BACKOFF * 2**attempt
+        log.debug(f"HEAD moved while committing, retrying in {delay:.1f}s")
+        time.sleep(delay)
+        attempt += 1
+
+    _run_index_cmd("git", "reset", "-q", "--", *changed)
+    if _snapshot is not None:
+        for path in changed:
+            _snapshot.record_commit(path)
+    return True
+
+
+def _commit_tree(
+    message: str, parent: str | None, contents: dict[str, str | None]
+) -> str:
+    # Tree of the parent with given files replaced, built in a temporary index
+    with tempfile.TemporaryDirectory(prefix="helmupdater-index-") as tmp_dir:
+        env = {"GIT_INDEX_FILE": str(Path(tmp_dir) / "index")}
+        run_cmd("git", "read-tree", parent or "--empty", env=env)
+        for path, content in contents.items():
+            if content is None:
+                run_cmd("git", "update-index", "--force-remove", "--", path, env=env)
+                continue
+            blob = run_cmd("git", "hash-object", "-w", "--stdin", input=content)
+            run_cmd(
+                "git",
+                "update-index",
+                "--add",
+                "--cacheinfo",
+                f"100644,{blob.stdout.strip()},{path}",
+                env=env,
+            )
+        # Hooks see the index of the commit, like with `git commit <paths>`
+        _run_hook("pre-commit", env=env)
+        message_path = Path(tmp_dir) / "COMMIT_EDITMSG"
+        message_path.write_text(message.rstrip("\n") + "\n")
+        _run_hook("prepare-commit-msg", str(message_path), "message", env=env)
+        _run_hook("commit-msg", str(message_path), env=env)
+        message = run_cmd("git", "stripspace", input=message_path.read_text()).stdout
+        tree = run_cmd("git", "write-tree", env=env).stdout.strip()
+    parents = ["-p", parent] if parent is not None else []
+    # Unlike `git commit`, commit-tree doesn't sign by itself
+    sign = run_cmd(
+        "git", "config", "--type=bool", "commit.gpgSign", raise_on_error=False
+    )
+    signing = ["-S"] if sign.stdout.strip() == "true" else []
+    return run_cmd(
+        "git", "commit-tree", tree, *parents, *signing, input=message
+    ).stdout.strip()
+
+
+def _run_hook(name: str, *args: str, env: dict[str, str]) -> None:
+    # A failing hook aborts the commit, like with `git commit`
+    run_cmd("git", "hook", "run", "--ignore-missing", name, "--", *args, env=env)
+
+
+def show_file(file_path: Path | str, ref: str = "HEAD") -> str | None:
+    """
+    Get the content of a file at a commit.
+
+    Args:
+        file_path: Path relative to the repository root
+        ref: Commit to read the file from
+
+    Returns:
+        Content of the file, or None if it doesn't exist at that commit
+
+    Examples:
+        >>> show_file("charts/local/nginx/default.nix", "HEAD~1")
+        '{\n  repo = "http://localhost:45010/";\n ...'
+    """
+    result = run_cmd("git", "show", f"{ref}:{file_path}", raise_on_error=False)
+    if result.returncode != 0:
+        return None
+    return result.stdout
 
 
 def reset(file_path: Path | str | None = None) -> None:
@@ -76,9 +287,149 @@ def reset(file_path: Path | str | None = None) -> None:
         >>> reset("charts/local/nginx/default.nix")  # Unstage specific file
     """
     if file_path is None:
-        run_cmd("git", "reset")
+        _run_index_cmd("git", "reset")
     else:
-        run_cmd("git", "reset", str(file_path))
+        _run_index_cmd("git", "reset", str(file_path))
+
+
+def changed_files(ref: str, pathspec: str = CHARTS_PATHSPEC) -> list[str]:
+    """
+    List files that were added or modified since a git ref.
+
+    The working tree is compared against the ref, so uncommitted changes are
+    included. Deleted files are not listed.
+
+    Args:
+        ref: Git ref to compare against (branch, tag or commit)
+        pathspec: Directory (relative to the repository root) to look into
+
+    Returns:
+        Paths relative to the repository root
+
+    Examples:
+        >>> changed_files("origin/master")
+        ['charts/local/nginx/default.nix']
+    """
+    result = run_cmd(
+        "git",
+        "diff",
+        "--name-only",
+        "-z",
+        "--no-renames",
+        "--diff-filter=d",
+        ref,
+        "--",
+        pathspec,
+    )
+    return [path for path in result.stdout.split("\0") if path]
+
+
+def log_subjects(pathspec: str = CHARTS_PATHSPEC) -> list[tuple[int, str]]:
+    """
+    List commit subjects touching a path, oldest first.
+
+    Args:
+        pathspec: Directory (relative to the repository root) to look into
+
+    Returns:
+        List of (commit timestamp, subject) tuples
+
+    Examples:
+        >>> log_subjects()
+        [(1767225600, 'local/nginx: init at 1.0.0'), ...]
+    """
+    result = run_cmd("git", "log", "--reverse", "--format=%ct %s", "--", pathspec)
+    entries = []
+    for line in result.stdout.splitlines():
+        timestamp, _, subject = line.partition(" ")
+        entries.append((int(timestamp), subject))
+    return entries
+
+
+def head_commit() -> str | None:
+    """
+    Get the commit checked out.
+
+    Returns:
+        Commit hash, or None outside of a git repository or before the first commit
+    """
+    result = run_cmd("git", "rev-parse", "--verify", "HEAD", raise_on_error=False)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+def file_history(pathspec: str, since: str | None = None) -> list[str]:
+    """
+    List contents of files after every commit that changed them, oldest first.
+
+    Contents are taken from a single `git log -p` with the whole file as context,
+    so this works for small files only. Deleted files are not listed.
+
+    Args:
+        pathspec: Files to look at (e.g. ":(glob)charts/**/default.nix")
+        since: Commit to start after, the whole history if None
+
+    Returns:
+        File contents
+
+    Raises:
+        CalledProcessError: If `since` isn't a known commit
+
+    Examples:
+        >>> file_history(":(glob)charts/**/default.nix")
+        ['{\\n  repo = "https://...";\\n  chart = "nginx";\\n ...', ...]
+    """
+    revisions = f"{since}..HEAD" if since else "HEAD"
+    result = run_cmd(
+        "git",
+        "log",
+        "--reverse",
+        "--patch",
+        "--unified=1000",
+        "--no-renames",
+        "--format=",
+        revisions,
+        "--",
+        pathspec,
+    )
+
+    contents = []
+    for diff in result.stdout.split("diff --git ")[1:]:
+        _, _, hunks = diff.partition("\n@@")
+        lines = [
+            line[1:] for line in hunks.splitlines()[1:] if line.startswith(("+", " "))
+        ]
+        if lines:
+            contents.append("\n".join(lines) + "\n")
+    return contents
+
+
+def content_key(*paths: str) -> str | None:
+    """
+    Identify the content of paths in the working tree, as a nix flake sees it.
+
+    The key combines the object hashes of the paths at HEAD with the diff of
+    tracked files against HEAD, so it changes with commits as well as with
+    staged and unstaged edits. Untracked files are ignored, like in flakes.
+
+    Args:
+        *paths: Paths relative to the repository root
+
+    Returns:
+        Hex digest, or None if the paths don't exist at HEAD
+
+    Examples:
+        >>> content_key("charts", "flake.lock")
+        '5e1c0b...'
+    """
+    head = run_cmd(
+        "git", "rev-parse", *(f"HEAD:{path}" for path in paths), raise_on_error=False
+    )
+    if head.returncode != 0:
+        return None
+    diff = run_cmd("git", "diff", "--binary", "HEAD", "--", *paths)
+    return hashlib.sha256((head.stdout + diff.stdout).encode()).hexdigest()
 
 
 @contextmanager
@@ -105,9 +456,55 @@ def staged_file(file_path: Path | str):
         reset(file_path)
 
 
+@contextmanager
+def staged_files(file_paths: Iterable[Path | str]):
+    """
+    Context manager to temporarily stage several files with one git call each.
+
+    Args:
+        file_paths: Paths to files to stage
+
+    Yields:
+        Paths to the staged files
+
+    Examples:
+        >>> with staged_files(["charts/local/nginx/default.nix"]) as paths:
+        ...     perform_operations()
+    """
+    paths = [str(file_path) for file_path in file_paths]
+    if paths:
+        _run_index_cmd("git", "add", *paths)
+    try:
+        yield file_paths
+    finally:
+        if paths:
+            _run_index_cmd("git", "reset", *paths)
+
+
+def _run_index_cmd(*args: str, **kwargs: Any) -> CompletedProcess:
+    # Commands writing the index are serialized between helmupdater processes by
+    # a lock file. Git processes started by someone else can still hold
+    # `.git/index.lock`, in which case the command is retried.
+    attempt = 0
+    while True:
+        try:
+            with locks.index_lock():
+                return run_cmd(*args, **kwargs)
+        except CalledProcessError as e:
+            if "index.lock" not in (e.stderr or "") or attempt == INDEX_LOCK_RETRIES:
+                raise
+        delay = INDEX_LOCK_BACKOFF * 2**attempt
+        log.debug(f"git index is locked, retrying in {delay:.1f}s")
+        time.sleep(delay)
+        attempt += 1
+
+
 def has_changes(file_path: Path | str) -> bool:
     """
-    Check if file has unstaged changes.
+    Check if file has uncommitted changes.
+
+    The answer comes from the run-scoped status snapshot (see `status_snapshot`),
+    so repeated checks don't start a git process per file.
 
     Args:
         file_path: Path to file to check
@@ -119,7 +516,160 @@ def has_changes(file_path: Path | str) -> bool:
         >>> has_changes("charts/local/nginx/default.nix")
         True
     """
-    result = run_cmd(
-        "git", "status", "--porcelain", str(file_path)
-    )
-    return result.stdout.strip() != ""
+    return status_snapshot().has_changes(file_path)
+
+
+def status_snapshot() -> StatusSnapshot:
+    """
+    Get the status snapshot for the current run, taking it on first use.
+
+    Returns:
+        StatusSnapshot shared by the whole process
+    """
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = StatusSnapshot()
+    return _snapshot
+
+
+def track_write(file_path: Path | str, content: str | None) -> None:
+    """
+    Let the status snapshot know that helmupdater is about to overwrite a file.
+
+    Must be called before the new content is written. Does nothing if the snapshot
+    hasn't been taken yet, as it will see the file on disk once it is.
+
+    Args:
+        file_path: Path to the file being written
+        content: New content of the file, None if it is about to be removed
+    """
+    if _snapshot is not None:
+        _snapshot.record_write(file_path, content)
+
+
+class StatusSnapshot:
+    """
+    Tree-wide view of `git status` for the charts directory.
+
+    The snapshot is taken with a single `git status` call and then updated as
+    helmupdater writes and commits files itself. For files written by helmupdater,
+    the content they had while clean is remembered, so writing the original content
+    back marks them as clean again. Files that were already dirty when the
+    snapshot was taken and are then rewritten fall back to a per-file
+    `git status` call, as their committed content is unknown.
+    """
+
+    def __init__(self, pathspec: str = CHARTS_PATHSPEC) -> None:
+        """
+        Take the snapshot.
+
+        Args:
+            pathspec: Directory (relative to the repository root) to track
+        """
+        self.pathspec = pathspec.rstrip("/") + "/"
+        result = run_cmd(
+            "git",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=all",
+            "--",
+            self.pathspec,
+        )
+        self.changed: set[str] = _parse_porcelain_v2(result.stdout)
+        self._baseline: dict[str, str | None] = {}
+        self._unknown: set[str] = set()
+
+    def _key(self, file_path: Path | str) -> str | None:
+        path = Path(file_path)
+        if path.is_absolute():
+            try:
+                path = path.relative_to(Path.cwd())
+            except ValueError:
+                return None
+        key = path.as_posix()
+        return key if key.startswith(self.pathspec) else None
+
+    def has_changes(self, file_path: Path | str) -> bool:
+        """
+        Check if file has uncommitted changes.
+
+        Args:
+            file_path: Path to file to check
+
+        Returns:
+            True if file has changes, False otherwise
+        """
+        key = self._key(file_path)
+        if key is None or key in self._unknown:
+            return _status_porcelain(file_path) != ""
+        return key in self.changed
+
+    def record_write(self, file_path: Path | str, content: str | None) -> None:
+        """
+        Update the snapshot for a file that is about to be overwritten.
+
+        Args:
+            file_path: Path to the file being written
+            content: New content of the file, None if it is about to be removed
+        """
+        key = self._key(file_path)
+        if key is None or key in self._unknown:
+            return
+
+        if key not in self.changed and key not in self._baseline:
+            path = Path(file_path)
+            self._baseline[key] = path.read_text() if path.exists() else None
+
+        if key not in self._baseline:
+            self._unknown.add(key)
+        elif content == self._baseline[key]:
+            self.changed.discard(key)
+        else:
+            self.changed.add(key)
+
+    def record_commit(self, file_path: Path | str) -> None:
+        """
+        Mark a file as clean after its current content was committed.
+
+        Args:
+            file_path: Path to the committed file
+        """
+        key = self._key(file_path)
+        if key is None:
+            return
+
+        path = Path(file_path)
+        self.changed.discard(key)
+        self._unknown.discard(key)
+        self._baseline[key] = path.read_text() if path.exists() else None
+
+
+def _status_porcelain(file_path: Path | str) -> str:
+    result = run_cmd("git", "status", "--porcelain", str(file_path))
+    return result.stdout.strip()
+
+
+def _parse_porcelain_v2(output: str) -> set[str]:
+    # Entries are NUL-terminated. The number of space-separated fields before the
+    # path depends on the entry type, the path itself may contain spaces:
+    #
+    #   1 XY sub mH mI mW hH hI <path>
+    #   2 XY sub mH mI mW hH hI Xscore <path>\0<origPath>
+    #   u XY sub m1 m2 m3 mW h1 h2 h3 <path>
+    #   ? <path>
+    fields_before_path = {"1": 8, "2": 9, "u": 10, "?": 1}
+
+    paths: set[str] = set()
+    entries = iter(output.split("\0"))
+    for entry in entries:
+        if not entry:
+            continue
+        entry_type = entry[0]
+        if entry_type not in fields_before_path:
+            continue
+        paths.add(entry.split(" ", fields_before_path[entry_type])[-1])
+        if entry_type == "2":
+            paths.add(next(entries))
+
+    return paths
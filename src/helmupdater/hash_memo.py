@@ -0,0 +1,127 @@
+"""Chart hashes of upstream archives, kept between runs."""
+
+# Used for a forward reference to ChartMetadata
+from __future__ import annotations
+
+import json
+import threading
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Any
+
+from helmupdater.utils import cache_dir, write_atomic
+
+if TYPE_CHECKING:
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+_FILE_NAME = "hashes.json"
+
+# Serializes read-modify-write of the file by threads of this process
+_lock = threading.Lock()
+
+
+def lookup(
+    repo_url: str,
+    chart_name: str,
+    version: str,
+    digest: str | None,
+    history: bool = False,
+) -> str | None:
+    """
+    Look up the hash of a chart archive computed before.
+
+    Hashes are found by the digest of the archive, so an archive re-published
+    under the same version isn't matched. With `history`, hashes of versions
+    seen in git history are used as well, as long as the digest of the archive
+    they were computed for isn't known to differ.
+
+    Args:
+        repo_url: Repository URL
+        chart_name: Chart name
+        version: Chart version
+        digest: Digest of the archive, None if the registry doesn't publish one
+        history: Whether to use hashes of versions found in git history
+
+    Returns:
+        Hash of the chart, or None if it has to be computed
+    """
+    memo = _load()
+    if digest is not None and digest in memo["digests"]:
+        return memo["digests"][digest]
+    if history:
+        entry = memo["versions"].get(_version_key(repo_url, chart_name, version))
+        if entry is not None and (digest is None or entry["digest"] is None):
+            return entry["hash"]
+    return None
+
+
+def record(
+    repo_url: str,
+    chart_name: str,
+    version: str,
+    digest: str | None,
+    chart_hash: str,
+) -> None:
+    """
+    Remember the hash of a chart archive, computed by nix.
+
+    Args:
+        repo_url: Repository URL
+        chart_name: Chart name
+        version: Chart version
+        digest: Digest of the archive, None if the registry doesn't publish one
+        chart_hash: Hash of the chart
+    """
+    with _lock:
+        memo = _load()
+        if digest is not None:
+            memo["digests"][digest] = chart_hash
+        memo["versions"][_version_key(repo_url, chart_name, version)] = {
+            "hash": chart_hash,
+            "digest": digest,
+        }
+        _save(memo)
+
+
+def seeded_commit() -> str | None:
+    """Get the commit up to which git history was scanned for hashes."""
+    return _load()["seeded"]
+
+
+def seed(commit: str, charts: Iterable[ChartMetadata]) -> None:
+    """
+    Remember hashes of chart versions found in git history.
+
+    Hashes recorded by `record` are kept, they are bound to an archive digest.
+
+    Args:
+        commit: Commit up to which history was scanned
+        charts: Chart files at every commit that changed them, oldest first
+    """
+    with _lock:
+        memo = _load()
+        for chart_info in charts:
+            key = _version_key(chart_info.repo, chart_info.chart, chart_info.version)
+            entry = memo["versions"].get(key)
+            if entry is None or entry["digest"] is None:
+                memo["versions"][key] = {"hash": chart_info.chartHash, "digest": None}
+        memo["seeded"] = commit
+        _save(memo)
+
+
+def _version_key(repo_url: str, chart_name: str, version: str) -> str:
+    return f"{repo_url.rstrip('/')}/{chart_name}@{version}"
+
+
+def _load() -> dict[str, Any]:
+    try:
+        memo = json.loads((cache_dir() / _FILE_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        memo = {}
+    memo.setdefault("seeded", None)
+    memo.setdefault("digests", {})
+    memo.setdefault("versions", {})
+    return memo
+
+
+def _save(memo: dict[str, Any]) -> None:
+    write_atomic(cache_dir() / _FILE_NAME, json.dumps(memo))
@@ -0,0 +1,331 @@
+"""Per-chart records of every update run, kept in a SQLite database."""
+
+# Used for forward references to ChartRecord
+from __future__ import annotations
+
+import contextlib
+import statistics
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Generator, Iterable
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlparse
+
+from helmupdater.logging import event
+from helmupdater.utils import cache_dir
+
+if TYPE_CHECKING:
+    import sqlite3
+
+_FILE_NAME = "history.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS charts (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    chart TEXT NOT NULL,
+    host TEXT NOT NULL,
+    started REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    old_version TEXT,
+    new_version TEXT,
+    error TEXT,
+    registry_requests INTEGER NOT NULL,
+    registry_seconds REAL NOT NULL,
+    registry_bytes INTEGER NOT NULL,
+    versions INTEGER NOT NULL,
+    hash_seconds REAL NOT NULL,
+    build_seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS charts_started ON charts (started);
+"""
+
+# Record of the chart being checked by every thread, metrics are added to it
+# (see `add`)
+_current = threading.local()
+
+
+@dataclass
+class ChartRecord:
+    """What checking a chart took and what came out of it."""
+
+    chart: str
+    host: str
+    started: float
+    outcome: str = "failed"
+    """One of: updated, unchanged, failed, skipped"""
+    old_version: str | None = None
+    new_version: str | None = None
+    error: str | None = None
+    """Error message, or why the chart was skipped"""
+    registry_requests: int = 0
+    registry_seconds: float = 0.0
+    """Time to first byte and transfer of registry requests"""
+    registry_bytes: int = 0
+    versions: int = 0
+    """Stable versions found upstream"""
+    hash_seconds: float = 0.0
+    build_seconds: float = 0.0
+
+    def resolve(self, version: str) -> None:
+        """
+        Record the version the chart was resolved to, as "updated" or "unchanged".
+
+        Args:
+            version: Latest version of the chart
+        """
+        self.new_version = version
+        self.outcome = "updated" if version != self.old_version else "unchanged"
+
+
+def add(metric: str, value: float) -> None:
+    """
+    Add to a metric of the chart being checked, if any.
+
+    Args:
+        metric: Field of `ChartRecord` (e.g. "registry_bytes")
+        value: Amount to add
+    """
+    record = getattr(_current, "record", None)
+    if record is not None:
+        setattr(record, metric, getattr(record, metric) + value)
+
+
+@contextlib.contextmanager
+def timed(metric: str) -> Generator[None]:
+    """
+    Add the time spent in a block to a metric of the chart being checked.
+
+    Args:
+        metric: Field of `ChartRecord` (e.g. "hash_seconds")
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        add(metric, time.monotonic() - started)
+
+
+class RunHistory:
+    """
+    Records of a run, appended to the history database in the cache directory.
+
+    The database is shared by all runs (and processes), so `stats` can compare
+    registries and charts over time. Charts can be recorded from several
+    threads at once, metrics are added to the record of the calling thread.
+    """
+
+    def __init__(self, command: str, path: Path | None = None) -> None:
+        """
+        Args:
+            command: Command of the run (e.g. "update-all")
+            path: Database file, `history.sqlite` in the cache directory by default
+        """
+        self._connection = connect(path)
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO runs (command, started) VALUES (?, ?)",
+                (command, time.time()),
+            )
+        self.run_id = cursor.lastrowid
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def chart(
+        self, repo_name: str, chart_name: str, repo_url: str, version: str
+    ) -> Generator[ChartRecord]:
+        """
+        Record checking a chart.
+
+        Registry requests, hashing and builds made within the block are added to
+        the record. Its outcome is "failed" unless set otherwise. The check is
+        emitted as "chart.started" and "chart.finished" events, the latter with
+        the fields of the record.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+            repo_url: Repository URL
+            version: Version of the chart before the check
+        """
+        record = _new_record(repo_name, chart_name, repo_url, version)
+        _current.record = record
+        event("chart.started", repo=repo_name, chart=chart_name, version=version)
+        try:
+            yield record
+        finally:
+            _current.record = None
+            event(
+                "chart.finished",
+                **{
+                    **asdict(record),
+                    "repo": repo_name,
+                    "chart": chart_name,
+                    "seconds": time.time() - record.started,
+                },
+            )
+            self._insert([record])
+
+    def skip(self, charts: Iterable[tuple[str, str, str, str]], reason: str) -> None:
+        """
+        Record charts that weren't checked, with outcome "skipped".
+
+        Args:
+            charts: Repository name, chart name, repository URL and version of
+                every skipped chart
+            reason: Why the charts were skipped
+        """
+        records = []
+        for repo_name, chart_name, repo_url, version in charts:
+            record = _new_record(repo_name, chart_name, repo_url, version)
+            record.outcome = "skipped"
+            record.error = reason
+            records.append(record)
+        self._insert(records)
+
+    def _insert(self, records: list[ChartRecord]) -> None:
+        columns = [f.name for f in fields(ChartRecord)]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f"INSERT INTO charts (run_id, {', '.join(columns)}) "
+                f"VALUES (?{', ?' * len(columns)})",
+                [(self.run_id, *asdict(record).values()) for record in records],
+            )
+
+    def close(self) -> None:
+        """Close the database."""
+        self._connection.close()
+
+
+def _new_record(
+    repo_name: str, chart_name: str, repo_url: str, version: str
+) -> ChartRecord:
+    return ChartRecord(
+        chart=f"{repo_name}/{chart_name}",
+        host=urlparse(repo_url).netloc,
+        started=time.time(),
+        old_version=version,
+    )
+
+
+def connect(path: Path | None = None) -> sqlite3.Connection:
+    """
+    Open the history database, creating it if needed.
+
+    Args:
+        path: Database file, `history.sqlite` in the cache directory by default
+
+    Returns:
+        Connection with rows accessible by column name
+    """
+    import sqlite3
+
+    # Concurrent runs wait for each other's writes instead of failing
+    connection = sqlite3.connect(
+        path or cache_dir() / _FILE_NAME, timeout=30, check_same_thread=False
+    )
+    connection.row_factory = sqlite3.Row
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def percentile(values: list[float], percent: int) -> float:
+    """
+    Get a percentile of values.
+
+    Args:
+        values: Values, at least one
+        percent: Percentile, 1-99
+
+    Returns:
+        The value below which `percent` percent of values fall
+    """
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def host_latency(
+    connection: sqlite3.Connection, since: float, until: float
+) -> dict[str, list[float]]:
+    """
+    Collect the mean registry request time of every chart check, by host.
+
+    Args:
+        connection: History database
+        since: Start of the period, as a timestamp
+        until: End of the period, as a timestamp
+
+    Returns:
+        Seconds per request of every check in the period, by registry host
+    """
+    latency: dict[str, list[float]] = defaultdict(list)
+    for row in connection.execute(
+        "SELECT host, registry_seconds / registry_requests AS seconds FROM charts "
+        "WHERE registry_requests > 0 AND started >= ? AND started < ?",
+        (since, until),
+    ):
+        latency[row["host"]].append(row["seconds"])
+    return latency
+
+
+def top_charts(
+    connection: sqlite3.Connection, since: float, limit: int
+) -> dict[str, list[dict[str, Any]]]:
+    """
+    Find the charts costing the most time and failing the most.
+
+    Args:
+        connection: History database
+        since: Start of the period, as a timestamp
+        limit: Number of charts in every list
+
+    Returns:
+        Lists of charts by "nix" (hash and build time), "registry" (request time)
+        and "failures" (failed checks), highest first
+    """
+    queries = {
+        "nix": "SUM(hash_seconds + build_seconds)",
+        "registry": "SUM(registry_seconds)",
+        "failures": "SUM(outcome = 'failed')",
+    }
+    return {
+        name: [
+            dict(row)
+            for row in connection.execute(
+                f"SELECT chart, {total} AS total, COUNT(*) AS checks FROM charts "
+                "WHERE started >= ? GROUP BY chart HAVING total > 0 "
+                "ORDER BY total DESC LIMIT ?",
+                (since, limit),
+            )
+        ]
+        for name, total in queries.items()
+    }
+
+
+def outcomes(connection: sqlite3.Connection, since: float) -> dict[str, int]:
+    """
+    Count chart checks by outcome.
+
+    Args:
+        connection: History database
+        since: Start of the period, as a timestamp
+
+    Returns:
+        Number of checks of every outcome in the period
+    """
+    return {
+        row["outcome"]: row["count"]
+        for row in connection.execute(
+            "SELECT outcome, COUNT(*) AS count FROM charts WHERE started >= ? "
+            "GROUP BY outcome ORDER BY count DESC",
+            (since,),
+        )
+    }
@@ -0,0 +1,101 @@
+"""Coordination between helmupdater processes working in the same checkout."""
+
+import fcntl
+import hashlib
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+
+from helmupdater.utils import cache_dir
+
+
+class LockedError(RuntimeError):
+    """Lock is held by another process."""
+
+
+def lock_dir() -> Path:
+    """
+    Get directory for lock files of the current checkout.
+
+    Lock files live in the cache directory rather than in the checkout, so they
+    never show up as untracked files. The directory is specific to the current
+    working directory.
+
+    Returns:
+        Path to the lock directory
+    """
+    checkout = hashlib.sha256(str(Path.cwd().resolve()).encode()).hexdigest()
+    directory = cache_dir() / "locks" / checkout[:16]
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True) -> Generator[None]:
+    """
+    Hold an exclusive advisory lock on a file.
+
+    The lock is released when the block exits or the process dies. Locks are
+    tied to the open file, so threads of one process exclude each other too.
+
+    Args:
+        path: Path to the lock file, created if missing
+        blocking: If False, fail instead of waiting for the lock
+
+    Raises:
+        LockedError: If blocking=False and the lock is held elsewhere
+    """
+    with open(path, "a") as f:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError as e:
+            raise LockedError(f"{path} is locked by another process") from e
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def chart_lock(repo_name: str, chart_name: str, blocking: bool = True):
+    """
+    Lock a chart for the time it is updated and committed.
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+        blocking: If False, fail instead of waiting for the lock
+
+    Raises:
+        LockedError: If blocking=False and the chart is locked elsewhere
+
+    Examples:
+        >>> with chart_lock("local", "nginx"):
+        ...     update("local", "nginx")
+    """
+    # Names are directory names in charts/, so they can't contain a slash
+    directory = lock_dir() / "charts" / repo_name
+    directory.mkdir(parents=True, exist_ok=True)
+    return file_lock(directory / f"{chart_name}.lock", blocking)
+
+
+def index_lock():
+    """
+    Lock the git index of the checkout for the time of one git command.
+
+    Examples:
+        >>> with index_lock():
+        ...     run_cmd("git", "add", "charts/local/nginx/default.nix")
+    """
+    return file_lock(lock_dir() / "index.lock")
+
+
+def lock_file_lock():
+    """
+    Lock charts.lock.json of the checkout while it is read and rewritten.
+
+    Examples:
+        >>> with lock_file_lock():
+        ...     write_atomic("charts.lock.json", content)
+    """
+    return file_lock(lock_dir() / "charts-lock.lock")
@@ -1,17 +1,134 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import sys
+from enum import StrEnum
+from typing import Any, TextIO
 
 import structlog
 
 
-def configure_logging(level: int | None = None) -> None:
+class LogFormat(StrEnum):
+    """How log messages are written."""
+
+    CONSOLE = "console"
+    """Human-readable lines."""
+
+    JSON = "json"
+    """One JSON object per line (NDJSON), including structured events (see
+    `event`)."""
+
+
+# Standard library logger JSON lines are handed to, so they are written by a
+# background thread (see `configure_logging`)
+_JSON_LOGGER = "helmupdater.json"
+
+_listener: logging.handlers.QueueListener | None = None
+_events = False
+_event_log = structlog.get_logger()
+
+
+def configure_logging(
+    level: int | None = None,
+    log_format: LogFormat = LogFormat.CONSOLE,
+    stream: TextIO | None = None,
+) -> None:
+    """
+    Configure structlog for the process.
+
+    Loggers are cached on first use, so the configuration is meant to be set
+    once, before anything is logged.
+
+    In JSON format, messages are rendered by the thread logging them and put on
+    a queue; a background thread writes them to stdout. Workers never wait for
+    the output stream.
+
+    Args:
+        level: Minimum level, from the LOG_LEVEL env variable (INFO by default)
+            if None
+        log_format: Format of log lines
+        stream: Stream JSON lines are written to, stdout by default
+    """
+    global _events
     if level is None:
         level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
         level = logging.getLevelNamesMapping().get(level_name, logging.INFO)
 
-    structlog.configure(
-        wrapper_class=structlog.make_filtering_bound_logger(level),
-    )
+    stop_logging()
+    _events = log_format == LogFormat.JSON
+    if log_format == LogFormat.JSON:
+        _start_listener(stream or sys.stdout)
+        structlog.configure(
+            processors=[
+                structlog.processors.add_log_level,
+                structlog.processors.TimeStamper(fmt="iso", utc=True),
+                structlog.processors.format_exc_info,
+                structlog.processors.JSONRenderer(),
+            ],
+            wrapper_class=structlog.make_filtering_bound_logger(level),
+            logger_factory=_json_logger,
+            cache_logger_on_first_use=True,
+        )
+    else:
+        structlog.configure(
+            wrapper_class=structlog.make_filtering_bound_logger(level),
+            cache_logger_on_first_use=True,
+        )
+
+
+def stop_logging() -> None:
+    """Write queued JSON lines and stop the writer thread, if any."""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+
+# JSON lines still queued when the process exits are written
+atexit.register(stop_logging)
+
+
+def _start_listener(stream: TextIO) -> None:
+    global _listener
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(stream))
+    _listener.start()
+
+    # Loggers cached before keep writing to the same standard library logger
+    logger = logging.getLogger(_JSON_LOGGER)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+
+def _json_logger(*args: Any) -> logging.Logger:
+    return logging.getLogger(_JSON_LOGGER)
+
+
+def events_enabled() -> bool:
+    """Whether structured events are emitted (`--log-format json`)."""
+    return _events
+
+
+def event(name: str, **fields: Any) -> None:
+    """
+    Emit a structured event, in JSON format only.
+
+    Events mark progress of a run for machines following it (e.g. an
+    orchestrator reading the output): charts starting and finishing, phases
+    finishing, the run finishing. Console output is left as it is.
+
+    Args:
+        name: Name of the event (e.g. "chart.finished")
+        **fields: Fields of the event, JSON-serializable
+
+    Examples:
+        >>> event("phase.finished", repo="bitnami", chart="nginx", seconds=0.2)
+    """
+    if _events:
+        _event_log.info(name, **fields)
 
 
 def get_logger() -> structlog.stdlib.BoundLogger:
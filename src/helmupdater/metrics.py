@@ -0,0 +1,204 @@
+"""Metrics of a run, written in the Prometheus text format (`--metrics-file`)."""
+
+# Used for forward references to Collector
+from __future__ import annotations
+
+import bisect
+import contextlib
+import threading
+import time
+from collections.abc import Generator
+from pathlib import Path
+
+from helmupdater.utils import write_atomic
+
+PREFIX = "helmupdater"
+
+# Upper bounds of histogram buckets in seconds, from fast registry requests to
+# slow nix builds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Name: (type, help)
+METRICS = {
+    "registry_request_duration_seconds": (
+        "histogram",
+        "Duration of registry requests, until the body is received.",
+    ),
+    "registry_errors_total": ("counter", "Registry requests that failed."),
+    "phase_duration_seconds": ("histogram", "Duration of phases of chart checks."),
+    "subprocesses_total": ("counter", "Subprocesses started, by command."),
+    "subprocess_duration_seconds_total": ("counter", "Time spent in subprocesses."),
+    "charts": ("gauge", "Charts checked, updated, failed and skipped by the run."),
+    "run_duration_seconds": ("gauge", "Duration of the run."),
+    "last_run_timestamp_seconds": ("gauge", "Time the run finished."),
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+collector: Collector | None = None
+
+
+def inc(name: str, amount: float = 1, **labels: str) -> None:
+    """
+    Add to a counter or gauge, if metrics are collected.
+
+    Args:
+        name: Name of the metric, without prefix (see METRICS)
+        amount: Amount to add
+        **labels: Labels of the series
+    """
+    if collector is not None:
+        collector.inc(name, amount, labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """
+    Record a value in a histogram, if metrics are collected.
+
+    Args:
+        name: Name of the metric, without prefix (see METRICS)
+        value: Observed value
+        **labels: Labels of the series
+    """
+    if collector is not None:
+        collector.observe(name, value, labels)
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels: str) -> Generator[None]:
+    """
+    Record the duration of a block in a histogram.
+
+    Args:
+        name: Name of the metric, without prefix (see METRICS)
+        **labels: Labels of the series
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+
+def start(path: Path) -> None:
+    """
+    Start collecting metrics.
+
+    Args:
+        path: File to write metrics to when the run ends (see `stop`)
+    """
+    global collector
+    collector = Collector(path)
+
+
+def stop() -> None:
+    """Stop collecting metrics and write them."""
+    global collector
+    if collector is None:
+        return
+    current, collector = collector, None
+    current.write()
+
+
+class Collector:
+    """
+    Metrics of the current run.
+
+    All values start from zero with every run. The file is meant for the
+    node_exporter textfile collector, which exposes the last run's values until
+    the next run replaces the file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.started = time.time()
+        self._values: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float, labels: dict[str, str]) -> None:
+        """Add to a counter or gauge."""
+        key = (name, _labels(name, labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: dict[str, str]) -> None:
+        """Record a value in a histogram."""
+        key = (name, _labels(name, labels))
+        with self._lock:
+            # Bucket counts (not cumulative), then +Inf, sum
+            histogram = self._histograms.setdefault(key, [0.0] * (len(BUCKETS) + 2))
+            histogram[bisect.bisect_left(BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def render(self) -> str:
+        """
+        Render metrics in the Prometheus text exposition format.
+
+        Returns:
+            Metrics with their HELP and TYPE lines, metrics without values are
+            left out
+        """
+        finished = time.time()
+        self.inc("run_duration_seconds", finished - self.started, {})
+        self.inc("last_run_timestamp_seconds", finished, {})
+
+        lines = []
+        with self._lock:
+            for name, (kind, description) in METRICS.items():
+                full_name = f"{PREFIX}_{name}"
+                series = []
+                if kind == "histogram":
+                    for (metric, labels), histogram in sorted(self._histograms.items()):
+                        if metric == name:
+                            series.extend(
+                                _histogram_lines(full_name, labels, histogram)
+                            )
+                else:
+                    for (metric, labels), value in sorted(self._values.items()):
+                        if metric == name:
+                            series.append(
+                                f"{full_name}{_format_labels(labels)} {_number(value)}"
+                            )
+                if series:
+                    lines.append(f"# HELP {full_name} {description}")
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    lines.extend(series)
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        """Write metrics to the file, atomically."""
+        write_atomic(self.path, self.render())
+
+
+def _labels(name: str, labels: dict[str, str]) -> Labels:
+    if name not in METRICS:
+        raise ValueError(f"unknown metric {name}")
+    return tuple(sorted(labels.items()))
+
+
+def _histogram_lines(name: str, labels: Labels, histogram: list[float]) -> list[str]:
+    lines = []
+    cumulative = 0.0
+    for bound, count in zip((*BUCKETS, "+Inf"), histogram[:-1], strict=True):
+        cumulative += count
+        le = bound if isinstance(bound, str) else _number(bound)
+        bucket_labels = _format_labels((*labels, ("le", le)))
+        lines.append(f"{name}_bucket{bucket_labels} {_number(cumulative)}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {_number(histogram[-1])}")
+    lines.append(f"{name}_count{_format_labels(labels)} {_number(cumulative)}")
+    return lines
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
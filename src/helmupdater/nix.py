@@ -1,19 +1,88 @@
 """Nix operations for helmupdater."""
 
+from __future__ import annotations
+
 import functools
 import json
+import os
+import platform
 import re
+from enum import StrEnum
+from pathlib import Path
 from subprocess import CompletedProcess
+from typing import TYPE_CHECKING
 
-from helmupdater.chart.chart_metadata import ChartMetadata
+from helmupdater import charts_lock, eval_cache, git
 from helmupdater.utils import run_cmd
 
+if TYPE_CHECKING:
+    from helmupdater.chart.chart_metadata import ChartMetadata
+    from helmupdater.nix_repl import NixRepl
+
+
+class Engine(StrEnum):
+    """How chart derivations and metadata are evaluated."""
+
+    FLAKE = "flake"
+    """Through the flake outputs (`.#chartsDerivations`, `.#chartsMetadata`).
+    Every call copies the source tree to the store and loads all of `charts/`."""
+
+    FILE = "file"
+    """By importing the chart's default.nix (or taking its entry in the lock
+    file) directly, with flake inputs pinned from flake.lock. Cost doesn't
+    depend on the size of the collection, and charts don't have to be tracked
+    by git."""
+
+    REPL = "repl"
+    """Through the flake outputs, queried from a long-lived `nix repl` that loads
+    the flake once per run. Builds still go through `nix build`."""
+
+
+engine = Engine(os.environ.get("HELMUPDATER_NIX_ENGINE", Engine.FLAKE))
+
+# Files the flake outputs are evaluated from
+_FLAKE_INPUTS = ("charts", "flake.nix", "flake.lock")
+
+# Evaluates charts the same way as the `charts` flake output, without the flake.
+# Inputs are pinned from flake.lock, only the chart files in use are read.
+# Charts in the lock file are passed in as attribute sets.
+_CHARTS_EXPR = """
+let
+  lock = builtins.fromJSON (builtins.readFile {lock_path});
+  locked = name: lock.nodes.${{lock.nodes.root.inputs.${{name}}}}.locked;
+  pkgs = import (builtins.fetchTree (locked "nixpkgs")) {{
+    system = builtins.currentSystem;
+  }};
+  kubeGenerators = locked "nix-kube-generators";
+  kubelib = (builtins.getFlake
+    "github:${{kubeGenerators.owner}}/${{kubeGenerators.repo}}/${{kubeGenerators.rev}}"
+  ).lib {{ inherit pkgs; }};
+  trimBogusVersion = attrs: builtins.removeAttrs attrs [ "bogusVersion" ];
+  lockedChart = attrs: kubelib.downloadHelmChart (trimBogusVersion attrs);
+  chart = path: lockedChart (import path);
+in
+{charts}
+"""
+
+_repl_session: NixRepl | None = None
+
+
+def _repl() -> NixRepl:
+    global _repl_session
+    if _repl_session is None:
+        from helmupdater.nix_repl import NixRepl
+
+        _repl_session = NixRepl()
+    return _repl_session
+
 
 @functools.cache
 def current_system() -> str:
     """
     Get current Nix system architecture.
 
+    The result is kept in the cache directory between runs.
+
     Returns:
         System string (e.g., "x86_64-linux", "aarch64-darwin")
 
@@ -21,19 +90,104 @@ def current_system() -> str:
         >>> current_system()
         'aarch64-darwin'
     """
-    result = run_cmd(
-        "nix",
-        "eval",
+    key = f"{platform.system()}/{platform.machine()}"
+    system = eval_cache.get("currentSystem", key)
+    if system is not None:
+        return system
+
+    if engine == Engine.REPL:
+        system = _repl().eval_json("builtins.currentSystem")
+    else:
+        result = run_cmd(
+            "nix",
+            "eval",
+            "--impure",
+            "--expr",
+            "builtins.currentSystem",
+        )
+        # Strip quotes and whitespace from output like '"aarch64-darwin"\n'
+        system = result.stdout.strip().strip('"')
+
+    eval_cache.put("currentSystem", key, system)
+    return system
+
+
+def _nix_string(value: str) -> str:
+    # JSON string escapes are valid in nix, except that "${" starts interpolation
+    return json.dumps(value).replace("${", "\\${")
+
+
+def _nix_path(path: Path) -> str:
+    return f"(/. + {_nix_string(str(path.resolve()))})"
+
+
+def _nix_attrs(attrs: dict[str, str]) -> str:
+    return (
+        "{ "
+        + " ".join(f"{_nix_string(k)} = {_nix_string(v)};" for k, v in attrs.items())
+        + " }"
+    )
+
+
+def _chart_installables(
+    charts: list[tuple[str, str]], attr: str | None = None
+) -> list[str]:
+    """
+    Get `nix` arguments selecting derivations of charts.
+
+    Args:
+        charts: List of (repo_name, chart_name) tuples
+        attr: Optional attribute of the derivations to select (e.g. "drvPath")
+
+    Returns:
+        Installables for the flake engine, an expression with attribute paths
+        for the file engine
+    """
+    # Chart metadata is read from the lock file on disk
+    charts_lock.flush()
+    suffix = f".{attr}" if attr else ""
+    if engine in (Engine.FLAKE, Engine.REPL):
+        return [
+            f".#chartsDerivations.{current_system()}.{repo_name}.{chart_name}{suffix}"
+            for repo_name, chart_name in charts
+        ]
+
+    locked = charts_lock.load() or {}
+    repos: dict[str, dict[str, str]] = {}
+    for repo_name, chart_name in charts:
+        entry = locked.get(repo_name, {}).get(chart_name)
+        if entry is not None:
+            value = f"lockedChart {_nix_attrs(entry)}"
+        else:
+            chart_path = Path.cwd() / "charts" / repo_name / chart_name / "default.nix"
+            value = f"chart {_nix_path(chart_path)}"
+        repos.setdefault(repo_name, {})[chart_name] = value
+    charts_attrs = " ".join(
+        f"{_nix_string(repo_name)} = {{ "
+        + " ".join(f"{_nix_string(name)} = {value};" for name, value in repo.items())
+        + " };"
+        for repo_name, repo in repos.items()
+    )
+    expr = _CHARTS_EXPR.format(
+        lock_path=_nix_path(Path.cwd() / "flake.lock"),
+        charts=f"{{ {charts_attrs} }}",
+    )
+    return [
         "--impure",
         "--expr",
-        "builtins.currentSystem",
-    )
-    # Strip quotes and whitespace from output like '"aarch64-darwin"\n'
-    return result.stdout.strip().strip('"')
+        expr,
+        *(
+            f"{_nix_string(repo_name)}.{_nix_string(chart_name)}{suffix}"
+            for repo_name, chart_name in charts
+        ),
+    ]
 
 
 def build_chart(
-    repo_name: str, chart_name: str, raise_on_error: bool = True
+    repo_name: str,
+    chart_name: str,
+    raise_on_error: bool = True,
+    link: bool = True,
 ) -> CompletedProcess[str]:
     """
     Build Nix derivation for a Helm chart.
@@ -42,6 +196,7 @@ def build_chart(
         repo_name: Repository name
         chart_name: Chart name
         raise_on_error: If True, raise CalledProcessError on non-zero exit
+        link: If False, don't create the `result` symlink
 
     Returns:
         CompletedProcess with stdout and stderr
@@ -54,11 +209,59 @@ def build_chart(
     return run_cmd(
         "nix",
         "build",
-        f".#chartsDerivations.{current_system()}.{repo_name}.{chart_name}",
+        *([] if link else ["--no-link"]),
+        *_chart_installables([(repo_name, chart_name)]),
         raise_on_error=raise_on_error,
     )
 
 
+def build_charts(
+    charts: list[tuple[str, str]], max_jobs: int = 4
+) -> dict[tuple[str, str], bool]:
+    """
+    Build Nix derivations for several Helm charts in one nix invocation.
+
+    All charts are built by a single `nix build --keep-going`, so the flake is
+    evaluated once. If the batch fails, charts are built one by one to find out
+    which of them failed. Successful builds are already in the store at that point,
+    so this costs an evaluation per chart and no downloads.
+
+    Args:
+        charts: List of (repo_name, chart_name) tuples
+        max_jobs: Maximum number of derivations built in parallel
+
+    Returns:
+        Build result for every chart, True if it succeeded
+
+    Examples:
+        >>> build_charts([("local", "nginx"), ("local", "podinfo")])
+        {('local', 'nginx'): True, ('local', 'podinfo'): False}
+    """
+    if not charts:
+        return {}
+
+    result = run_cmd(
+        "nix",
+        "build",
+        "--no-link",
+        "--keep-going",
+        "--max-jobs",
+        str(max_jobs),
+        *_chart_installables(charts),
+        raise_on_error=False,
+    )
+    if result.returncode == 0:
+        return {chart: True for chart in charts}
+
+    results = {}
+    for repo_name, chart_name in charts:
+        chart_result = build_chart(
+            repo_name, chart_name, raise_on_error=False, link=False
+        )
+        results[(repo_name, chart_name)] = chart_result.returncode == 0
+    return results
+
+
 def get_hash(repo_name: str, chart_name: str) -> str:
     """
     Extract correct hash from failed Nix build output.
@@ -114,12 +317,23 @@ def _parse_build_mismatch_hash(output: str) -> str | None:
     return None
 
 
+def _repl_chart_attr(repo_name: str, chart_name: str, attr: str):
+    charts_lock.flush()
+    return _repl().eval_json(
+        f"chartsDerivations.${{builtins.currentSystem}}"
+        f".{_nix_string(repo_name)}.{_nix_string(chart_name)}.{attr}"
+    )
+
+
 def get_hash_derivation(repo_name: str, chart_name: str) -> str:
+    if engine == Engine.REPL:
+        return _repl_chart_attr(repo_name, chart_name, "outputHash")
+
     result = run_cmd(
         "nix",
         "derivation",
         "show",
-        f".#chartsDerivations.{current_system()}.{repo_name}.{chart_name}",
+        *_chart_installables([(repo_name, chart_name)]),
     )
     # Data structure with version:4 looks like this (trimmed for brevity):
     # {
@@ -135,26 +349,112 @@ def get_hash_derivation(repo_name: str, chart_name: str) -> str:
     return hash_value
 
 
+def get_derivation_path(repo_name: str, chart_name: str) -> str:
+    """
+    Evaluate the derivation of a Helm chart without building it.
+
+    Args:
+        repo_name: Repository name
+        chart_name: Chart name
+
+    Returns:
+        Store path of the derivation
+
+    Examples:
+        >>> get_derivation_path("local", "nginx")
+        '/nix/store/2r72dg8...-nginx-1.0.1.drv'
+    """
+    if engine == Engine.REPL:
+        return _repl_chart_attr(repo_name, chart_name, "drvPath")
+
+    result = run_cmd(
+        "nix",
+        "eval",
+        "--raw",
+        *_chart_installables([(repo_name, chart_name)], attr="drvPath"),
+    )
+    return result.stdout.strip()
+
+
+def check_derivation(drv_path: str) -> str | None:
+    """
+    Download a chart again and compare it with the hash of its derivation.
+
+    Outputs already in the store are rebuilt with `--rebuild`, which fetches the
+    chart from upstream and checks the result against the fixed output hash.
+    Outputs that are not in the store yet are simply built.
+
+    Args:
+        drv_path: Store path of the chart derivation
+
+    Returns:
+        None if the upstream archive matches, the actual hash otherwise
+
+    Raises:
+        RuntimeError: If the build failed for another reason than a hash mismatch
+
+    Examples:
+        >>> check_derivation("/nix/store/2r72dg8...-nginx-1.0.1.drv")
+        'sha256-2Wu51wd842yLn8ZRO9NunjzJhIqGkqEsU4qHzKKXjFY='
+    """
+    installable = f"{drv_path}^*"
+    result = run_cmd(
+        "nix", "build", "--no-link", "--rebuild", installable, raise_on_error=False
+    )
+    if result.returncode != 0 and "checking is not possible" in result.stderr:
+        result = run_cmd("nix", "build", "--no-link", installable, raise_on_error=False)
+
+    if result.returncode == 0:
+        return None
+
+    hash_value = _parse_build_mismatch_hash(result.stderr)
+    if hash_value is None:
+        raise RuntimeError(f"Failed to check {drv_path}:\n{result.stderr}")
+    return hash_value
+
+
 def get_charts() -> dict[str, dict[str, ChartMetadata]]:
     """
     Evaluate and return all chart metadata from Nix.
 
+    If the lock file is in use, charts are read from it instead, without nix.
+    Only charts missing from it are read from their chart files.
+
+    The evaluation result is kept in the cache directory between runs, keyed by
+    the content of `charts/`, `flake.nix` and `flake.lock` in the working tree.
+
     Returns:
         Nested dict structure: {repo_name: {chart_name: ChartMetadata}}
 
+    Raises:
+        ConflictError: If charts are in the lock file and have a chart file
+
     Examples:
         >>> charts = get_charts()
         >>> charts["local"]["nginx"]["version"]
         '1.0.0'
     """
-    result = run_cmd(
-        "nix",
-        "eval",
-        ".#chartsMetadata",
-        "--json",
-    )
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+    locked = charts_lock.load()
+    if locked is not None:
+        return _get_locked_charts(locked)
+
+    key = git.content_key(*_FLAKE_INPUTS)
+    data = eval_cache.get("chartsMetadata", key)
+    if data is None:
+        if engine == Engine.REPL:
+            data = _repl().eval_json("chartsMetadata")
+        else:
+            result = run_cmd(
+                "nix",
+                "eval",
+                ".#chartsMetadata",
+                "--json",
+            )
+            data = json.loads(result.stdout)
+        eval_cache.put("chartsMetadata", key, data)
 
-    data = json.loads(result.stdout)
     return {
         repo_name: {
             chart_name: ChartMetadata(**chart_info)
@@ -164,13 +464,58 @@ def get_charts() -> dict[str, dict[str, ChartMetadata]]:
     }
 
 
+def _get_locked_charts(
+    locked: charts_lock.Entries,
+) -> dict[str, dict[str, ChartMetadata]]:
+    from helmupdater import chart
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+    charts = {
+        repo_name: {
+            chart_name: ChartMetadata(**entry)
+            for chart_name, entry in repo_charts.items()
+        }
+        for repo_name, repo_charts in locked.items()
+    }
+    conflicts = []
+    for chart_path in sorted((Path.cwd() / "charts").glob("*/*/default.nix")):
+        repo_name, chart_name = chart_path.parts[-3:-1]
+        if chart_name in charts.get(repo_name, {}):
+            conflicts.append((repo_name, chart_name))
+            continue
+        charts.setdefault(repo_name, {})[chart_name] = chart.parse_chart_file(
+            chart_path.read_text()
+        ) or eval_chart_file(chart_path)
+    # The flake fails on these as well
+    if conflicts:
+        raise charts_lock.ConflictError(conflicts)
+    return charts
+
+
 def get_chart(repo_name: str, chart_name: str) -> ChartMetadata:
     """
     Evaluate and return specific chart metadata from Nix.
 
+    Charts in the lock file are read from it, without nix.
+
     Returns:
         ChartMetadata
     """
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+    chart_info = charts_lock.get(repo_name, chart_name)
+    if chart_info is not None:
+        return chart_info
+
+    if engine == Engine.FILE:
+        chart_path = Path.cwd() / "charts" / repo_name / chart_name / "default.nix"
+        return eval_chart_file(chart_path)
+    if engine == Engine.REPL:
+        return ChartMetadata(
+            **_repl().eval_json(
+                f"chartsMetadata.{_nix_string(repo_name)}.{_nix_string(chart_name)}"
+            )
+        )
     result = run_cmd(
         "nix",
         "eval",
@@ -179,3 +524,23 @@ def get_chart(repo_name: str, chart_name: str) -> ChartMetadata:
     )
     data = json.loads(result.stdout)
     return ChartMetadata(**data)
+
+
+def eval_chart_file(chart_path: Path) -> ChartMetadata:
+    """
+    Evaluate a chart file on its own, outside of the flake.
+
+    Args:
+        chart_path: Path to chart's default.nix file
+
+    Returns:
+        ChartMetadata
+
+    Examples:
+        >>> eval_chart_file(Path("charts/local/nginx/default.nix"))
+        ChartMetadata(repo='http://localhost:45010/', chart='nginx', ...)
+    """
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+    result = run_cmd("nix", "eval", "--json", "--file", str(chart_path))
+    return ChartMetadata(**json.loads(result.stdout))
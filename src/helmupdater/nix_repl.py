@@ -0,0 +1,159 @@
+"""Long-lived `nix repl` session for repeated flake queries."""
+
+import atexit
+import hashlib
+import itertools
+import json
+import os
+import re
+import subprocess
+import threading
+from pathlib import Path
+
+from helmupdater import metrics
+from helmupdater.logging import get_logger
+
+log = get_logger()
+
+# nix repl prints the prompt without a trailing newline, so it ends up in front
+# of the next line of output.
+_PROMPT = re.compile(r"^(?:nix-repl> )+")
+_STRING_ESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+
+
+class NixReplError(RuntimeError):
+    """Error reported by nix while evaluating an expression in the repl."""
+
+
+class NixRepl:
+    """
+    A `nix repl` process with the flake loaded, answering queries over stdin.
+
+    Starting nix, locking the flake inputs and instantiating the evaluator costs
+    seconds per process, while a query in an already running repl takes
+    milliseconds. The repl is restarted when files under `charts/` (or the git
+    index, `flake.lock` and `charts.lock.json`) change, as the flake it loaded
+    would be stale.
+    """
+
+    command: tuple[str, ...] = ("nix", "repl")
+
+    def __init__(self, flake: str = ".") -> None:
+        """
+        Prepare a session. The repl process is started on the first query.
+
+        Args:
+            flake: Flake reference to load
+        """
+        self.flake = flake
+        self._process: subprocess.Popen[str] | None = None
+        self._fingerprint: str | None = None
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def eval_json(self, expr: str):
+        """
+        Evaluate an expression in the scope of the flake outputs.
+
+        Args:
+            expr: Nix expression on a single line (e.g. "chartsMetadata.local")
+
+        Returns:
+            Value of the expression, decoded from JSON
+
+        Raises:
+            NixReplError: If nix fails to evaluate the expression
+
+        Examples:
+            >>> NixRepl().eval_json("chartsMetadata.local.nginx.version")
+            '1.0.1'
+        """
+        with self._lock:
+            fingerprint = _tree_fingerprint()
+            if self._process is None or fingerprint != self._fingerprint:
+                self._restart()
+                self._fingerprint = fingerprint
+            return json.loads(self._query(f"builtins.toJSON ({expr})"))
+
+    def close(self) -> None:
+        """Stop the repl process."""
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        if process.stdin:
+            process.stdin.close()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def _restart(self) -> None:
+        if self._process is not None:
+            log.debug("charts changed, restarting nix repl")
+        self.close()
+        metrics.inc("subprocesses_total", command=" ".join(self.command[:2]))
+        self._process = subprocess.Popen(
+            list(self.command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=dict(os.environ, NO_COLOR="1", TERM="dumb"),
+        )
+        self._query(f":lf {self.flake}", expect_value=False)
+
+    def _query(self, line: str, expect_value: bool = True) -> str:
+        process = self._process
+        assert process is not None and process.stdin and process.stdout
+
+        # The sentinel string is echoed back once the line before it is done,
+        # everything printed in between belongs to that line.
+        sentinel = f"__helmupdater_{next(self._counter)}__"
+        process.stdin.write(f"{line}\n{json.dumps(sentinel)}\n")
+        process.stdin.flush()
+
+        output = []
+        while True:
+            out_line = process.stdout.readline()
+            if not out_line:
+                self._process = None
+                raise NixReplError("nix repl exited unexpectedly:\n" + "".join(output))
+            out_line = _PROMPT.sub("", out_line).rstrip("\n")
+            if out_line == json.dumps(sentinel):
+                break
+            if out_line:
+                output.append(out_line)
+
+        values = [out for out in output if out.startswith('"')]
+        if any("error:" in out for out in output) or (expect_value and not values):
+            raise NixReplError(f"Failed to evaluate {line}:\n" + "\n".join(output))
+        return _parse_nix_string(values[-1]) if values else ""
+
+
+def _parse_nix_string(literal: str) -> str:
+    # Strings are printed as nix string literals: "...", with \", \\, \n, \r, \t
+    # and \${ escaped.
+    return re.sub(
+        r"\\(.)",
+        lambda m: _STRING_ESCAPES.get(m.group(1), m.group(1)),
+        literal[1:-1],
+    )
+
+
+def _tree_fingerprint() -> str:
+    digest = hashlib.sha256()
+    paths = [
+        Path("flake.nix"),
+        Path("flake.lock"),
+        Path("charts.lock.json"),
+        Path(".git") / "index",
+    ]
+    paths += sorted(Path("charts").glob("**/*.nix"))
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return digest.hexdigest()
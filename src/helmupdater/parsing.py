@@ -0,0 +1,155 @@
+"""Parsing of large documents (e.g. repository indexes) on all cores."""
+
+# Used for a forward reference to Executor
+from __future__ import annotations
+
+import atexit
+import os
+import sys
+import threading
+from enum import StrEnum
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from concurrent.futures import Executor
+
+
+class ExecutorKind(StrEnum):
+    """Where large documents are parsed."""
+
+    AUTO = "auto"
+    """Threads on free-threaded builds, else interpreters if available, else
+    processes."""
+
+    INLINE = "inline"
+    """In the calling thread."""
+
+    THREADS = "threads"
+    """In a thread pool. Runs in parallel on free-threaded builds only."""
+
+    INTERPRETERS = "interpreters"
+    """In a pool of subinterpreters, each with its own GIL (Python 3.14+).
+    Extension modules without subinterpreter support aren't available there,
+    YAML is parsed by the pure Python loader."""
+
+    PROCESSES = "processes"
+    """In a process pool. Documents and results are pickled across processes."""
+
+
+# Documents smaller than this are parsed inline, handing them over costs more
+# than parsing them
+MIN_PARALLEL_SIZE = 256 * 1024
+
+kind = ExecutorKind(os.environ.get("HELMUPDATER_PARSE_EXECUTOR", ExecutorKind.AUTO))
+
+_executor: Executor | None = None
+_executor_lock = threading.Lock()
+
+
+def resolve_kind(requested: ExecutorKind = ExecutorKind.AUTO) -> ExecutorKind:
+    """
+    Pick the executor for this interpreter.
+
+    Args:
+        requested: Requested kind, AUTO to pick the best available
+
+    Returns:
+        Kind of executor to use, never AUTO
+    """
+    if requested != ExecutorKind.AUTO:
+        return requested
+    if not getattr(sys, "_is_gil_enabled", lambda: True)():
+        return ExecutorKind.THREADS
+    import concurrent.futures
+
+    if hasattr(concurrent.futures, "InterpreterPoolExecutor"):
+        return ExecutorKind.INTERPRETERS
+    return ExecutorKind.PROCESSES
+
+
+def create_executor(executor_kind: ExecutorKind, max_workers: int) -> Executor:
+    """
+    Create an executor of the given kind.
+
+    Args:
+        executor_kind: Kind of executor, not AUTO or INLINE
+        max_workers: Maximum number of documents parsed at a time
+
+    Returns:
+        New executor
+    """
+    import concurrent.futures
+
+    if executor_kind == ExecutorKind.THREADS:
+        return concurrent.futures.ThreadPoolExecutor(max_workers)
+    if executor_kind == ExecutorKind.INTERPRETERS:
+        return concurrent.futures.InterpreterPoolExecutor(max_workers)
+    if executor_kind == ExecutorKind.PROCESSES:
+        return concurrent.futures.ProcessPoolExecutor(max_workers)
+    raise ValueError(f"no executor for {executor_kind}")
+
+
+def run[T](function: Callable[..., T], *args: Any) -> T:
+    """
+    Run a CPU-bound function on the shared executor and wait for it.
+
+    The calling thread releases the GIL while waiting, so threads handing work
+    over (e.g. charts checked concurrently) parse in parallel. The function and
+    its arguments have to be picklable: a function of a module, and plain data.
+
+    Args:
+        function: Module-level function
+        *args: Arguments of the function
+
+    Returns:
+        Result of the function
+    """
+    global _executor
+    executor_kind = resolve_kind(kind)
+    if executor_kind == ExecutorKind.INLINE:
+        return function(*args)
+    with _executor_lock:
+        if _executor is None:
+            _executor = create_executor(executor_kind, os.process_cpu_count() or 1)
+    return _executor.submit(function, *args).result()
+
+
+def shutdown() -> None:
+    """Stop the shared executor, if started."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+atexit.register(shutdown)
+
+
+def load_yaml(content: str) -> Any:
+    """
+    Parse a YAML document, on the shared executor if it's large.
+
+    Args:
+        content: YAML document
+
+    Returns:
+        Parsed document
+
+    Examples:
+        >>> load_yaml("entries: {}")
+        {'entries': {}}
+    """
+    if len(content) < MIN_PARALLEL_SIZE:
+        return parse_yaml(content)
+    return run(parse_yaml, content)
+
+
+def parse_yaml(content: str) -> Any:
+    """Parse a YAML document with the fastest safe loader available."""
+    import yaml
+
+    # libyaml isn't available in subinterpreters
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(content, Loader=loader)
@@ -0,0 +1,294 @@
+"""CPU and memory profiles of a run, split by chart and phase (`--profile`)."""
+
+# Used for forward references to Session
+from __future__ import annotations
+
+import contextlib
+import io
+import threading
+import time
+from collections.abc import Generator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from helmupdater import metrics
+from helmupdater.logging import event, events_enabled, get_logger
+
+if TYPE_CHECKING:
+    import cProfile
+    import pstats
+
+log = get_logger()
+
+# Phases of a run, as passed to `phase`
+PHASES = ("metadata", "registry", "versions", "hashing", "git")
+
+# Allocation sites and functions listed per phase in the summary
+TOP_ALLOCATIONS = 10
+TOP_FUNCTIONS = 10
+
+# Frames kept per allocation by tracemalloc
+TRACEBACK_DEPTH = 1
+
+# Phases outside of any chart
+RUN = "(run)"
+
+_session: Session | None = None
+_disabled = contextlib.nullcontext()
+
+
+def phase(
+    name: str, chart: str | None = None
+) -> contextlib.AbstractContextManager[None]:
+    """
+    Mark a phase of a run for profiling.
+
+    The duration of the phase is recorded in metrics (`--metrics-file`) and
+    emitted as a "phase.finished" event (`--log-format json`). Without any of
+    those or `--profile`, this returns a shared no-op context manager, so
+    marking phases costs nothing.
+
+    Args:
+        name: Name of the phase, one of PHASES
+        chart: Chart the phase works on ("repo/chart"), None for the whole run
+
+    Returns:
+        Context manager delimiting the phase
+
+    Examples:
+        >>> with profiling.phase("registry", "bitnami/nginx"):
+        ...     versions = repo.get_versions("nginx")
+    """
+    if _session is None and metrics.collector is None and not events_enabled():
+        return _disabled
+    return _phase(name, chart)
+
+
+@contextlib.contextmanager
+def _phase(name: str, chart: str | None) -> Generator[None]:
+    profile = _session.phase(name, chart) if _session is not None else _disabled
+    error = None
+    started = time.perf_counter()
+    try:
+        with profile:
+            yield
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("phase_duration_seconds", elapsed, phase=name)
+        repo_name, _, chart_name = (chart or "").partition("/")
+        event(
+            "phase.finished",
+            repo=repo_name or None,
+            chart=chart_name or None,
+            phase=name,
+            seconds=elapsed,
+            error=error,
+        )
+
+
+def start(directory: Path) -> None:
+    """
+    Start profiling phases of the run.
+
+    Args:
+        directory: Directory to write profiles to, created if missing
+    """
+    global _session
+    _session = Session(directory)
+
+
+def stop() -> None:
+    """Stop profiling and write the profiles collected so far."""
+    global _session
+    if _session is None:
+        return
+    session, _session = _session, None
+    session.close()
+
+
+@dataclass
+class PhaseStats:
+    """Profile of a phase of a chart, accumulated over its occurrences."""
+
+    profile: cProfile.Profile
+    calls: int = 0
+    seconds: float = 0.0
+    peak_memory: int = 0
+    allocations: dict[str, int] = field(default_factory=dict)
+    """Bytes allocated and not freed within the phase, by source line"""
+
+
+class Session:
+    """
+    Profiles of phases of a run.
+
+    Every phase of every chart gets a cProfile profile, the peak of traced memory
+    and the allocations it left behind (a tracemalloc snapshot compared with
+    the one taken when the phase started). Phases are profiled in the thread
+    that started the session; phases running in other threads (e.g. concurrent
+    hashing) are only timed. When phases nest, the outer phase is paused while
+    the inner one runs.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        import tracemalloc
+
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._stats: dict[tuple[str, str], PhaseStats] = {}
+        self._active: list[PhaseStats] = []
+        self._thread = threading.get_ident()
+        self._lock = threading.Lock()
+        tracemalloc.start(TRACEBACK_DEPTH)
+
+    def _get_stats(self, chart: str, name: str) -> PhaseStats:
+        import cProfile
+
+        with self._lock:
+            if (chart, name) not in self._stats:
+                self._stats[chart, name] = PhaseStats(cProfile.Profile())
+            return self._stats[chart, name]
+
+    @contextlib.contextmanager
+    def phase(self, name: str, chart: str | None = None) -> Generator[None]:
+        """Profile a phase, see `helmupdater.profiling.phase`."""
+        import tracemalloc
+
+        stats = self._get_stats(chart or RUN, name)
+        profiled = threading.get_ident() == self._thread
+        if profiled:
+            outer = self._active[-1] if self._active else None
+            if outer is not None:
+                outer.profile.disable()
+            before = _snapshot()
+            tracemalloc.reset_peak()
+            self._active.append(stats)
+            stats.profile.enable()
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats.calls += 1
+                stats.seconds += elapsed
+            if profiled:
+                stats.profile.disable()
+                self._active.pop()
+                peak = tracemalloc.get_traced_memory()[1]
+                stats.peak_memory = max(stats.peak_memory, peak)
+                for diff in _snapshot().compare_to(before, "lineno")[:TOP_ALLOCATIONS]:
+                    site = str(diff.traceback[0])
+                    stats.allocations[site] = (
+                        stats.allocations.get(site, 0) + diff.size_diff
+                    )
+                if outer is not None:
+                    outer.peak_memory = max(outer.peak_memory, peak)
+                    outer.profile.enable()
+
+    def close(self) -> None:
+        """Stop tracing memory and write profiles and the summary."""
+        import tracemalloc
+
+        tracemalloc.stop()
+        for (chart, name), stats in self._stats.items():
+            path = self.directory / _pstats_path(chart, name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            stats.profile.dump_stats(path)
+
+        summary = self.directory / "summary.txt"
+        summary.write_text(self.summary())
+        log.info(f"profiles written to {self.directory}", summary=str(summary))
+
+    def summary(self) -> str:
+        """
+        Describe the profiles, grouped by chart.
+
+        Returns:
+            Time, peak memory, top allocation sites and the slowest functions
+            (cumulative time) of every phase of every chart
+        """
+        charts: dict[str, list[tuple[str, PhaseStats]]] = {}
+        for (chart, name), stats in sorted(
+            self._stats.items(), key=lambda item: _phase_order(*item[0])
+        ):
+            charts.setdefault(chart, []).append((name, stats))
+
+        out = io.StringIO()
+        for chart, phases in charts.items():
+            total = sum(stats.seconds for _, stats in phases)
+            out.write(f"{chart}  {total:.3f}s\n")
+            for name, stats in phases:
+                out.write(
+                    f"  {name}: {stats.calls} call(s), {stats.seconds:.3f}s, "
+                    f"peak {_format_size(stats.peak_memory)}\n"
+                )
+                allocations = sorted(
+                    stats.allocations.items(), key=lambda item: -abs(item[1])
+                )
+                for site, size in allocations[:TOP_ALLOCATIONS]:
+                    out.write(f"    {_format_size(size, sign=True):>12}  {site}\n")
+                for line in _top_functions(stats.profile):
+                    out.write(f"    {line}\n")
+            out.write("\n")
+        return out.getvalue()
+
+
+def _snapshot():
+    import tracemalloc
+
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )
+    )
+
+
+def _top_functions(profile: cProfile.Profile) -> list[str]:
+    import pstats
+
+    profile.create_stats()
+    if not profile.stats:
+        return []
+    functions = pstats.Stats(profile).get_stats_profile().func_profiles
+    entries = sorted(functions.items(), key=lambda item: -item[1].cumtime)
+    return [
+        f"{function.cumtime:10.3f}s  {_function_name(name, function)}"
+        for name, function in entries[:TOP_FUNCTIONS]
+    ]
+
+
+def _function_name(name: str, function: pstats.FunctionProfile) -> str:
+    # Built-ins have no file, their name says what they are
+    if function.file_name == "~":
+        return name
+    return f"{function.file_name}:{function.line_number}({name})"
+
+
+def _phase_order(chart: str, name: str) -> tuple[bool, str, int]:
+    index = PHASES.index(name) if name in PHASES else len(PHASES)
+    return chart != RUN, chart, index
+
+
+def _pstats_path(chart: str, name: str) -> Path:
+    if chart == RUN:
+        return Path(f"run.{name}.pstats")
+    # One directory per repository, names may contain "_" or "."
+    repo_name, _, chart_name = chart.partition("/")
+    return Path(repo_name, f"{chart_name}.{name}.pstats")
+
+
+def _format_size(size: float, sign: bool = False) -> str:
+    prefix = ("+" if size >= 0 else "-") if sign else ""
+    size = abs(size)
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{prefix}{size:.1f} {unit}"
+        size /= 1024
+    return f"{prefix}{size:.1f} GiB"
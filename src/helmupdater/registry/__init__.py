@@ -1,12 +1,35 @@
 """Registry module for Helm chart repository abstractions."""
 
+# Registry implementations pull in requests, yaml and oras. They are imported
+# only when a registry is actually used (see `__getattr__`), which keeps
+# commands that never touch a registry fast to start.
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse
 
-from .base import Registry
-from .http import HTTPRegistry
-from .oci import OCIRegistry
+if TYPE_CHECKING:
+    from .base import ChartNotFoundError, Registry
+    from .http import HTTPRegistry
+    from .oci import OCIRegistry
+
+__all__ = ["ChartNotFoundError", "Registry", "HTTPRegistry", "OCIRegistry", "create"]
+
+_LAZY_ATTRS = {
+    "ChartNotFoundError": ".base",
+    "Registry": ".base",
+    "HTTPRegistry": ".http",
+    "OCIRegistry": ".oci",
+}
+
 
-__all__ = ["Registry", "HTTPRegistry", "OCIRegistry", "create"]
+def __getattr__(name: str):
+    if name in _LAZY_ATTRS:
+        import importlib
+
+        module = importlib.import_module(_LAZY_ATTRS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def create(url: str, name: str, **kwargs) -> Registry:
@@ -36,8 +59,12 @@ def create(url: str, name: str, **kwargs) -> Registry:
     parsed = urlparse(url)
 
     if parsed.scheme == "oci":
+        from .oci import OCIRegistry
+
         return OCIRegistry(url, name, **kwargs)
     elif parsed.scheme in ("http", "https"):
+        from .http import HTTPRegistry
+
         return HTTPRegistry(url, name, **kwargs)
     else:
         raise ValueError(f"Unsupported registry scheme: {parsed.scheme}")
@@ -5,6 +5,10 @@ from typing import Protocol
 from helmupdater.chart.chart_version import ChartVersion
 
 
+class ChartNotFoundError(ValueError):
+    """Chart doesn't exist in the registry."""
+
+
 class Registry(Protocol):
     """
     Protocol defining the interface for Helm chart registries.
@@ -25,7 +29,33 @@ class Registry(Protocol):
 
         Raises:
             requests.exceptions.ConnectionError: If registry is unreachable
-            ValueError: If chart is not found
+            ChartNotFoundError: If chart is not found
+        """
+        ...
+
+    def get_digest(self, chart_name: str, version: str) -> str | None:
+        """
+        Get the digest of a chart archive, without downloading it.
+
+        Args:
+            chart_name: Name of the Helm chart
+            version: Chart version
+
+        Returns:
+            Digest of the archive (e.g. "sha256:abc..."), or None if the registry
+            doesn't publish one
+        """
+        ...
+
+    def list_charts(self) -> list[str]:
+        """
+        List names of all charts in the registry.
+
+        Returns:
+            List of chart names
+
+        Raises:
+            ValueError: If the registry can't be listed
         """
         ...
 
@@ -1,9 +1,45 @@
 """HTTP-based Helm chart repository implementation."""
 
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
 import requests
-import yaml
 
+from helmupdater import history, metrics
 from helmupdater.chart.chart_version import ChartVersion, parse_versions
+from helmupdater.registry.base import ChartNotFoundError
+from helmupdater.registry.index_cache import IndexCache
+from helmupdater.registry.latency import MAX_TRANSFER, Timeouts, profiles
+from helmupdater.registry.ratelimit import scheduler
+from helmupdater.utils import cache_dir, write_atomic
+
+CHUNK_SIZE = 64 * 1024
+
+# Whether repositories serve the ChartMuseum API, by base URL. Kept in the cache
+# directory, so a repository is probed once.
+_chart_api_support: dict[str, bool] | None = None
+_chart_api_lock = threading.Lock()
+
+
+def _supports_chart_api(base_url: str) -> bool | None:
+    global _chart_api_support
+    with _chart_api_lock:
+        if _chart_api_support is None:
+            try:
+                path = cache_dir() / "chart_api.json"
+                _chart_api_support = json.loads(path.read_text())
+            except (FileNotFoundError, ValueError):
+                _chart_api_support = {}
+        return _chart_api_support.get(base_url)
+
+
+def _set_chart_api_support(base_url: str, supported: bool) -> None:
+    with _chart_api_lock:
+        assert _chart_api_support is not None
+        _chart_api_support[base_url] = supported
+        write_atomic(cache_dir() / "chart_api.json", json.dumps(_chart_api_support))
 
 
 class HTTPRegistry:
@@ -12,15 +48,26 @@ class HTTPRegistry:
 
     This implements the standard Helm repository format using index.yaml
     for chart metadata and HTTP(S) URLs for chart downloads.
+
+    Versions of a single chart are fetched from the ChartMuseum API
+    (`/api/charts/<name>`) when the repository serves it, which avoids downloading
+    and parsing the index of the whole repository. Other repositories fall back
+    to index.yaml, which is kept in the cache directory and revalidated with a
+    conditional request (see `IndexCache`).
+
+    An instance can be shared by threads checking charts of the same repository,
+    the index is fetched once.
     """
 
-    def __init__(self, base_url: str, name: str, timeout: int = 5) -> None:
+    def __init__(self, base_url: str, name: str, timeout: float | None = None) -> None:
         """
         Initialize HTTP registry.
 
         Args:
             base_url: Base URL of the Helm repository
-            timeout: HTTP request timeout in seconds (default: 5)
+            timeout: HTTP connect and first byte timeout in seconds. By default,
+                timeouts are derived from the latency of the host in previous
+                runs (see `helmupdater.registry.latency`).
 
         Examples:
             >>> registry = HTTPRegistry("https://prometheus-community.github.io/helm-charts")
@@ -28,32 +75,222 @@ class HTTPRegistry:
         self.base_url = base_url.rstrip("/") + "/"
         self.name = name
         self.timeout = timeout
+        self._index: dict | None = None
+        self._index_cache: IndexCache | None = None
+        self._entries: dict[str, list[dict]] = {}
+        self._index_lock = threading.RLock()
 
-    def _fetch_raw_versions(self, chart_name: str) -> list[str]:
+    def _get_index_cache(self) -> IndexCache:
+        """
+        Bring the cached index.yaml up to date, once per registry instance.
+
+        Returns:
+            Cache holding the current index.yaml
+
+        Raises:
+            requests.exceptions.HTTPError: If the registry responds with an error
+        """
+        with self._index_lock:
+            if self._index_cache is None:
+                cache = IndexCache(f"{self.base_url}index.yaml")
+                response, content = self._get(cache.url, cache.conditional_headers())
+                if response.status_code != 304:
+                    response.raise_for_status()
+                    cache.store(
+                        content,
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    )
+                self._index_cache = cache
+            return self._index_cache
+
+    def _get_index(self) -> dict:
+        """
+        Fetch and parse the whole index.yaml, once per registry instance.
+
+        Returns:
+            Parsed index.yaml
+
+        Raises:
+            requests.exceptions.HTTPError: If the registry responds with an error
         """
-        Fetch raw version strings from index.yaml.
+        with self._index_lock:
+            if self._index is None:
+                self._index = self._get_index_cache().load()
+            return self._index
+
+    def _get(
+        self, url: str, headers: dict[str, str] | None = None
+    ) -> tuple[requests.Response, bytes]:
+        """
+        Send a GET request to the repository host within its limits.
+
+        Args:
+            url: URL to request
+            headers: Additional request headers
+
+        Returns:
+            Response and its body
+        """
+        host = urlparse(url).netloc
+        if self.timeout is None:
+            timeouts = profiles.timeouts(host)
+        else:
+            timeouts = Timeouts(self.timeout, self.timeout, MAX_TRANSFER)
+
+        response = scheduler.call(
+            host,
+            lambda: requests.get(
+                url,
+                headers=headers,
+                timeout=(timeouts.connect, timeouts.first_byte),
+                stream=True,
+            ),
+        )
+
+        started = time.monotonic()
+        content = self._read_body(response, timeouts.transfer)
+        first_byte = response.elapsed.total_seconds()
+        transfer = time.monotonic() - started
+        profiles.record(
+            host,
+            first_byte=first_byte,
+            transfer=transfer,
+            size=len(content),
+            status=response.status_code,
+        )
+        metrics.observe(
+            "registry_request_duration_seconds", first_byte + transfer, host=host
+        )
+        history.add("registry_requests", 1)
+        history.add("registry_seconds", first_byte + transfer)
+        history.add("registry_bytes", len(content))
+        return response, content
+
+    def _chart_api_url(self, chart_name: str) -> str:
+        # ChartMuseum serves repositories at /<path>/ and their API at
+        # /api/<path>/charts/
+        parsed = urlparse(self.base_url)
+        return parsed._replace(path=f"/api{parsed.path}charts/{chart_name}").geturl()
+
+    def _fetch_api_entries(self, chart_name: str) -> list[dict] | None:
+        """
+        Fetch entries of a chart from the ChartMuseum API.
 
         Args:
             chart_name: Name of the Helm chart
 
         Returns:
-            List of raw version strings
+            Entries of the chart, as in index.yaml, or None if the repository
+            doesn't serve the API
 
         Raises:
-            ValueError: If chart is not found in index.yaml
+            ChartNotFoundError: If the API reports that the chart doesn't exist
         """
-        response = requests.get(
-            f"{self.base_url}index.yaml",
-            timeout=self.timeout,
-        )
-        response.encoding = "utf8"
-        index = yaml.safe_load(response.text)
+        response, content = self._get(self._chart_api_url(chart_name))
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = None
+
+        # ChartMuseum answers with a JSON list of versions, or a JSON error
+        # object for missing charts. Other answers (usually an HTML 404 page)
+        # mean there is no API, except server errors which say nothing.
+        if response.status_code >= 500:
+            return None
+        if response.status_code == 200 and isinstance(data, list):
+            supported = True
+        elif response.status_code == 404 and isinstance(data, dict) and "error" in data:
+            supported = True
+        else:
+            supported = False
+        if _supports_chart_api(self.base_url) != supported:
+            _set_chart_api_support(self.base_url, supported)
+
+        if not supported:
+            return None
+        if not isinstance(data, list):
+            raise ChartNotFoundError(f"Chart {chart_name} is not found in the repo.")
+        return data
+
+    @staticmethod
+    def _read_body(response: requests.Response, limit: float) -> bytes:
+        """
+        Read a streamed response body within a time limit.
 
-        chart_entries = index.get("entries", {}).get(chart_name)
+        Args:
+            response: Response of a request made with stream=True
+            limit: Maximum time to spend on the transfer, in seconds
+
+        Returns:
+            Response body
+
+        Raises:
+            requests.exceptions.Timeout: If the transfer takes longer than limit
+        """
+        deadline = time.monotonic() + limit
+        chunks = []
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                response.close()
+                raise requests.exceptions.Timeout(
+                    f"{response.url}: transfer took longer than {limit:.0f}s"
+                )
+        return b"".join(chunks)
+
+    def _fetch_entries(self, chart_name: str) -> list[dict]:
+        """
+        Fetch entries of a chart from the ChartMuseum API or index.yaml.
+
+        Entries are fetched once per registry instance.
+
+        Args:
+            chart_name: Name of the Helm chart
+
+        Returns:
+            Entries of the chart (version, digest, urls, ...)
+
+        Raises:
+            ChartNotFoundError: If chart is not found in the repository
+        """
+        if chart_name not in self._entries:
+            self._entries[chart_name] = self._fetch_uncached_entries(chart_name)
+        return self._entries[chart_name]
+
+    def _fetch_uncached_entries(self, chart_name: str) -> list[dict]:
+        # An index fetched already (e.g. to list charts) answers without requests
+        if (
+            self._index is None
+            and self._index_cache is None
+            and _supports_chart_api(self.base_url) is not False
+        ):
+            entries = self._fetch_api_entries(chart_name)
+            if entries is not None:
+                return entries
+
+        if self._index is not None:
+            chart_entries = self._index.get("entries", {}).get(chart_name)
+        else:
+            chart_entries = self._get_index_cache().lookup(chart_name)
         if chart_entries is None:
-            raise ValueError(f"Chart {chart_name} is not found in the repo.")
+            raise ChartNotFoundError(f"Chart {chart_name} is not found in the repo.")
+        return chart_entries
 
-        return [entry["version"] for entry in chart_entries]
+    def _fetch_raw_versions(self, chart_name: str) -> list[str]:
+        """
+        Fetch raw version strings from the ChartMuseum API or index.yaml.
+
+        Args:
+            chart_name: Name of the Helm chart
+
+        Returns:
+            List of raw version strings
+
+        Raises:
+            ChartNotFoundError: If chart is not found in the repository
+        """
+        return [entry["version"] for entry in self._fetch_entries(chart_name)]
 
     def get_versions(self, chart_name: str) -> list[ChartVersion]:
         """
@@ -67,7 +304,7 @@ class HTTPRegistry:
 
         Raises:
             requests.exceptions.ConnectionError: If registry is unreachable
-            ValueError: If chart is not found in index.yaml
+            ChartNotFoundError: If chart is not found in index.yaml
             ValueError: If all version entries fail parsing
         """
         versions_raw = self._fetch_raw_versions(chart_name)
@@ -78,6 +315,35 @@ class HTTPRegistry:
         )
         return [v for v in versions if v.is_stable]
 
+    def get_digest(self, chart_name: str, version: str) -> str | None:
+        """
+        Get the digest of a chart archive from its entry in index.yaml.
+
+        Args:
+            chart_name: Name of the Helm chart
+            version: Chart version
+
+        Returns:
+            SHA-256 digest of the archive ("sha256:<hex>"), or None if the entry
+            has none
+        """
+        for entry in self._fetch_entries(chart_name):
+            if entry.get("version") == version and entry.get("digest"):
+                digest = entry["digest"]
+                return digest if ":" in digest else f"sha256:{digest}"
+        return None
+
+    def list_charts(self) -> list[str]:
+        """
+        List names of all charts in the repository.
+
+        Returns:
+            Chart names from index.yaml
+        """
+        if self._index is not None:
+            return list(self._index.get("entries", {}))
+        return self._get_index_cache().chart_names()
+
     @property
     def registry_type(self) -> str:
         """Return registry type identifier."""
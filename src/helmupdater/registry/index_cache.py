@@ -0,0 +1,222 @@
+"""On-disk cache of repository indexes with per-chart byte offsets."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+from pathlib import Path
+from typing import Any
+
+from helmupdater.parsing import load_yaml
+from helmupdater.utils import cache_dir, write_atomic
+
+
+def scan_offsets(content: bytes) -> dict[str, tuple[int, int]] | None:
+    """
+    Find the byte range of every chart under `entries:` in one pass.
+
+    Indexes written by helm (and ChartMuseum) are block-style YAML, with chart
+    names as keys of the top-level `entries` mapping:
+
+        entries:
+          nginx:
+          - version: 1.0.0
+          podinfo:
+          ...
+
+    Args:
+        content: index.yaml
+
+    Returns:
+        Dict of chart name to (start, end) offsets of its key and entries, or
+        None if the index isn't laid out like this
+    """
+    offsets: dict[str, tuple[int, int]] = {}
+    in_entries = False
+    key_indent: int | None = None
+    current: str | None = None
+    start = position = 0
+
+    for line in content.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped and not stripped.startswith(b"#"):
+            indent = len(line) - len(line.lstrip(b" "))
+            if not in_entries:
+                if indent == 0 and stripped.startswith(b"entries:"):
+                    if stripped != b"entries:":
+                        # flow style, e.g. "entries: {}"
+                        return None
+                    in_entries = True
+            elif indent == 0:
+                break
+            else:
+                if key_indent is None:
+                    key_indent = indent
+                if indent == key_indent and not stripped.startswith(b"-"):
+                    if current is not None:
+                        offsets[current] = (start, position)
+                    name, colon, _ = stripped.partition(b":")
+                    if not colon:
+                        return None
+                    current = name.strip(b"\"'").decode()
+                    start = position
+        position += len(line)
+
+    if not in_entries:
+        return None
+    if current is not None:
+        offsets[current] = (start, position)
+    return offsets
+
+
+class IndexCache:
+    """
+    A repository index stored in the cache directory, with a sidecar of offsets.
+
+    The sidecar maps every chart to its byte range in the index. It's built when
+    the index is stored, so looking up a chart maps the file into memory and
+    parses only the chart's slice, however large the repository is. Validators
+    of the stored index (`ETag`, `Last-Modified`) are kept in the sidecar too,
+    for conditional requests.
+    """
+
+    def __init__(self, url: str) -> None:
+        """
+        Args:
+            url: URL of the index
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        directory = cache_dir() / "index"
+        directory.mkdir(exist_ok=True)
+        self.url = url
+        self.path = directory / f"{key}.yaml"
+        self.sidecar_path = directory / f"{key}.json"
+        self._sidecar: dict[str, Any] | None = None
+        self._document: dict | None = None
+
+    @property
+    def sidecar(self) -> dict[str, Any]:
+        """Validators and chart offsets of the stored index."""
+        if self._sidecar is None:
+            try:
+                self._sidecar = json.loads(self.sidecar_path.read_text())
+            except (FileNotFoundError, ValueError):
+                self._sidecar = {}
+            # The index may have been replaced by another process in between,
+            # possibly by one of the same size
+            if self._sidecar.get("stamp") != _file_stamp(self.path):
+                self._sidecar = {}
+        return self._sidecar
+
+    def conditional_headers(self) -> dict[str, str]:
+        """
+        Get headers making a request for the index conditional.
+
+        Returns:
+            `If-None-Match` / `If-Modified-Since` headers, empty if nothing is
+            stored
+        """
+        headers = {}
+        if self.sidecar.get("etag"):
+            headers["If-None-Match"] = self.sidecar["etag"]
+        if self.sidecar.get("last_modified"):
+            headers["If-Modified-Since"] = self.sidecar["last_modified"]
+        return headers
+
+    def store(
+        self,
+        content: bytes,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        """
+        Store a new version of the index and build its sidecar.
+
+        Args:
+            content: index.yaml
+            etag: `ETag` header of the response
+            last_modified: `Last-Modified` header of the response
+        """
+        offsets = scan_offsets(content)
+        write_atomic(self.path, content)
+        self._sidecar = {
+            "url": self.url,
+            "stamp": _file_stamp(self.path),
+            "etag": etag,
+            "last_modified": last_modified,
+            "charts": offsets,
+        }
+        write_atomic(self.sidecar_path, json.dumps(self._sidecar))
+        self._document = None
+
+    def chart_names(self) -> list[str]:
+        """
+        List charts in the stored index.
+
+        Returns:
+            Chart names, in the order of the index
+        """
+        offsets = self.sidecar.get("charts")
+        if offsets is None:
+            return list(self.load().get("entries", {}))
+        return list(offsets)
+
+    def lookup(self, chart_name: str) -> list[dict] | None:
+        """
+        Get the entries of a chart in the stored index.
+
+        Only the chart's slice of the index is parsed, unless the index has no
+        usable offsets or the slice doesn't parse on its own (e.g. it refers to
+        an anchor defined in another chart).
+
+        Args:
+            chart_name: Name of the Helm chart
+
+        Returns:
+            Entries of the chart, or None if it isn't in the index
+        """
+        offsets = self.sidecar.get("charts")
+        if offsets is None:
+            return self.load().get("entries", {}).get(chart_name)
+        if chart_name not in offsets:
+            return None
+
+        start, end = offsets[chart_name]
+        with (
+            open(self.path, "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+        ):
+            chunk = mapped[start:end]
+        import yaml
+
+        try:
+            document = load_yaml(chunk.decode("utf8"))
+        except yaml.YAMLError:
+            document = None
+        if not isinstance(document, dict) or chart_name not in document:
+            return self.load().get("entries", {}).get(chart_name)
+        return document[chart_name]
+
+    def load(self) -> dict:
+        """
+        Parse the whole stored index.
+
+        Large indexes are parsed on another core (see `helmupdater.parsing`), so
+        several of them can be parsed at once.
+
+        Returns:
+            Parsed index.yaml
+        """
+        if self._document is None:
+            self._document = load_yaml(self.path.read_text(encoding="utf8"))
+        return self._document
+
+
+def _file_stamp(path: Path) -> list[int] | None:
+    # A list, to compare equal to its JSON round trip
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
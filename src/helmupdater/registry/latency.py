@@ -0,0 +1,161 @@
+"""Registry request timeouts derived from latency observed in previous runs."""
+
+from __future__ import annotations
+
+import atexit
+import json
+import statistics
+import threading
+from dataclasses import dataclass
+
+from helmupdater.utils import cache_dir, write_atomic
+
+# Samples kept per host, most recent last
+MAX_SAMPLES = 50
+# Below this many samples the defaults are used
+MIN_SAMPLES = 5
+
+# Timeouts are this many times the 95th percentile of observed values, within
+# the bounds below.
+HEADROOM = 4.0
+
+DEFAULT_CONNECT = 5.0
+MIN_CONNECT, MAX_CONNECT = 1.0, 10.0
+
+DEFAULT_FIRST_BYTE = 5.0
+MIN_FIRST_BYTE, MAX_FIRST_BYTE = 2.0, 30.0
+
+# Transfer limits are derived from the 5th percentile of observed throughput
+# and the largest observed response, so a large index on a slow CDN gets more
+# time. Only successful responses with a body count, headers-only answers (e.g.
+# 304 revalidations) and error pages say nothing about throughput.
+DEFAULT_TRANSFER = 60.0
+MIN_TRANSFER, MAX_TRANSFER = 10.0, 300.0
+
+
+@dataclass(frozen=True)
+class Timeouts:
+    """Timeouts for a request to a host, in seconds."""
+
+    connect: float
+    """Establishing the connection"""
+
+    first_byte: float
+    """From sending the request to receiving the response headers"""
+
+    transfer: float
+    """Receiving the response body"""
+
+
+def _p95(values: list[float]) -> float:
+    return statistics.quantiles(values, n=20, method="inclusive")[18]
+
+
+def _p5(values: list[float]) -> float:
+    return statistics.quantiles(values, n=20, method="inclusive")[0]
+
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return max(low, min(value, high))
+
+
+class LatencyProfiles:
+    """
+    Latency and size of recent responses of every registry host.
+
+    Samples are kept in the cache directory, so timeouts adapt over runs: hosts
+    that are fast get short timeouts and fail fast when they go down, while
+    hosts serving large indexes slowly get enough time to finish.
+    """
+
+    def __init__(self) -> None:
+        self._samples: dict[str, list[dict[str, float]]] | None = None
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    @property
+    def samples(self) -> dict[str, list[dict[str, float]]]:
+        """Samples of every host, loaded from the cache directory on first use."""
+        if self._samples is None:
+            try:
+                self._samples = json.loads((cache_dir() / "latency.json").read_text())
+            except (FileNotFoundError, ValueError):
+                self._samples = {}
+        return self._samples
+
+    def timeouts(self, host: str) -> Timeouts:
+        """
+        Get timeouts for a request to a host.
+
+        Args:
+            host: Host name
+
+        Returns:
+            Timeouts derived from the host's samples, defaults if there are
+            too few of them
+        """
+        with self._lock:
+            samples = list(self.samples.get(host, []))
+        if len(samples) < MIN_SAMPLES:
+            return Timeouts(DEFAULT_CONNECT, DEFAULT_FIRST_BYTE, DEFAULT_TRANSFER)
+
+        first_byte = _p95([s["first_byte"] for s in samples]) * HEADROOM
+        downloads = [
+            s for s in samples if s["size"] > 0 and 200 <= s.get("status", 200) < 300
+        ]
+        if len(downloads) < MIN_SAMPLES:
+            transfer = DEFAULT_TRANSFER
+        else:
+            largest = max(s["size"] for s in downloads)
+            slow = _p5([s["size"] / max(s["transfer"], 1e-3) for s in downloads])
+            transfer = largest / slow * HEADROOM
+        return Timeouts(
+            # Connection time isn't measured on its own. Time to the first byte
+            # includes it, so it bounds the connect timeout from above.
+            connect=_clamp(first_byte, MIN_CONNECT, MAX_CONNECT),
+            first_byte=_clamp(first_byte, MIN_FIRST_BYTE, MAX_FIRST_BYTE),
+            transfer=_clamp(transfer, MIN_TRANSFER, MAX_TRANSFER),
+        )
+
+    def record(
+        self,
+        host: str,
+        first_byte: float,
+        transfer: float = 0.0,
+        size: int = 0,
+        status: int = 200,
+    ) -> None:
+        """
+        Record a response of a host.
+
+        Args:
+            host: Host name
+            first_byte: Seconds until the response headers were received
+            transfer: Seconds spent receiving the body
+            size: Size of the body in bytes, 0 if unknown
+            status: HTTP status of the response
+        """
+        with self._lock:
+            host_samples = self.samples.setdefault(host, [])
+            host_samples.append(
+                {
+                    "first_byte": first_byte,
+                    "transfer": transfer,
+                    "size": size,
+                    "status": status,
+                }
+            )
+            del host_samples[:-MAX_SAMPLES]
+            self._dirty = True
+
+    def save(self) -> None:
+        """Persist samples of every host."""
+        with self._lock:
+            if not self._dirty:
+                return
+            write_atomic(cache_dir() / "latency.json", json.dumps(self.samples))
+            self._dirty = False
+
+
+profiles = LatencyProfiles()
+atexit.register(profiles.save)
@@ -1,28 +1,58 @@
 """OCI-compliant container registry for Helm charts."""
 
-import signal
-from contextlib import contextmanager
-from urllib.parse import urlparse
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from urllib.parse import urljoin, urlparse
 
+import requests
 from oras.client import OrasClient
 
+from helmupdater import history, metrics
 from helmupdater.chart.chart_version import ChartVersion, parse_versions
+from helmupdater.registry.base import ChartNotFoundError
+from helmupdater.registry.latency import profiles
+from helmupdater.registry.ratelimit import scheduler
 
 # Require version to have a minimal number of components. Following semver.
 MIN_VERSION_COMPONENTS = 3
 
+# Media type of the layer holding the chart archive
+CHART_LAYER_MEDIA_TYPE = "application/vnd.cncf.helm.chart.content.v1.tar+gzip"
 
-@contextmanager
-def _timeout(seconds: int = 5):
-    def timeout_handler(signum, frame):
-        raise TimeoutError(f"Operation timed out after {seconds} seconds")
 
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(seconds)
+def _with_timeout[T](function: Callable[[], T], seconds: float = 5) -> T:
+    """
+    Run a function on a thread of its own, waiting for it at most `seconds`.
+
+    Works from any thread, unlike an alarm signal. A call that times out isn't
+    interrupted: it is left to finish in the background, on a daemon thread
+    that doesn't keep the process from exiting. Until it does, it keeps the
+    host slot of the request it runs for (see `RequestScheduler.hold_slot`).
+    """
+    future: Future[T] = Future()
+    lock = threading.Lock()
+    release: Callable[[], None] | None = None
+
+    def run() -> None:
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+        with lock:
+            if release is not None:
+                release()
+
+    threading.Thread(target=run, name="oras", daemon=True).start()
     try:
-        yield
-    finally:
-        signal.alarm(0)
+        return future.result(timeout=seconds)
+    except TimeoutError as e:
+        with lock:
+            if future.done():
+                raise
+            release = scheduler.hold_slot()
+        raise TimeoutError(f"Operation timed out after {seconds} seconds") from e
 
 
 class OCIRegistry:
@@ -41,7 +71,7 @@ class OCIRegistry:
     """
 
     def __init__(
-        self, registry_url: str, name: str, timeout: int = 5, **options
+        self, registry_url: str, name: str, timeout: float | None = None, **options
     ) -> None:
         """
         Initialize OCI registry.
@@ -49,6 +79,9 @@ class OCIRegistry:
         Args:
             registry_url: OCI registry URL (oci://registry.example.com/charts/mychart)
             name: Name of the registry
+            timeout: Timeout of listing tags in seconds. By default, it's derived
+                from the latency of the host in previous runs (see
+                `helmupdater.registry.latency`).
             **options: various options passed to an underlying client (Oras)
 
         Example:
@@ -76,19 +109,76 @@ class OCIRegistry:
             List of version strings
 
         Raises:
-            ValueError: If request fails or chart is not found
+            ChartNotFoundError: If chart is not found
+            ValueError: If request fails
         """
         # Re-initializing client here since with "token" auth it needs to retrieve new
         # token for each repository individually.
         registry_client = OrasClient(hostname=self.registry_host, **self.options)
 
         repository = f"{self.repository_path}/{chart_name}"
+
         # Oras does not expose retries/timeout settings. It also uses exponential
-        # backoff. Hardcoding timeout wrapper to have at least some control over it.
-        with _timeout(self.timeout):
-            tags = registry_client.get_tags(repository)
+        # backoff. Waiting for it on another thread gives at least some control
+        # over it, from any thread (charts are checked on a pool, see `batch`).
+        # Oras doesn't expose the responses either, so the whole listing is
+        # profiled as time to first byte.
+        timeout = self.timeout or profiles.timeouts(self.registry_host).first_byte
+
+        def get_tags() -> list[str]:
+            started = time.monotonic()
+            tags = _with_timeout(lambda: registry_client.get_tags(repository), timeout)
+            elapsed = time.monotonic() - started
+            profiles.record(self.registry_host, elapsed)
+            metrics.observe(
+                "registry_request_duration_seconds", elapsed, host=self.registry_host
+            )
+            history.add("registry_requests", 1)
+            history.add("registry_seconds", elapsed)
+            return tags
+
+        # Oras raises on throttled responses, without exposing their headers, so
+        # only the error message tells the scheduler to back off.
+        try:
+            return scheduler.call(self.registry_host, get_tags)
+        except ValueError as e:
+            # Oras reports error responses as "Issue with <url>: <reason>"
+            if str(e).endswith(": Not Found"):
+                raise ChartNotFoundError(
+                    f"Chart {chart_name} is not found in the repo."
+                ) from e
+            raise
+
+    def get_digest(self, chart_name: str, version: str) -> str | None:
+        """
+        Get the digest of a chart archive from the manifest of its tag.
+
+        The chart layer holds the same archive an HTTP repository would serve,
+        so its digest identifies the archive across both kinds of registries.
+
+        Args:
+            chart_name: Name of the Helm chart
+            version: Chart version (tag)
+
+        Returns:
+            Digest of the chart layer, or None if the manifest has none
+        """
+        registry_client = OrasClient(hostname=self.registry_host, **self.options)
+        container = (
+            f"{self.registry_host}/{self.repository_path}/{chart_name}:{version}"
+        )
+        timeout = self.timeout or profiles.timeouts(self.registry_host).first_byte
 
-        return tags
+        def get_manifest() -> dict:
+            return _with_timeout(
+                lambda: registry_client.get_manifest(container), timeout
+            )
+
+        manifest = scheduler.call(self.registry_host, get_manifest)
+        for layer in manifest.get("layers", []):
+            if layer.get("mediaType") == CHART_LAYER_MEDIA_TYPE:
+                return layer.get("digest")
+        return None
 
     def get_versions(self, chart_name: str) -> list[ChartVersion]:
         """
@@ -116,6 +206,55 @@ class OCIRegistry:
             if v.is_stable and len(v.version_info.release) >= MIN_VERSION_COMPONENTS
         ]
 
+    def list_charts(self) -> list[str]:
+        """
+        List names of all charts in the repository.
+
+        Charts are the repositories right under the repository path in the
+        catalog of the registry. Not every registry serves its catalog (e.g.
+        ghcr.io and Docker Hub don't).
+
+        Returns:
+            Chart names, sorted
+
+        Raises:
+            ValueError: If the catalog can't be listed
+        """
+        registry_client = OrasClient(hostname=self.registry_host, **self.options)
+        scheme = "http" if self.options.get("insecure") else "https"
+        url: str | None = f"{scheme}://{self.registry_host}/v2/_catalog"
+        prefix = f"{self.repository_path}/" if self.repository_path else ""
+        repositories: list[str] = []
+
+        # Oras doesn't list catalogs. Its public `do_request` handles the
+        # authentication, pages are followed by their Link header like for tags.
+        timeout = self.timeout or profiles.timeouts(self.registry_host).first_byte
+        while url is not None:
+            page_url = url
+
+            def request(page_url: str = page_url) -> requests.Response:
+                return _with_timeout(
+                    lambda: registry_client.do_request(page_url), timeout
+                )
+
+            try:
+                response = scheduler.call(self.registry_host, request)
+                response.raise_for_status()
+                repositories.extend(response.json().get("repositories") or [])
+            except (ValueError, requests.exceptions.RequestException) as e:
+                raise ValueError(
+                    f"failed to list charts of {self.registry_url}, "
+                    f"the registry may not serve its catalog: {e}"
+                ) from e
+            next_url = response.links.get("next", {}).get("url")
+            url = urljoin(page_url, next_url) if next_url else None
+        return sorted(
+            name
+            for repository in repositories
+            if repository.startswith(prefix)
+            and "/" not in (name := repository.removeprefix(prefix))
+        )
+
     @property
     def registry_type(self) -> str:
         """Return registry type identifier."""
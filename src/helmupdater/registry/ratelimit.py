@@ -0,0 +1,359 @@
+"""Per-host scheduling of registry requests that stays within rate limits."""
+
+from __future__ import annotations
+
+import os
+import random
+import re
+import threading
+import time
+from collections.abc import Callable, Mapping
+from email.utils import parsedate_to_datetime
+from typing import TypeVar
+
+from helmupdater import metrics
+from helmupdater.logging import get_logger
+
+log = get_logger()
+
+T = TypeVar("T")
+
+# Responses that mean "slow down" rather than "failed"
+THROTTLED_STATUSES = frozenset({429, 503})
+
+# Some clients (oras) raise on throttled responses instead of returning them
+_THROTTLED_ERROR = re.compile(r"\b429\b|too many requests|rate limit", re.IGNORECASE)
+
+# `X-RateLimit-Reset` (GitHub) is an epoch timestamp, `RateLimit-Reset` is a delay
+_EPOCH_THRESHOLD = 1_000_000_000
+
+
+class HostUnavailableError(ConnectionError):
+    """Host failed too many requests in a row, requests to it fail fast."""
+
+
+class HostThrottle:
+    """
+    Token bucket and concurrency limit for requests to a single host.
+
+    Requests take a token from a bucket refilled at `rate` tokens per second
+    (holding at most `burst` tokens), and one of `concurrency` slots for the time
+    they run. When the host asks to back off, no requests start until the
+    requested time passes.
+    """
+
+    def __init__(self, concurrency: int, rate: float, burst: int | None = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def acquire(self) -> None:
+        """Wait for a free slot and a token."""
+        self._slots.acquire()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def release(self) -> None:
+        """Give back the slot taken by `acquire`."""
+        self._slots.release()
+
+    def block_for(self, seconds: float) -> None:
+        """
+        Hold off new requests to the host.
+
+        Args:
+            seconds: Time from now before the next request may start
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class _Slot:
+    """Slot of a host taken by a request, released once nothing holds it."""
+
+    def __init__(self, throttle: HostThrottle) -> None:
+        self._throttle = throttle
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def retain(self) -> None:
+        with self._lock:
+            self._holders += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self._holders -= 1
+            if self._holders:
+                return
+        self._throttle.release()
+
+
+class RequestScheduler:
+    """
+    Runs registry requests through per-host throttles, retrying throttled ones.
+
+    A request is retried when the host answers with 429 or 503 (or the client
+    raises an error saying so), after the delay from `Retry-After` or, lacking
+    that, an exponential backoff with full jitter. `RateLimit-Remaining: 0`
+    (and GitHub's `X-RateLimit-*`) on any response pauses the host until the
+    advertised reset, so the limit is not hit in the first place.
+
+    Each host also has a circuit breaker: after `failure_threshold` requests in
+    a row fail to connect, time out or get a server error (5xx, including 503
+    answers that are being retried), further requests to the host fail at once
+    with `HostUnavailableError`. After `cooldown` seconds one request is let
+    through again to probe the host.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        rate: float = 10.0,
+        retries: int = 4,
+        backoff: float = 1.0,
+        max_delay: float = 60.0,
+        failure_threshold: int = 3,
+        cooldown: float = 300.0,
+    ) -> None:
+        """
+        Args:
+            concurrency: Maximum number of requests running at once per host
+            rate: Requests per second started per host, on average
+            retries: Maximum number of retries of a throttled request
+            backoff: Base delay of the exponential backoff, in seconds
+            max_delay: Longest delay honoured before a retry, in seconds
+            failure_threshold: Consecutive connection failures opening the breaker
+            cooldown: Time before a host with an open breaker is probed again
+        """
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._hosts: dict[str, HostThrottle] = {}
+        self._failures: dict[str, int] = {}
+        self._open_until: dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Slot of the request running on every thread, see `hold_slot`
+        self._running = threading.local()
+
+    def host(self, host: str) -> HostThrottle:
+        """Get the throttle of a host, created on first use."""
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostThrottle(self.concurrency, self.rate)
+            return self._hosts[host]
+
+    def call(self, host: str, request: Callable[[], T]) -> T:
+        """
+        Run a request to a host within its limits.
+
+        Args:
+            host: Host name the request goes to
+            request: Function sending the request. If it returns a response
+                (anything with `status_code` and `headers`), rate limit headers
+                are taken into account.
+
+        Returns:
+            Result of the request. A throttled response is returned as is once
+            retries are exhausted.
+
+        Raises:
+            HostUnavailableError: If the circuit breaker of the host is open,
+                also when it opens while a request is retried
+
+        Examples:
+            >>> scheduler.call("ghcr.io", lambda: requests.get(url, timeout=5))
+            <Response [200]>
+        """
+        throttle = self.host(host)
+        attempt = 0
+        while True:
+            self._check_breaker(host)
+            throttle.acquire()
+            slot = self._running.slot = _Slot(throttle)
+            try:
+                result = request()
+            except Exception as e:
+                if isinstance(e, OSError) and not _THROTTLED_ERROR.search(str(e)):
+                    self._record_failure(host)
+                if attempt == self.retries or not _THROTTLED_ERROR.search(str(e)):
+                    metrics.inc("registry_errors_total", host=host)
+                    raise
+                delay = self._backoff_delay(attempt)
+            else:
+                status = getattr(result, "status_code", None)
+                if isinstance(status, int) and status >= 500:
+                    self._record_failure(host)
+                elif status != 429:
+                    self._record_success(host)
+                headers = getattr(result, "headers", None) or {}
+                reset = _rate_limit_reset(headers)
+                if reset is not None:
+                    throttle.block_for(min(reset, self.max_delay))
+                if status not in THROTTLED_STATUSES or attempt == self.retries:
+                    # 404 answers the request (chart or API missing)
+                    if isinstance(status, int) and status >= 400 and status != 404:
+                        metrics.inc("registry_errors_total", host=host)
+                    return result
+                delay = _retry_after(headers)
+                if delay is None:
+                    delay = self._backoff_delay(attempt)
+            finally:
+                self._running.slot = None
+                slot.release()
+
+            delay = min(delay, self.max_delay)
+            log.debug(
+                f"{host}: throttled, retrying in {delay:.1f}s",
+                attempt=attempt + 1,
+            )
+            throttle.block_for(delay)
+            attempt += 1
+
+    def hold_slot(self) -> Callable[[], None]:
+        """
+        Keep the host slot of the request running on this thread taken.
+
+        For requests that leave work behind when they return, e.g. a call
+        abandoned on a thread after a timeout, which still talks to the host.
+        The slot is only given back once the returned function is called as
+        well, so abandoned work counts towards the host's concurrency.
+
+        Returns:
+            Function releasing the slot, doing nothing outside of a request
+        """
+        slot = getattr(self._running, "slot", None)
+        if slot is None:
+            return lambda: None
+        slot.retain()
+        return slot.release
+
+    def unavailable_hosts(self) -> list[str]:
+        """List hosts whose circuit breaker is open."""
+        with self._lock:
+            return sorted(self._open_until)
+
+    def _check_breaker(self, host: str) -> None:
+        with self._lock:
+            open_until = self._open_until.get(host)
+            if open_until is None:
+                return
+            if time.monotonic() < open_until:
+                raise HostUnavailableError(
+                    f"{host} is unavailable after {self._failures[host]} "
+                    "failed requests in a row"
+                )
+            # Let one request probe the host, others keep failing fast until it
+            # succeeds or fails.
+            self._open_until[host] = time.monotonic() + self.cooldown
+
+    def _record_failure(self, host: str) -> None:
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if self._failures[host] >= self.failure_threshold:
+                if host not in self._open_until:
+                    log.warning(f"{host}: failing, skipping its remaining requests")
+                self._open_until[host] = time.monotonic() + self.cooldown
+
+    def _record_success(self, host: str) -> None:
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open_until.pop(host, None)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, self.backoff * 2**attempt)
+
+
+def _retry_after(headers: Mapping[str, str]) -> float | None:
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _header_number(headers: Mapping[str, str], *names: str) -> float | None:
+    # Docker Hub sends values like "76;w=21600"
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value.split(";")[0].strip())
+            except ValueError:
+                return None
+    return None
+
+
+def _rate_limit_reset(headers: Mapping[str, str]) -> float | None:
+    """Get seconds until the rate limit resets, if the host says it's exhausted."""
+    remaining = _header_number(headers, "RateLimit-Remaining", "X-RateLimit-Remaining")
+    if remaining is None or remaining > 0:
+        return None
+    reset = _header_number(headers, "RateLimit-Reset", "X-RateLimit-Reset")
+    if reset is None:
+        return None
+    if reset > _EPOCH_THRESHOLD:
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+def _limit_from_env[N: (int, float)](
+    name: str, convert: Callable[[str], N], default: N, minimum: N, strict: bool
+) -> N:
+    """
+    Read a limit from an environment variable.
+
+    Args:
+        name: Name of the environment variable
+        convert: Conversion of the value (int or float)
+        default: Limit if the variable isn't set
+        minimum: Smallest valid limit
+        strict: Whether the limit should be greater than `minimum`
+
+    Raises:
+        ValueError: If the value isn't a number or is out of range
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        limit = convert(value)
+    except ValueError:
+        limit = None
+    if limit is None or not (limit > minimum if strict else limit >= minimum):
+        bound = "greater than" if strict else "at least"
+        raise ValueError(f"{name} should be a number {bound} {minimum}, got {value!r}")
+    return limit
+
+
+# A rate of 0 would never refill the bucket, and no slots would block forever
+scheduler = RequestScheduler(
+    concurrency=_limit_from_env("HELMUPDATER_HOST_CONCURRENCY", int, 4, 1, False),
+    rate=_limit_from_env("HELMUPDATER_HOST_RATE", float, 10.0, 0.0, True),
+)
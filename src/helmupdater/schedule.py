@@ -0,0 +1,289 @@
+"""Adaptive scheduling of update checks based on chart release cadence."""
+
+from __future__ import annotations
+
+import itertools
+import json
+import re
+import statistics
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any
+
+from helmupdater import git, locks
+from helmupdater.logging import get_logger
+from helmupdater.utils import cache_dir, write_atomic
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from helmupdater.chart.chart_metadata import ChartMetadata
+
+log = get_logger()
+
+DAY = 24 * 60 * 60
+
+# A chart is checked again after this fraction of its median release interval.
+CHECK_FRACTION = 0.25
+MAX_CHECK_INTERVAL = 7 * DAY
+
+# Charts failing this many runs in a row (or missing upstream) are skipped for a
+# period doubling with every further failure.
+PERMANENT_FAILURES = 3
+MIN_FAILURE_BACKOFF = DAY
+MAX_FAILURE_BACKOFF = 30 * DAY
+
+# Commits created by helmupdater: "repo/chart: update to 1.0.1"
+_RELEASE_SUBJECT = re.compile(
+    r"^(?P<repo>[^/\s]+)/(?P<chart>[^:\s]+): (?:update to|init at) "
+)
+
+
+def release_history() -> dict[tuple[str, str], list[int]]:
+    """
+    Collect release timestamps of every chart from git history.
+
+    Releases are the "init at" and "update to" commits created by helmupdater.
+
+    Returns:
+        Dict of (repo_name, chart_name) to commit timestamps, oldest first
+    """
+    history: dict[tuple[str, str], list[int]] = defaultdict(list)
+    for timestamp, subject in git.log_subjects():
+        match = _RELEASE_SUBJECT.match(subject)
+        if match:
+            history[(match["repo"], match["chart"])].append(timestamp)
+    return history
+
+
+def release_cadence(timestamps: list[int]) -> float | None:
+    """
+    Estimate how often a chart is released.
+
+    Args:
+        timestamps: Release timestamps, oldest first
+
+    Returns:
+        Median interval between releases in seconds, or None if there are
+        fewer than two releases
+    """
+    if len(timestamps) < 2:
+        return None
+    return statistics.median(b - a for a, b in itertools.pairwise(timestamps))
+
+
+class Scheduler:
+    """
+    Decide which charts are due for an update check.
+
+    Every chart is checked again after a fraction of its release cadence, so
+    charts released daily are checked on every run, while charts released once a
+    year are checked weekly. Charts without enough history are always due. The
+    time of the last successful check is kept in the cache directory.
+    """
+
+    def __init__(self, now: float | None = None) -> None:
+        self.now = time.time() if now is None else now
+        self.state_path = cache_dir() / "schedule.json"
+        self.last_checked: dict[str, float] = {}
+        if self.state_path.exists():
+            self.last_checked = json.loads(self.state_path.read_text())
+        self._changed: dict[str, float] = {}
+        self.history = release_history()
+
+    def check_interval(self, repo_name: str, chart_name: str) -> float:
+        """
+        Get time between update checks of a chart.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+
+        Returns:
+            Interval in seconds
+        """
+        cadence = release_cadence(self.history.get((repo_name, chart_name), []))
+        if cadence is None:
+            return 0
+        return min(cadence * CHECK_FRACTION, MAX_CHECK_INTERVAL)
+
+    def is_due(self, repo_name: str, chart_name: str) -> bool:
+        """
+        Check if a chart is due for an update check.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+
+        Returns:
+            True if the chart should be checked in this run
+        """
+        last_checked = self.last_checked.get(f"{repo_name}/{chart_name}")
+        if last_checked is None:
+            return True
+        interval = self.check_interval(repo_name, chart_name)
+        return self.now - last_checked >= interval
+
+    def change_likelihood(self, repo_name: str, chart_name: str) -> float:
+        """
+        Estimate how likely a chart is to have a new release.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+
+        Returns:
+            Time since the last release relative to the release cadence.
+            Charts without enough history get infinity.
+        """
+        timestamps = self.history.get((repo_name, chart_name), [])
+        cadence = release_cadence(timestamps)
+        if not cadence:
+            return float("inf")
+        return (self.now - timestamps[-1]) / cadence
+
+    def plan(
+        self,
+        charts: dict[str, dict[str, ChartMetadata]],
+        check_all: bool = False,
+    ) -> list[tuple[str, str]]:
+        """
+        Select charts to check in this run.
+
+        Args:
+            charts: Chart metadata as returned by `nix.get_charts()`
+            check_all: If True, select every chart regardless of the schedule
+
+        Returns:
+            List of (repo_name, chart_name) tuples, most likely to change first
+        """
+        selected = [
+            (repo_name, chart_name)
+            for repo_name, repo_charts in charts.items()
+            for chart_name in repo_charts
+            if check_all or self.is_due(repo_name, chart_name)
+        ]
+        selected.sort(key=lambda c: self.change_likelihood(*c), reverse=True)
+        return selected
+
+    def mark_checked(self, repo_name: str, chart_name: str) -> None:
+        """
+        Record a successful update check of a chart.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+        """
+        self.last_checked[f"{repo_name}/{chart_name}"] = self.now
+        self._changed[f"{repo_name}/{chart_name}"] = self.now
+
+    def save(self) -> None:
+        """Persist the time of the last check of charts checked by this run."""
+        self.last_checked = _update_state(self.state_path, self._changed)
+        self._changed = {}
+
+
+class NegativeCache:
+    """
+    Remember charts that keep failing and skip them for a while.
+
+    Charts missing upstream are skipped right after their first failure, other
+    charts after failing `PERMANENT_FAILURES` runs in a row. The skip period
+    starts at a day and doubles with every further failure, up to 30 days. A
+    successful check clears the entry. Entries are kept in the cache directory.
+    """
+
+    def __init__(self, now: float | None = None) -> None:
+        self.now = time.time() if now is None else now
+        self.state_path = cache_dir() / "failures.json"
+        self.entries: dict[str, dict] = {}
+        if self.state_path.exists():
+            self.entries = json.loads(self.state_path.read_text())
+        # Entries changed by this run, None for removed ones
+        self._changed: dict[str, dict | None] = {}
+
+    def skipped_until(self, repo_name: str, chart_name: str) -> float | None:
+        """
+        Check if a chart is skipped because of previous failures.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+
+        Returns:
+            Timestamp when the chart is checked again, or None if it isn't skipped
+        """
+        entry = self.entries.get(f"{repo_name}/{chart_name}")
+        if entry is None or entry.get("until", 0) <= self.now:
+            return None
+        return entry["until"]
+
+    def error(self, repo_name: str, chart_name: str) -> str | None:
+        """Get the last recorded error of a chart."""
+        entry = self.entries.get(f"{repo_name}/{chart_name}")
+        return None if entry is None else entry["error"]
+
+    def record_failure(
+        self, repo_name: str, chart_name: str, error: str, missing: bool = False
+    ) -> None:
+        """
+        Record a failed update check of a chart.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+            error: Error message
+            missing: Whether the chart is missing upstream
+        """
+        name = f"{repo_name}/{chart_name}"
+        entry = self.entries.get(name, {"failures": 0})
+        entry["failures"] += 1
+        entry["error"] = error
+
+        backoffs = entry["failures"] - (0 if missing else PERMANENT_FAILURES - 1)
+        if backoffs > 0:
+            period = MIN_FAILURE_BACKOFF * 2 ** (backoffs - 1)
+            entry["until"] = self.now + min(period, MAX_FAILURE_BACKOFF)
+        self.entries[name] = self._changed[name] = entry
+
+    def record_success(self, repo_name: str, chart_name: str) -> None:
+        """
+        Forget previous failures of a chart.
+
+        Args:
+            repo_name: Repository name
+            chart_name: Chart name
+        """
+        name = f"{repo_name}/{chart_name}"
+        if self.entries.pop(name, None) is not None:
+            self._changed[name] = None
+
+    def save(self) -> None:
+        """Persist the failures of charts checked by this run."""
+        self.entries = _update_state(self.state_path, self._changed)
+        self._changed = {}
+
+
+def _update_state(path: Path, changes: dict[str, Any]) -> dict[str, Any]:
+    """
+    Apply changes to a state file shared by all runs.
+
+    The file is read again under a lock, so that runs finishing at the same
+    time keep each other's changes.
+
+    Args:
+        path: State file (JSON object)
+        changes: Changed keys, None for removed ones
+
+    Returns:
+        State as written
+    """
+    with locks.file_lock(path.with_name(f"{path.name}.lock")):
+        state = json.loads(path.read_text()) if path.exists() else {}
+        for key, value in changes.items():
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+        write_atomic(path, json.dumps(state, sort_keys=True))
+    return state
@@ -1,11 +1,17 @@
 """Utility functions for helmupdater."""
 
+import os
 import subprocess
+import tempfile
+import time
+from pathlib import Path
 
 
 def run_cmd(
     *args: str,
     raise_on_error: bool = True,
+    input: str | None = None,
+    env: dict[str, str] | None = None,
 ) -> subprocess.CompletedProcess:
     """
     Run a subprocess command with consistent defaults.
@@ -15,6 +21,8 @@ def run_cmd(
     Args:
         *args: Command and arguments to run
         raise_on_error: If True, raise CalledProcessError on non-zero exit
+        input: Text written to the command's stdin
+        env: Variables added to the environment of the command
 
     Returns:
         CompletedProcess result with stdout and stderr as strings
@@ -29,12 +37,28 @@ def run_cmd(
         >>> run_cmd("nix", "build", "...", raise_on_error=False)
         CompletedProcess(...)
     """
-    return subprocess.run(
-        args,
-        check=raise_on_error,
-        capture_output=True,
-        text=True,
-    )
+    from helmupdater import metrics
+
+    # "nix eval", "git commit", ...
+    command = " ".join(args[:2])
+    started = time.monotonic()
+    try:
+        return subprocess.run(
+            args,
+            check=raise_on_error,
+            capture_output=True,
+            text=True,
+            input=input,
+            env={**os.environ, **env} if env else None,
+        )
+    finally:
+        metrics.inc("subprocesses_total", command=command)
+        metrics.inc(
+            "subprocess_duration_seconds_total",
+            time.monotonic() - started,
+            command=command,
+        )
+
 
 def parse_chart_name(name: str) -> tuple[str, str]:
     """
@@ -55,3 +79,67 @@ def parse_chart_name(name: str) -> tuple[str, str]:
             f"Invalid chart name format: '{name}'. Expected format: 'repo/chart'"
         )
     return parts[0], parts[1]
+
+
+def is_pattern(name: str) -> bool:
+    """
+    Check if a name is a glob pattern.
+
+    Args:
+        name: Name to check
+
+    Returns:
+        True if the name contains glob wildcards
+    """
+    return any(char in name for char in "*?[")
+
+
+def cache_dir() -> Path:
+    """
+    Get directory for state that helmupdater keeps between runs.
+
+    The directory is taken from `HELMUPDATER_CACHE_DIR`, falling back to
+    `$XDG_CACHE_HOME/helmupdater` and `~/.cache/helmupdater`. It is created if
+    it doesn't exist.
+
+    Returns:
+        Path to the cache directory
+    """
+    path = os.environ.get("HELMUPDATER_CACHE_DIR")
+    if path:
+        directory = Path(path)
+    else:
+        xdg_cache = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        directory = Path(xdg_cache) / "helmupdater"
+
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def write_atomic(path: Path | str, content: str | bytes) -> None:
+    """
+    Write a file atomically.
+
+    Content is written to a temporary file in the same directory, which then
+    replaces the target. Readers see either the old or the new content, never a
+    partially written file. The permissions of an existing file are kept, new
+    files are created world-readable.
+
+    Args:
+        path: Path to the file
+        content: New content of the file, written in binary mode if bytes
+    """
+    path = Path(path)
+    try:
+        mode = path.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as f:
+            f.write(content)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -1,9 +1,10 @@
+import subprocess
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from helmupdater import chart
+from helmupdater import chart, charts_lock, eval_cache, hash_memo
 
 
 def _write_chart_file(
@@ -21,12 +22,26 @@ def _write_chart_file(
 
     return chart_path
 
+
 class TestChartUtils:
     def test_get_chart_path(self):
         result = chart.get_chart_path("local", "nginx")
         expected = Path.cwd() / "charts" / "local" / "nginx" / "default.nix"
         assert result == expected
 
+    @pytest.mark.parametrize(
+        "path,expected",
+        [
+            ("charts/local/nginx/default.nix", ("local", "nginx")),
+            (Path("charts/local/nginx/default.nix"), ("local", "nginx")),
+            ("charts/local/nginx/README.md", None),
+            ("charts/local/default.nix", None),
+            ("tests/local/nginx/default.nix", None),
+        ],
+    )
+    def test_parse_chart_path(self, path, expected):
+        assert chart.parse_chart_path(path) == expected
+
     def test_create_chart_directory(self, tmp_path, monkeypatch):
         monkeypatch.chdir(tmp_path)
 
@@ -67,6 +82,13 @@ class TestChartUtils:
         assert f'version = "{chart_metadata.version}";' in content
         assert f'chartHash = "{chart_metadata.chartHash}";' in content
 
+    def test_write_chart_file_invalidates_eval_cache(self, tmp_path, chart_metadata):
+        eval_cache.put("chartsMetadata", "key", {})
+
+        chart.write_chart_file(tmp_path / "default.nix", chart_metadata)
+
+        assert eval_cache.get("chartsMetadata", "key") is None
+
     def test_write_chart_file_existing(self, tmp_path, chart_metadata):
         chart_path = tmp_path / "default.nix"
         chart_path.write_text("old content")
@@ -78,6 +100,72 @@ class TestChartUtils:
         assert f'repo = "{chart_metadata.repo}";' in content
 
 
+class TestChartsLock:
+    @pytest.fixture(autouse=True)
+    def lock_file(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        subprocess.run(["git", "init", "-q"], check=True)
+        charts_lock.write({})
+        subprocess.run(["git", "add", charts_lock.LOCK_FILE], check=True)
+
+    def test_write_chart_file_updates_lock(self, tmp_path, chart_metadata):
+        chart_path = chart.get_chart_path("local", "nginx")
+
+        chart.write_chart_file(chart_path, chart_metadata)
+
+        assert not (tmp_path / "charts").exists()
+        assert chart.exists("local", "nginx")
+        assert chart.read("local", "nginx") == chart_metadata
+
+    def test_write_chart_file_moves_chart_file(self, tmp_path, chart_metadata):
+        chart_path = tmp_path / "charts" / "local" / "nginx" / "default.nix"
+        chart_path.parent.mkdir(parents=True)
+        chart_path.write_text("{ }")
+
+        chart.write_chart_file(chart_path, chart_metadata)
+
+        assert not (tmp_path / "charts" / "local").exists()
+        assert charts_lock.get("local", "nginx") == chart_metadata
+
+    def test_read_conflict(self, tmp_path, chart_metadata):
+        chart.write_chart_file(chart.get_chart_path("local", "nginx"), chart_metadata)
+        chart_path = chart.get_chart_path("local", "nginx")
+        chart_path.parent.mkdir(parents=True)
+        chart_path.write_text("{ }")
+
+        with pytest.raises(charts_lock.ConflictError, match="local/nginx"):
+            chart.read("local", "nginx")
+
+    def test_create_without_chart_file(self, tmp_path, chart_metadata):
+        chart.create(
+            "local",
+            chart_metadata.chart,
+            chart_info=chart_metadata,
+            update_to_latest=False,
+        )
+
+        assert not (tmp_path / "charts").exists()
+        assert charts_lock.get("local", chart_metadata.chart) == chart_metadata
+
+    def test_lock_entries(self, tmp_path, chart_metadata, local_chart_metadata_for):
+        podinfo = local_chart_metadata_for("podinfo")
+        charts_lock.put("local", "podinfo", podinfo)
+        chart_path = tmp_path / "charts" / "local" / "nginx" / "default.nix"
+        chart_path.parent.mkdir(parents=True)
+        chart_path.write_text(
+            "".join(f'{key} = "{value}";\n' for key, value in chart_metadata)
+        )
+
+        entries = chart.lock_entries()
+
+        assert entries == {
+            "local": {
+                "nginx": chart_metadata.model_dump(),
+                "podinfo": podinfo.model_dump(),
+            }
+        }
+
+
 class TestChartCreate:
     def test_create_no_update(self, tmp_path, monkeypatch, chart_metadata):
         monkeypatch.chdir(tmp_path)
@@ -136,10 +224,10 @@ class TestChartCreate:
             )
 
     @patch("helmupdater.chart.update")
-    @patch("helmupdater.chart.git.staged_file")
+    @patch("helmupdater.chart.git.staged_files")
     def test_create_with_update_to_latest(
         self,
-        mock_staged_file,
+        mock_staged_files,
         mock_update,
         tmp_path,
         monkeypatch,
@@ -147,8 +235,8 @@ class TestChartCreate:
     ):
         monkeypatch.chdir(tmp_path)
 
-        mock_staged_file.return_value.__enter__ = MagicMock()
-        mock_staged_file.return_value.__exit__ = MagicMock()
+        mock_staged_files.return_value.__enter__ = MagicMock()
+        mock_staged_files.return_value.__exit__ = MagicMock()
 
         old_chart_metadata = local_chart_metadata_for("nginx", "1.0.0")
         new_chart_metadata = local_chart_metadata_for("nginx", "1.0.1")
@@ -164,12 +252,15 @@ class TestChartCreate:
 
         assert result == new_chart_metadata
         mock_update.assert_called_once()
+        mock_staged_files.assert_called_once_with(
+            [chart.get_chart_path("local", "nginx")]
+        )
 
     @patch("helmupdater.chart.update")
-    @patch("helmupdater.chart.git.staged_file")
+    @patch("helmupdater.chart.git.staged_files")
     def test_create_with_update_to_latest_failed(
         self,
-        mock_staged_file,
+        mock_staged_files,
         mock_update,
         tmp_path,
         monkeypatch,
@@ -178,8 +269,8 @@ class TestChartCreate:
     ):
         monkeypatch.chdir(tmp_path)
 
-        mock_staged_file.return_value.__enter__ = MagicMock()
-        mock_staged_file.return_value.__exit__ = MagicMock()
+        mock_staged_files.return_value.__enter__ = MagicMock()
+        mock_staged_files.return_value.__exit__ = MagicMock()
         mock_update.side_effect = Exception("Update failed")
 
         result = chart.create(
@@ -263,7 +354,6 @@ class TestChartUpdate:
         mock_get_chart.assert_not_called()
         mock_rehash.assert_called_once()
 
-
     @patch("helmupdater.chart.nix.get_chart")
     @patch("helmupdater.chart.registry.create")
     @patch("helmupdater.chart.rehash")
@@ -292,7 +382,6 @@ class TestChartUpdate:
 
         assert result == chart_metadata
 
-
     @patch("helmupdater.chart.nix.get_chart")
     @patch("helmupdater.chart.registry.create")
     def test_update_no_versions(
@@ -315,10 +404,57 @@ class TestChartUpdate:
         with pytest.raises(ValueError, match="No versions available"):
             chart.update("local", "nginx", chart_info=chart_metadata)
 
+    @patch("helmupdater.chart.nix.get_chart")
+    @patch("helmupdater.chart.registry.create")
+    @patch("helmupdater.chart.rehash")
+    def test_update_known_hash(
+        self,
+        mock_rehash,
+        mock_registry_create,
+        mock_get_chart,
+        tmp_path,
+        monkeypatch,
+        local_chart_metadata_for,
+    ):
+        monkeypatch.chdir(tmp_path)
+
+        old_chart_metadata = local_chart_metadata_for("nginx", "1.0.0")
+        new_chart_metadata = local_chart_metadata_for("nginx", "1.0.1")
+        chart_path = _write_chart_file(tmp_path, old_chart_metadata)
+        hash_memo.record(
+            new_chart_metadata.repo,
+            "nginx",
+            "1.0.1",
+            "sha256:abc",
+            new_chart_metadata.chartHash,
+        )
+
+        mock_repo = MagicMock()
+        mock_repo.get_versions.return_value = [
+            chart.ChartVersion(version="1.0.1", repo="local", chart="nginx"),
+        ]
+        mock_repo.get_digest.return_value = "sha256:abc"
+        mock_registry_create.return_value = mock_repo
+
+        result = chart.update("local", "nginx", chart_info=old_chart_metadata)
+
+        assert result == new_chart_metadata
+        assert chart.parse_chart_file(chart_path.read_text()) == new_chart_metadata
+        mock_rehash.assert_not_called()
+        mock_get_chart.assert_not_called()
+
 
 class TestRehash:
     """Test rehash function."""
 
+    @pytest.fixture(autouse=True)
+    @staticmethod
+    def mock_repo():
+        repo = MagicMock()
+        repo.get_digest.return_value = "sha256:abc"
+        with patch("helmupdater.chart.registry.create", return_value=repo):
+            yield repo
+
     @patch("helmupdater.chart.nix.get_chart")
     @patch("helmupdater.chart.nix.get_hash")
     def test_rehash(
@@ -345,3 +481,187 @@ class TestRehash:
         result = chart.rehash("local", "nginx")
 
         assert result == current_chart
+        assert (
+            hash_memo.lookup(
+                current_chart.repo, "nginx", current_chart.version, "sha256:abc"
+            )
+            == current_chart.chartHash
+        )
+
+    @patch("helmupdater.chart.nix.get_chart")
+    @patch("helmupdater.chart.nix.get_hash")
+    def test_rehash_known_digest(
+        self,
+        mock_get_hash,
+        mock_get_chart,
+        tmp_path,
+        monkeypatch,
+        local_chart_metadata_for,
+    ):
+        monkeypatch.chdir(tmp_path)
+
+        current_chart = local_chart_metadata_for("nginx")
+        _write_chart_file(
+            tmp_path,
+            current_chart.model_copy(update={"chartHash": chart.PLACEHOLDER_HASH}),
+        )
+        hash_memo.record(
+            "https://elsewhere.example.com", "nginx", "9.9.9", "sha256:abc", "sha256-X"
+        )
+
+        result = chart.rehash("local", "nginx")
+
+        assert result.chartHash == "sha256-X"
+        mock_get_hash.assert_not_called()
+        mock_get_chart.assert_not_called()
+
+    @patch("helmupdater.chart.nix.get_hash", return_value="sha256-new")
+    def test_rehash_ignores_history(
+        self, mock_get_hash, tmp_path, monkeypatch, local_chart_metadata_for
+    ):
+        monkeypatch.chdir(tmp_path)
+
+        current_chart = local_chart_metadata_for("nginx")
+        _write_chart_file(tmp_path, current_chart)
+        hash_memo.seed("abc", [current_chart])
+
+        assert chart.rehash("local", "nginx").chartHash == "sha256-new"
+
+
+class TestParseChartFile:
+    def test_template(self, chart_metadata):
+        content = chart.CHART_TEMPLATE.replace("{{ repo }}", chart_metadata.repo)
+        content = content.replace("{{ chart }}", chart_metadata.chart)
+        content = content.replace("{{ version }}", chart_metadata.version)
+        content = content.replace("{{ hash }}", chart_metadata.chartHash)
+
+        assert chart.parse_chart_file(content) == chart_metadata
+
+    @pytest.mark.parametrize(
+        "content",
+        [
+            '{ repo = "r"; chart = "c"; version = "1"; chartHash = "h"; }',
+            '{\n  repo = "r";\n  chart = "c";\n  version = "${v}";\n'
+            '  chartHash = "h";\n}',
+            '{\n  repo = "r";\n  chart = "c";\n}',
+        ],
+    )
+    def test_needs_evaluation(self, content):
+        assert chart.parse_chart_file(content) is None
+
+
+class TestChartCreateMany:
+    @pytest.fixture
+    def mock_repo(self):
+        repo = MagicMock()
+        repo.list_charts.return_value = ["nginx", "podinfo", "redis"]
+        repo.get_versions.side_effect = lambda name: [
+            chart.ChartVersion(version="1.0.0", repo="local", chart=name),
+            chart.ChartVersion(version="1.0.1", repo="local", chart=name),
+        ]
+        with patch("helmupdater.chart.registry.create", return_value=repo):
+            yield repo
+
+    @patch("helmupdater.chart.nix.get_hash")
+    @patch("helmupdater.chart.git.staged_files")
+    def test_create_many(
+        self, mock_staged_files, mock_get_hash, mock_repo, tmp_path, monkeypatch
+    ):
+        monkeypatch.chdir(tmp_path)
+        mock_get_hash.side_effect = lambda repo_name, chart_name: f"sha256-{chart_name}"
+
+        result = chart.create_many(
+            "local", "http://localhost:45010", ["nginx", "podinfo"], jobs=2
+        )
+
+        assert list(result) == ["nginx", "podinfo"]
+        assert result["nginx"] == chart.ChartMetadata(
+            repo="http://localhost:45010",
+            chart="nginx",
+            version="1.0.1",
+            chartHash="sha256-nginx",
+        )
+        assert 'chartHash = "sha256-podinfo";' in (
+            chart.get_chart_path("local", "podinfo").read_text()
+        )
+        mock_staged_files.assert_called_once_with(
+            [
+                chart.get_chart_path("local", "nginx"),
+                chart.get_chart_path("local", "podinfo"),
+            ]
+        )
+        mock_repo.list_charts.assert_not_called()
+
+    @patch("helmupdater.chart.nix.get_hash", return_value="sha256-hash")
+    @patch("helmupdater.chart.git.staged_files")
+    def test_create_many_pattern(
+        self, mock_staged_files, mock_get_hash, mock_repo, tmp_path, monkeypatch
+    ):
+        monkeypatch.chdir(tmp_path)
+
+        result = chart.create_many("local", "http://localhost:45010", ["*"])
+
+        assert list(result) == ["nginx", "podinfo", "redis"]
+        assert mock_get_hash.call_count == 3
+
+    @patch("helmupdater.chart.nix.get_hash")
+    @patch("helmupdater.chart.git.staged_files")
+    def test_create_many_failures(
+        self, mock_staged_files, mock_get_hash, mock_repo, tmp_path, monkeypatch
+    ):
+        monkeypatch.chdir(tmp_path)
+        _write_chart_file(
+            tmp_path,
+            chart.ChartMetadata(
+                repo="http://localhost:45010",
+                chart="redis",
+                version="1.0.0",
+                chartHash=chart.PLACEHOLDER_HASH,
+            ),
+            chart_name="redis",
+        )
+
+        def get_hash(repo_name, chart_name):
+            if chart_name == "podinfo":
+                raise RuntimeError("Failed to extract hash")
+            return "sha256-hash"
+
+        mock_get_hash.side_effect = get_hash
+
+        result = chart.create_many(
+            "local", "http://localhost:45010", ["nginx", "podinfo", "redis"]
+        )
+
+        assert isinstance(result["nginx"], chart.ChartMetadata)
+        assert isinstance(result["podinfo"], RuntimeError)
+        assert isinstance(result["redis"], ValueError)
+        assert not (tmp_path / "charts" / "local" / "podinfo").exists()
+
+
+class TestVerifyMany:
+    @patch("helmupdater.chart.nix.check_derivation")
+    @patch("helmupdater.chart.nix.get_derivation_path")
+    def test_verify_many(self, mock_get_derivation_path, mock_check_derivation):
+        mock_get_derivation_path.side_effect = lambda repo_name, chart_name: (
+            f"/nix/store/{chart_name}.drv"
+        )
+
+        def check_derivation(drv_path):
+            if "podinfo" in drv_path:
+                return "sha256-actual"
+            if "redis" in drv_path:
+                raise RuntimeError("Failed to check")
+            return None
+
+        mock_check_derivation.side_effect = check_derivation
+
+        result = chart.verify_many(
+            [("local", "nginx"), ("local", "podinfo"), ("local", "redis")],
+            eval_jobs=1,
+            fetch_jobs=2,
+        )
+
+        assert result[("local", "nginx")] is None
+        assert result[("local", "podinfo")] == "sha256-actual"
+        assert isinstance(result[("local", "redis")], RuntimeError)
+        assert mock_get_derivation_path.call_count == 3
@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep state written between runs out of the user's cache directory."""
+    path = tmp_path / "cache"
+    monkeypatch.setenv("HELMUPDATER_CACHE_DIR", str(path))
+    return path
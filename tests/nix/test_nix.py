@@ -1,10 +1,12 @@
 import json
+import subprocess
+from pathlib import Path
 from subprocess import CalledProcessError, CompletedProcess
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import pytest
 
-from helmupdater import nix
+from helmupdater import charts_lock, nix
 from helmupdater.chart.chart_metadata import ChartMetadata
 
 
@@ -45,6 +47,20 @@ class TestCurrentSystem:
         mock_run_cmd.assert_called_once()
         nix.current_system.cache_clear()
 
+    @patch("helmupdater.nix.run_cmd")
+    def test_current_system_cached_between_runs(self, mock_run_cmd):
+        nix.current_system.cache_clear()
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout='"aarch64-darwin"\n', stderr=""
+        )
+
+        nix.current_system()
+        nix.current_system.cache_clear()
+
+        assert nix.current_system() == "aarch64-darwin"
+        mock_run_cmd.assert_called_once()
+        nix.current_system.cache_clear()
+
 
 class TestBuildChart:
     @patch("helmupdater.nix.current_system")
@@ -81,6 +97,72 @@ class TestBuildChart:
         result = nix.build_chart("local", "nginx", raise_on_error=False)
         assert result.stderr == "error message"
 
+    @patch("helmupdater.nix.current_system")
+    @patch("helmupdater.nix.run_cmd")
+    def test_build_chart_no_link(self, mock_run_cmd, mock_current_system):
+        mock_current_system.return_value = "x86_64-linux"
+
+        nix.build_chart("local", "nginx", link=False)
+
+        mock_run_cmd.assert_called_once_with(
+            "nix",
+            "build",
+            "--no-link",
+            ".#chartsDerivations.x86_64-linux.local.nginx",
+            raise_on_error=True,
+        )
+
+
+class TestBuildCharts:
+    @patch("helmupdater.nix.current_system")
+    @patch("helmupdater.nix.run_cmd")
+    def test_build_charts_success(self, mock_run_cmd, mock_current_system):
+        mock_current_system.return_value = "x86_64-linux"
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="", stderr=""
+        )
+
+        result = nix.build_charts([("local", "nginx"), ("local", "podinfo")], 2)
+
+        assert result == {("local", "nginx"): True, ("local", "podinfo"): True}
+        mock_run_cmd.assert_called_once_with(
+            "nix",
+            "build",
+            "--no-link",
+            "--keep-going",
+            "--max-jobs",
+            "2",
+            ".#chartsDerivations.x86_64-linux.local.nginx",
+            ".#chartsDerivations.x86_64-linux.local.podinfo",
+            raise_on_error=False,
+        )
+
+    @patch("helmupdater.nix.build_chart")
+    @patch("helmupdater.nix.current_system")
+    @patch("helmupdater.nix.run_cmd")
+    def test_build_charts_failure(
+        self, mock_run_cmd, mock_current_system, mock_build_chart
+    ):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=1, stdout="", stderr="error: build failed"
+        )
+        mock_build_chart.side_effect = [
+            CompletedProcess(args=[], returncode=0, stdout="", stderr=""),
+            CompletedProcess(args=[], returncode=1, stdout="", stderr="error"),
+        ]
+
+        result = nix.build_charts([("local", "nginx"), ("local", "podinfo")])
+
+        assert result == {("local", "nginx"): True, ("local", "podinfo"): False}
+        mock_build_chart.assert_called_with(
+            "local", "podinfo", raise_on_error=False, link=False
+        )
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_build_charts_empty(self, mock_run_cmd):
+        assert nix.build_charts([]) == {}
+        mock_run_cmd.assert_not_called()
+
 
 class TestGetHash:
     @patch("helmupdater.nix.build_chart")
@@ -116,7 +198,7 @@ class TestGetHash:
             },
             "version": 4
         }
-        """ # noqa: E501
+        """  # noqa: E501
 
         system = "aarch64-darwin"
         mock_current_system.return_value = system
@@ -168,7 +250,95 @@ class TestGetHash:
         mock_get_hash_derivation.assert_called_once_with("local", "nginx")
 
 
+class TestVerify:
+    @patch("helmupdater.nix.current_system", return_value="x86_64-linux")
+    @patch("helmupdater.nix.run_cmd")
+    def test_get_derivation_path(self, mock_run_cmd, mock_current_system):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="/nix/store/abcd-nginx-1.0.1.drv", stderr=""
+        )
+
+        assert nix.get_derivation_path("local", "nginx") == (
+            "/nix/store/abcd-nginx-1.0.1.drv"
+        )
+        mock_run_cmd.assert_called_once_with(
+            "nix",
+            "eval",
+            "--raw",
+            ".#chartsDerivations.x86_64-linux.local.nginx.drvPath",
+        )
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_check_derivation_matches(self, mock_run_cmd):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="", stderr=""
+        )
+
+        assert nix.check_derivation("/nix/store/abcd-nginx-1.0.1.drv") is None
+        mock_run_cmd.assert_called_once_with(
+            "nix",
+            "build",
+            "--no-link",
+            "--rebuild",
+            "/nix/store/abcd-nginx-1.0.1.drv^*",
+            raise_on_error=False,
+        )
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_check_derivation_mismatch(self, mock_run_cmd):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[],
+            returncode=1,
+            stdout="",
+            stderr=(
+                "error: hash mismatch in fixed-output derivation '/nix/store/abcd':\n"
+                "  specified: sha256-d0F6HCDggh3FWfR+LYim7iQr1E7X80Iwp8CCFRpZl3g=\n"
+                "     got:    sha256-2Wu51wd842yLn8ZRO9NunjzJhIqGkqEsU4qHzKKXjFY="
+            ),
+        )
+
+        assert nix.check_derivation("/nix/store/abcd-nginx-1.0.1.drv") == (
+            "sha256-2Wu51wd842yLn8ZRO9NunjzJhIqGkqEsU4qHzKKXjFY="
+        )
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_check_derivation_not_in_store(self, mock_run_cmd):
+        mock_run_cmd.side_effect = [
+            CompletedProcess(
+                args=[],
+                returncode=1,
+                stdout="",
+                stderr="error: some outputs of '/nix/store/abcd-nginx-1.0.1.drv' "
+                "are not valid, so checking is not possible",
+            ),
+            CompletedProcess(args=[], returncode=0, stdout="", stderr=""),
+        ]
+
+        assert nix.check_derivation("/nix/store/abcd-nginx-1.0.1.drv") is None
+        mock_run_cmd.assert_called_with(
+            "nix",
+            "build",
+            "--no-link",
+            "/nix/store/abcd-nginx-1.0.1.drv^*",
+            raise_on_error=False,
+        )
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_check_derivation_failure(self, mock_run_cmd):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=1, stdout="", stderr="error: unable to download"
+        )
+
+        with pytest.raises(RuntimeError, match="Failed to check"):
+            nix.check_derivation("/nix/store/abcd-nginx-1.0.1.drv")
+
+
 class TestGetCharts:
+    @pytest.fixture(autouse=True)
+    def content_key(self):
+        with patch("helmupdater.git.content_key", return_value="key") as mock:
+            yield mock
+
     @patch("helmupdater.nix.run_cmd")
     def test_get_charts_single_repo(self, mock_run_cmd, local_chart_metadata_for):
         nginx_chart = local_chart_metadata_for("nginx")
@@ -215,6 +385,151 @@ class TestGetCharts:
 
         assert result == {}
 
+    @patch("helmupdater.nix.run_cmd")
+    def test_get_charts_cached_between_runs(
+        self, mock_run_cmd, content_key, local_chart_metadata_for
+    ):
+        nginx_chart = local_chart_metadata_for("nginx")
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[],
+            returncode=0,
+            stdout=json.dumps({"local": {"nginx": nginx_chart.model_dump()}}),
+            stderr="",
+        )
+
+        nix.get_charts()
+        assert nix.get_charts() == {"local": {"nginx": nginx_chart}}
+        assert mock_run_cmd.call_count == 1
+
+        content_key.return_value = "changed"
+        nix.get_charts()
+        assert mock_run_cmd.call_count == 2
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_get_charts_not_cached_outside_git(self, mock_run_cmd, content_key):
+        content_key.return_value = None
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="{}", stderr=""
+        )
+
+        nix.get_charts()
+        nix.get_charts()
+
+        assert mock_run_cmd.call_count == 2
+
+
+class TestGetChartsFromLock:
+    @pytest.fixture(autouse=True)
+    def lock_file(self, tmp_path, monkeypatch, local_chart_metadata_for):
+        monkeypatch.chdir(tmp_path)
+        subprocess.run(["git", "init", "-q"], check=True)
+        charts_lock.write(
+            {"local": {"nginx": local_chart_metadata_for("nginx").model_dump()}}
+        )
+        subprocess.run(["git", "add", charts_lock.LOCK_FILE], check=True)
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_get_charts(self, mock_run_cmd, tmp_path, local_chart_metadata_for):
+        nginx_chart = local_chart_metadata_for("nginx")
+        podinfo_chart = local_chart_metadata_for("podinfo")
+        # Only charts missing from the lock file have a chart file
+        chart_path = tmp_path / "charts" / "local" / "podinfo" / "default.nix"
+        chart_path.parent.mkdir(parents=True)
+        chart_path.write_text(
+            "".join(f'{key} = "{value}";\n' for key, value in podinfo_chart)
+        )
+
+        result = nix.get_charts()
+
+        assert result == {"local": {"nginx": nginx_chart, "podinfo": podinfo_chart}}
+        mock_run_cmd.assert_not_called()
+
+    def test_get_charts_conflict(self, tmp_path):
+        chart_path = tmp_path / "charts" / "local" / "nginx" / "default.nix"
+        chart_path.parent.mkdir(parents=True)
+        chart_path.write_text("{ }")
+
+        with pytest.raises(charts_lock.ConflictError, match="local/nginx"):
+            nix.get_charts()
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_get_chart(self, mock_run_cmd, local_chart_metadata_for):
+        assert nix.get_chart("local", "nginx") == local_chart_metadata_for("nginx")
+        mock_run_cmd.assert_not_called()
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_file_engine(self, mock_run_cmd, monkeypatch):
+        monkeypatch.setattr(nix, "engine", nix.Engine.FILE)
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="", stderr=""
+        )
+
+        nix.build_charts([("local", "nginx"), ("local", "podinfo")])
+
+        args = mock_run_cmd.call_args.args
+        expr = args[args.index("--expr") + 1]
+        assert '"nginx" = lockedChart { "repo" = ' in expr
+        assert '"podinfo" = chart (/. + ' in expr
+
+
+@pytest.mark.e2e
+class TestFlakeWithLock:
+    """Evaluate the flake of the repository on a tree with a lock file."""
+
+    @pytest.fixture(autouse=True)
+    def tree(self, tmp_path, monkeypatch, local_chart_metadata_for):
+        root = Path(__file__).parents[2]
+        for name in ("flake.nix", "flake.lock"):
+            (tmp_path / name).write_text((root / name).read_text())
+        monkeypatch.chdir(tmp_path)
+        subprocess.run(["git", "init", "-q"], check=True)
+        charts_lock.write(
+            {"local": {"nginx": local_chart_metadata_for("nginx").model_dump()}}
+        )
+        self.write_chart_file(tmp_path, local_chart_metadata_for("podinfo"))
+        subprocess.run(
+            ["git", "add", "flake.nix", "flake.lock", charts_lock.LOCK_FILE, "charts"],
+            check=True,
+        )
+
+    @staticmethod
+    def write_chart_file(tmp_path, chart_info):
+        chart_path = tmp_path / "charts" / "local" / chart_info.chart / "default.nix"
+        chart_path.parent.mkdir(parents=True, exist_ok=True)
+        chart_path.write_text(
+            "{\n"
+            + "".join(f'  {key} = "{value}";\n' for key, value in chart_info)
+            + "}\n"
+        )
+
+    @staticmethod
+    def eval_charts() -> subprocess.CompletedProcess:
+        return subprocess.run(
+            ["nix", "eval", ".#chartsMetadata", "--json"],
+            capture_output=True,
+            text=True,
+        )
+
+    def test_charts_metadata(self, local_chart_metadata_for):
+        result = self.eval_charts()
+
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout) == {
+            "local": {
+                name: local_chart_metadata_for(name).model_dump()
+                for name in ("nginx", "podinfo")
+            }
+        }
+
+    def test_conflict(self, tmp_path, local_chart_metadata_for):
+        self.write_chart_file(tmp_path, local_chart_metadata_for("nginx"))
+        subprocess.run(["git", "add", "charts"], check=True)
+
+        result = self.eval_charts()
+
+        assert result.returncode != 0
+        assert "local/nginx: defined both in charts.lock.json" in result.stderr
+
 
 class TestGetChart:
     @patch("helmupdater.nix.run_cmd")
@@ -232,3 +547,107 @@ class TestGetChart:
         mock_run_cmd.assert_called_once_with(
             "nix", "eval", ".#chartsMetadata.local.nginx", "--json"
         )
+
+
+class TestFileEngine:
+    @pytest.fixture(autouse=True)
+    def file_engine(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(nix, "engine", nix.Engine.FILE)
+        monkeypatch.chdir(tmp_path)
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_build_chart(self, mock_run_cmd, tmp_path):
+        nix.build_chart("local", "nginx")
+
+        args = mock_run_cmd.call_args.args
+        assert args[:4] == ("nix", "build", "--impure", "--expr")
+        assert args[5:] == ('"local"."nginx"',)
+        expr = args[4]
+        assert f'(/. + "{tmp_path}/flake.lock")' in expr
+        assert (
+            f'"local" = {{ "nginx" = chart (/. + '
+            f'"{tmp_path}/charts/local/nginx/default.nix"); }};'
+        ) in expr
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_build_charts(self, mock_run_cmd):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="", stderr=""
+        )
+
+        nix.build_charts([("local", "nginx"), ("remote", "dummy")])
+
+        args = mock_run_cmd.call_args.args
+        assert args[-2:] == ('"local"."nginx"', '"remote"."dummy"')
+        assert args.count("--expr") == 1
+
+    @patch("helmupdater.nix.run_cmd")
+    def test_get_derivation_path(self, mock_run_cmd):
+        nix.get_derivation_path("local", "nginx")
+
+        assert mock_run_cmd.call_args.args[-1] == '"local"."nginx".drvPath'
+
+    @patch("helmupdater.nix.current_system")
+    @patch("helmupdater.nix.run_cmd")
+    def test_get_chart(
+        self, mock_run_cmd, mock_current_system, tmp_path, local_chart_metadata_for
+    ):
+        chart = local_chart_metadata_for("nginx")
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout=json.dumps(chart.model_dump()), stderr=""
+        )
+
+        assert nix.get_chart("local", "nginx") == chart
+        mock_run_cmd.assert_called_once_with(
+            "nix",
+            "eval",
+            "--json",
+            "--file",
+            str(tmp_path / "charts" / "local" / "nginx" / "default.nix"),
+        )
+        mock_current_system.assert_not_called()
+
+    def test_nix_string_escapes_interpolation(self):
+        assert nix._nix_string('a "${b}"') == '"a \\"\\${b}\\""'
+
+
+class TestReplEngine:
+    @pytest.fixture(autouse=True)
+    def repl_engine(self, monkeypatch):
+        monkeypatch.setattr(nix, "engine", nix.Engine.REPL)
+
+    @pytest.fixture
+    def mock_repl(self, monkeypatch):
+        repl = Mock()
+        monkeypatch.setattr(nix, "_repl_session", repl)
+        return repl
+
+    def test_get_chart(self, mock_repl, local_chart_metadata_for):
+        chart = local_chart_metadata_for("nginx")
+        mock_repl.eval_json.return_value = chart.model_dump()
+
+        assert nix.get_chart("local", "nginx") == chart
+        mock_repl.eval_json.assert_called_once_with('chartsMetadata."local"."nginx"')
+
+    def test_get_derivation_path(self, mock_repl):
+        mock_repl.eval_json.return_value = "/nix/store/abc-nginx-1.0.0.drv"
+
+        assert nix.get_derivation_path("local", "nginx") == (
+            "/nix/store/abc-nginx-1.0.0.drv"
+        )
+        mock_repl.eval_json.assert_called_once_with(
+            'chartsDerivations.${builtins.currentSystem}."local"."nginx".drvPath'
+        )
+
+    @patch("helmupdater.nix.current_system", return_value="x86_64-linux")
+    @patch("helmupdater.nix.run_cmd")
+    def test_build_chart_uses_flake(self, mock_run_cmd, _, mock_repl):
+        nix.build_chart("local", "nginx")
+
+        mock_run_cmd.assert_called_once_with(
+            "nix",
+            "build",
+            ".#chartsDerivations.x86_64-linux.local.nginx",
+            raise_on_error=True,
+        )
+        mock_repl.eval_json.assert_not_called()
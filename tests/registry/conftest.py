@@ -0,0 +1,18 @@
+import pytest
+
+from helmupdater.registry import http, latency
+
+
+@pytest.fixture(autouse=True)
+def latency_profiles(monkeypatch):
+    """Start every test without latency samples, and don't persist them."""
+    monkeypatch.setattr(latency.profiles, "_samples", None)
+    yield latency.profiles
+    latency.profiles._samples = None
+    latency.profiles._dirty = False
+
+
+@pytest.fixture(autouse=True)
+def chart_api_support(monkeypatch):
+    """Forget which repositories serve the ChartMuseum API between tests."""
+    monkeypatch.setattr(http, "_chart_api_support", None)
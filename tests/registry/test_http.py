@@ -5,16 +5,46 @@ Tests require the local registry to be running:
     tests/_infra/setup.sh
 """
 
-from unittest.mock import patch
+import json
+from datetime import timedelta
+from unittest.mock import Mock, patch
 
 import pytest
+import requests
 
-from helmupdater.registry import HTTPRegistry
+from helmupdater import utils
+from helmupdater.registry import ChartNotFoundError, HTTPRegistry, http
+from helmupdater.registry.latency import profiles
 
 REGISTRY_URL = "http://localhost:45010/"
 REGISTRY_NAME = "local"
 
 
+def _mock_response(mock_get, body: bytes, first_byte: float = 0.1):
+    response = mock_get.return_value
+    response.status_code = 200
+    response.headers = {}
+    response.iter_content.return_value = [body[:10], body[10:]]
+    response.elapsed = timedelta(seconds=first_byte)
+    return response
+
+
+def _response(status_code: int, body: bytes, headers: dict | None = None):
+    response = Mock(
+        status_code=status_code,
+        headers=headers or {},
+        elapsed=timedelta(seconds=0.1),
+    )
+    response.iter_content.return_value = [body]
+    return response
+
+
+INDEX = b"entries:\n  nginx:\n  - version: 1.0.0\n"
+API_NGINX = b'[{"name": "nginx", "version": "1.0.1"}, {"version": "1.0.0"}]'
+API_NOT_FOUND = b'{"error": "chart not found"}'
+HTML_NOT_FOUND = b"<html>404 Not Found</html>"
+
+
 class TestHTTPRegistry:
     """Test HTTP registry with local instance."""
 
@@ -71,3 +101,139 @@ class TestHTTPRegistry:
         assert len(versions) == 2
         version_strings = [v.version for v in versions]
         assert version_strings == ["1.0.0", "2.0.0"]
+
+    @patch("helmupdater.registry.http.requests.get")
+    def test_index_fetched_once(self, mock_get):
+        _mock_response(
+            mock_get,
+            b"apiVersion: v1\n"
+            b"entries:\n"
+            b"  nginx:\n"
+            b"  - version: 1.0.0\n"
+            b"  podinfo:\n"
+            b"  - version: v1.0.1\n",
+        )
+        registry = HTTPRegistry("http://example.com", "test")
+
+        assert registry.list_charts() == ["nginx", "podinfo"]
+        assert [v.version for v in registry.get_versions("nginx")] == ["1.0.0"]
+        assert [v.version for v in registry.get_versions("podinfo")] == ["v1.0.1"]
+        mock_get.assert_called_once()
+
+    @patch("helmupdater.registry.http.requests.get")
+    def test_index_request_profiled(self, mock_get):
+        _mock_response(mock_get, b"entries: {}\n", first_byte=0.25)
+
+        HTTPRegistry("http://example.com", "test").list_charts()
+
+        assert mock_get.call_args.kwargs["timeout"] == (5.0, 5.0)
+        assert mock_get.call_args.kwargs["stream"] is True
+        [sample] = profiles.samples["example.com"]
+        assert sample["first_byte"] == 0.25
+        assert sample["size"] == len(b"entries: {}\n")
+
+    @patch("helmupdater.registry.http.requests.get")
+    def test_explicit_timeout(self, mock_get):
+        _mock_response(mock_get, b"entries: {}\n")
+
+        HTTPRegistry("http://example.com", "test", timeout=2).list_charts()
+
+        assert mock_get.call_args.kwargs["timeout"] == (2, 2)
+
+    @patch("helmupdater.registry.http.requests.get")
+    def test_slow_transfer_times_out(self, mock_get):
+        response = _mock_response(mock_get, b"entries: {}\n")
+
+        with pytest.raises(requests.exceptions.Timeout, match="transfer took longer"):
+            HTTPRegistry._read_body(response, limit=-1)
+        response.close.assert_called_once()
+
+
+@patch("helmupdater.registry.http.requests.get")
+class TestChartMuseumAPI:
+    def test_uses_chart_api(self, mock_get):
+        mock_get.return_value = _response(200, API_NGINX)
+
+        registry = HTTPRegistry("http://example.com/charts", "test")
+
+        assert registry._fetch_raw_versions("nginx") == ["1.0.1", "1.0.0"]
+        mock_get.assert_called_once()
+        assert mock_get.call_args.args == (
+            "http://example.com/api/charts/charts/nginx",
+        )
+
+    def test_chart_not_found(self, mock_get):
+        mock_get.return_value = _response(404, API_NOT_FOUND)
+
+        with pytest.raises(ChartNotFoundError):
+            HTTPRegistry("http://example.com", "test")._fetch_raw_versions("gone")
+
+    def test_falls_back_to_index_and_remembers(self, mock_get):
+        mock_get.side_effect = [
+            _response(404, HTML_NOT_FOUND),
+            _response(200, INDEX),
+            _response(200, INDEX),
+        ]
+
+        assert HTTPRegistry("http://example.com", "a").get_versions("nginx")
+        assert HTTPRegistry("http://example.com", "b").get_versions("nginx")
+
+        urls = [c.args[0] for c in mock_get.call_args_list]
+        assert urls == [
+            "http://example.com/api/charts/nginx",
+            "http://example.com/index.yaml",
+            "http://example.com/index.yaml",
+        ]
+        assert json.loads((utils.cache_dir() / "chart_api.json").read_text()) == {
+            "http://example.com/": False
+        }
+
+    def test_get_digest(self, mock_get):
+        mock_get.return_value = _response(
+            200, b'[{"version": "1.0.1", "digest": "abc"}, {"version": "1.0.0"}]'
+        )
+        registry = HTTPRegistry("http://example.com", "test")
+
+        assert registry.get_digest("nginx", "1.0.1") == "sha256:abc"
+        assert registry.get_digest("nginx", "1.0.0") is None
+        assert [v.version for v in registry.get_versions("nginx")] == ["1.0.1", "1.0.0"]
+        mock_get.assert_called_once()
+
+    def test_server_error_not_remembered(self, mock_get):
+        mock_get.side_effect = [_response(502, b"Bad Gateway"), _response(200, INDEX)]
+
+        assert HTTPRegistry("http://example.com", "test").get_versions("nginx")
+
+        assert http._supports_chart_api("http://example.com/") is None
+
+    def test_index_used_once_loaded(self, mock_get):
+        mock_get.return_value = _response(200, INDEX)
+        registry = HTTPRegistry("http://example.com", "test")
+
+        registry.list_charts()
+        registry.get_versions("nginx")
+
+        mock_get.assert_called_once()
+
+
+@patch("helmupdater.registry.http.requests.get")
+class TestIndexCache:
+    def test_revalidates_stored_index(self, mock_get):
+        http._chart_api_support = {"http://example.com/": False}
+        mock_get.side_effect = [
+            _response(200, INDEX, headers={"ETag": '"v1"'}),
+            _response(304, b""),
+        ]
+
+        assert HTTPRegistry("http://example.com", "a").get_versions("nginx")
+        assert HTTPRegistry("http://example.com", "b").get_versions("nginx")
+
+        assert mock_get.call_args_list[0].kwargs["headers"] == {}
+        assert mock_get.call_args_list[1].kwargs["headers"] == {"If-None-Match": '"v1"'}
+
+    def test_chart_missing_from_index(self, mock_get):
+        http._chart_api_support = {"http://example.com/": False}
+        mock_get.return_value = _response(200, INDEX)
+
+        with pytest.raises(ChartNotFoundError):
+            HTTPRegistry("http://example.com", "test").get_versions("gone")
@@ -0,0 +1,112 @@
+import json
+import os
+
+import pytest
+
+from helmupdater.registry.index_cache import IndexCache, scan_offsets
+
+INDEX = (
+    b"apiVersion: v1\n"
+    b"entries:\n"
+    b"  nginx:\n"
+    b"  - name: nginx\n"
+    b"    version: 1.0.1\n"
+    b"  - name: nginx\n"
+    b"    version: 1.0.0\n"
+    b"  # comment\n"
+    b'  "podinfo":\n'
+    b"    - version: v1.0.1\n"
+    b"generated: 2024-01-01T00:00:00Z\n"
+)
+
+
+class TestScanOffsets:
+    def test_block_style(self):
+        offsets = scan_offsets(INDEX)
+
+        assert list(offsets) == ["nginx", "podinfo"]
+        start, end = offsets["nginx"]
+        assert INDEX[start:end].startswith(b"  nginx:\n")
+        assert INDEX[start:end].endswith(b"version: 1.0.0\n  # comment\n")
+        start, end = offsets["podinfo"]
+        assert INDEX[start:end] == b'  "podinfo":\n    - version: v1.0.1\n'
+
+    def test_unindented_sequence(self):
+        content = b"entries:\n  nginx:\n  - version: 1.0.0\n  podinfo: []\n"
+
+        assert list(scan_offsets(content)) == ["nginx", "podinfo"]
+
+    @pytest.mark.parametrize(
+        "content",
+        [b"entries: {}\n", b"entries: {nginx: []}\n", b"apiVersion: v1\n"],
+    )
+    def test_other_layouts(self, content):
+        assert scan_offsets(content) is None
+
+
+class TestIndexCache:
+    @pytest.fixture
+    @staticmethod
+    def cache():
+        cache = IndexCache("http://example.com/index.yaml")
+        cache.store(INDEX, etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+        return IndexCache(cache.url)
+
+    def test_lookup(self, cache, monkeypatch):
+        monkeypatch.setattr(IndexCache, "load", lambda self: pytest.fail("full parse"))
+
+        assert [e["version"] for e in cache.lookup("nginx")] == ["1.0.1", "1.0.0"]
+        assert cache.lookup("podinfo") == [{"version": "v1.0.1"}]
+        assert cache.lookup("gone") is None
+        assert cache.chart_names() == ["nginx", "podinfo"]
+
+    def test_conditional_headers(self, cache):
+        assert cache.conditional_headers() == {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+        }
+
+    def test_nothing_stored(self):
+        cache = IndexCache("http://example.com/index.yaml")
+
+        assert cache.conditional_headers() == {}
+
+    def test_stale_sidecar_ignored(self, cache):
+        cache.path.write_bytes(INDEX + b"# replaced\n")
+
+        assert cache.conditional_headers() == {}
+        assert cache.lookup("podinfo") == [{"version": "v1.0.1"}]
+
+    def test_replaced_by_same_size_ignored(self, cache):
+        cache.path.write_bytes(INDEX.replace(b"v1.0.1", b"v1.0.2"))
+        os.utime(cache.path, ns=(0, 0))
+
+        assert cache.conditional_headers() == {}
+        assert cache.lookup("podinfo") == [{"version": "v1.0.2"}]
+
+    def test_alias_to_other_chart_falls_back_to_full_parse(self):
+        cache = IndexCache("http://example.com/index.yaml")
+        cache.store(
+            b"entries:\n"
+            b"  nginx:\n"
+            b"  - &nginx\n"
+            b"    version: 1.0.0\n"
+            b"  nginx-alias:\n"
+            b"  - *nginx\n"
+        )
+
+        assert cache.lookup("nginx-alias") == [{"version": "1.0.0"}]
+
+    def test_bad_offsets_fall_back_to_full_parse(self, cache):
+        sidecar = json.loads(cache.sidecar_path.read_text())
+        sidecar["charts"]["nginx"] = [0, 10]
+        cache.sidecar_path.write_text(json.dumps(sidecar))
+
+        assert len(cache.lookup("nginx")) == 2
+
+    def test_flow_style_index(self):
+        cache = IndexCache("http://example.com/index.yaml")
+        cache.store(b"entries: {nginx: [{version: 1.0.0}]}\n")
+
+        assert cache.chart_names() == ["nginx"]
+        assert cache.lookup("nginx") == [{"version": "1.0.0"}]
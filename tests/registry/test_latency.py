@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from helmupdater import utils
+from helmupdater.registry import latency
+from helmupdater.registry.latency import LatencyProfiles, Timeouts
+
+
+def _record(profiles, host, count, first_byte, transfer=0.0, size=0):
+    for _ in range(count):
+        profiles.record(host, first_byte, transfer, size)
+
+
+def test_defaults_without_samples():
+    profiles = LatencyProfiles()
+    _record(profiles, "example.org", latency.MIN_SAMPLES - 1, first_byte=0.1)
+
+    assert profiles.timeouts("example.org") == Timeouts(
+        latency.DEFAULT_CONNECT, latency.DEFAULT_FIRST_BYTE, latency.DEFAULT_TRANSFER
+    )
+
+
+def test_fast_host_fails_fast():
+    profiles = LatencyProfiles()
+    _record(profiles, "fast.example.org", 10, first_byte=0.1, transfer=0.1, size=10_000)
+
+    timeouts = profiles.timeouts("fast.example.org")
+
+    assert timeouts.connect == latency.MIN_CONNECT
+    assert timeouts.first_byte == latency.MIN_FIRST_BYTE
+    assert timeouts.transfer == latency.MIN_TRANSFER
+
+
+def test_large_slow_index_gets_time():
+    profiles = LatencyProfiles()
+    # 20 MB at 500 kB/s
+    _record(profiles, "slow.example.org", 10, 2.0, transfer=40.0, size=20_000_000)
+
+    timeouts = profiles.timeouts("slow.example.org")
+
+    assert timeouts.first_byte == pytest.approx(8.0)
+    assert timeouts.transfer == pytest.approx(160.0)
+
+
+def test_transfer_ignores_responses_without_body():
+    profiles = LatencyProfiles()
+    _record(profiles, "slow.example.org", 10, 2.0, transfer=40.0, size=20_000_000)
+    # Revalidations, requests without a known size and error pages
+    profiles.record("slow.example.org", 2.0)
+    profiles.record("slow.example.org", 2.0, transfer=0.0, size=0, status=304)
+    profiles.record("slow.example.org", 2.0, transfer=0.5, size=100, status=503)
+
+    timeouts = profiles.timeouts("slow.example.org")
+
+    assert timeouts.transfer == pytest.approx(160.0)
+
+
+def test_transfer_percentile_ignores_outliers():
+    profiles = LatencyProfiles()
+    _record(profiles, "example.org", 39, 0.1, transfer=1.0, size=1_000_000)
+    _record(profiles, "example.org", 1, 0.1, transfer=1000.0, size=1_000_000)
+
+    assert profiles.timeouts("example.org").transfer < latency.DEFAULT_TRANSFER
+
+
+def test_transfer_default_without_downloads():
+    profiles = LatencyProfiles()
+    _record(profiles, "example.org", 10, first_byte=0.1)
+
+    assert profiles.timeouts("example.org").transfer == latency.DEFAULT_TRANSFER
+
+
+def test_percentile_ignores_outliers():
+    profiles = LatencyProfiles()
+    _record(profiles, "example.org", 39, first_byte=1.0)
+    _record(profiles, "example.org", 1, first_byte=100.0)
+
+    assert profiles.timeouts("example.org").first_byte < latency.MAX_FIRST_BYTE
+
+
+def test_samples_capped():
+    profiles = LatencyProfiles()
+    _record(profiles, "example.org", latency.MAX_SAMPLES + 10, first_byte=0.1)
+
+    assert len(profiles.samples["example.org"]) == latency.MAX_SAMPLES
+
+
+def test_save_and_load():
+    profiles = LatencyProfiles()
+    profiles.record("example.org", 0.5, 1.0, 1000)
+    profiles.save()
+
+    state = json.loads((utils.cache_dir() / "latency.json").read_text())
+    assert state == {
+        "example.org": [
+            {"first_byte": 0.5, "transfer": 1.0, "size": 1000, "status": 200}
+        ]
+    }
+    assert LatencyProfiles().samples == state
@@ -5,11 +5,15 @@ Tests require the local registry to be running:
     tests/_infra/setup.sh
 """
 
-from unittest.mock import patch
+import threading
+from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
 
+from helmupdater import batch, chart
 from helmupdater.registry import OCIRegistry
+from helmupdater.registry.ratelimit import RequestScheduler
 
 REGISTRY_URL = "oci://localhost:45020/charts"
 REGISTRY_NAME = "local"
@@ -95,3 +99,122 @@ class TestOCIRegistry:
         version_strings = {v.version for v in versions}
         assert version_strings == {"1.11.1", "1.0.10", "v0.34.7"}
         assert max(versions).version == "1.11.1"
+
+    @patch("helmupdater.registry.oci.OrasClient")
+    def test_get_versions_in_batch(self, mock_client, oci_registry):
+        mock_client.return_value.get_tags.return_value = ["1.0.0", "1.1.0"]
+        charts = {
+            ("local", name): chart.ChartMetadata(
+                repo=REGISTRY_URL,
+                chart=name,
+                version="1.0.0",
+                chartHash=chart.PLACEHOLDER_HASH,
+            )
+            for name in ("nginx", "podinfo")
+        }
+
+        def check(repo_name, chart_name, chart_info):
+            # Charts are checked on worker threads, where signals can't be used
+            assert threading.current_thread() is not threading.main_thread()
+            latest = max(oci_registry.get_versions(chart_name))
+            return chart_info.model_copy(update={"version": latest.version})
+
+        run = batch.Batch("update", jobs=2)
+        try:
+            results = run.run(charts, check)
+        finally:
+            run.close()
+
+        assert {key: result.version for key, result in results.items()} == {
+            ("local", "nginx"): "1.1.0",
+            ("local", "podinfo"): "1.1.0",
+        }
+
+    @patch("helmupdater.registry.oci.OrasClient")
+    def test_get_versions_timeout(self, mock_client):
+        released = threading.Event()
+        finished = threading.Event()
+
+        def get_tags(_):
+            released.wait(5)
+            finished.set()
+            return []
+
+        mock_client.return_value.get_tags.side_effect = get_tags
+        oci_registry = OCIRegistry(
+            REGISTRY_URL, REGISTRY_NAME, insecure=True, timeout=0.01
+        )
+        scheduler = RequestScheduler(concurrency=1)
+        slots = scheduler.host("localhost:45020")._slots
+
+        with patch("helmupdater.registry.oci.scheduler", scheduler):
+            try:
+                with pytest.raises(TimeoutError, match="timed out"):
+                    oci_registry.get_versions("nginx")
+                # The abandoned call still talks to the host
+                assert not slots.acquire(blocking=False)
+            finally:
+                released.set()
+
+        assert finished.wait(5)
+        assert slots.acquire(timeout=5)
+
+    @patch("helmupdater.registry.oci.OrasClient")
+    def test_list_charts(self, mock_client, oci_registry):
+        pages = {
+            "http://localhost:45020/v2/_catalog": (
+                ["charts/podinfo", "charts/nginx", "charts/sub/chart"],
+                "/v2/_catalog?last=charts%2Fsub%2Fchart&n=3",
+            ),
+            "http://localhost:45020/v2/_catalog?last=charts%2Fsub%2Fchart&n=3": (
+                ["charts-other/redis", "other/loki"],
+                None,
+            ),
+        }
+
+        def do_request(url):
+            repositories, next_url = pages[url]
+            response = MagicMock(status_code=200, headers={})
+            response.json.return_value = {"repositories": repositories}
+            response.links = {"next": {"url": next_url}} if next_url else {}
+            return response
+
+        mock_client.return_value.do_request.side_effect = do_request
+
+        assert oci_registry.list_charts() == ["nginx", "podinfo"]
+        assert mock_client.return_value.do_request.call_count == 2
+
+    @patch("helmupdater.registry.oci.OrasClient")
+    def test_list_charts_no_catalog(self, mock_client, oci_registry):
+        response = requests.Response()
+        response.status_code = 404
+        response.url = "http://localhost:45020/v2/_catalog"
+        mock_client.return_value.do_request.return_value = response
+
+        with pytest.raises(ValueError, match="may not serve its catalog"):
+            oci_registry.list_charts()
+
+    @pytest.mark.e2e
+    def test_list_charts_e2e(self, oci_registry):
+        assert {"nginx", "podinfo"} <= set(oci_registry.list_charts())
+
+    @patch("helmupdater.registry.oci.OrasClient")
+    def test_get_digest(self, mock_client, oci_registry):
+        mock_client.return_value.get_manifest.return_value = {
+            "layers": [
+                {"mediaType": "application/vnd.oci.image.config.v1+json"},
+                {
+                    "mediaType": "application/vnd.cncf.helm.chart.content.v1.tar+gzip",
+                    "digest": "sha256:abc",
+                },
+            ]
+        }
+
+        assert oci_registry.get_digest("nginx", "1.0.0") == "sha256:abc"
+        mock_client.return_value.get_manifest.assert_called_once_with(
+            "localhost:45020/charts/nginx:1.0.0"
+        )
+
+    @pytest.mark.e2e
+    def test_get_digest_nginx(self, oci_registry):
+        assert oci_registry.get_digest("nginx", "1.0.0").startswith("sha256:")
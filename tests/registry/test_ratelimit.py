@@ -0,0 +1,303 @@
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+
+from helmupdater.registry import ratelimit
+from helmupdater.registry.ratelimit import HostThrottle, RequestScheduler
+
+
+def response(status_code=200, **headers):
+    return SimpleNamespace(status_code=status_code, headers=headers)
+
+
+@pytest.fixture
+def blocks():
+    """Record delays requested from throttles instead of waiting."""
+    delays = []
+    with patch.object(HostThrottle, "block_for", side_effect=delays.append):
+        yield delays
+
+
+class TestRequestScheduler:
+    def test_returns_result(self):
+        scheduler = RequestScheduler()
+
+        assert scheduler.call("example.org", lambda: "tags") == "tags"
+
+    def test_retries_throttled_response_after_retry_after(self, blocks):
+        scheduler = RequestScheduler()
+        request = Mock(side_effect=[response(429, **{"Retry-After": "3"}), response()])
+
+        assert scheduler.call("example.org", request).status_code == 200
+        assert request.call_count == 2
+        assert blocks == [3.0]
+
+    def test_retry_after_capped(self, blocks):
+        scheduler = RequestScheduler(max_delay=10)
+        request = Mock(
+            side_effect=[response(503, **{"Retry-After": "3600"}), response()]
+        )
+
+        scheduler.call("example.org", request)
+
+        assert blocks == [10]
+
+    @patch("helmupdater.registry.ratelimit.random.uniform", return_value=0.5)
+    def test_backoff_without_retry_after(self, mock_uniform, blocks):
+        scheduler = RequestScheduler(backoff=1.0)
+        request = Mock(side_effect=[response(429), response(429), response()])
+
+        scheduler.call("example.org", request)
+
+        assert blocks == [0.5, 0.5]
+        assert [c.args for c in mock_uniform.call_args_list] == [(0, 1.0), (0, 2.0)]
+
+    def test_returns_throttled_response_after_retries(self, blocks):
+        scheduler = RequestScheduler(retries=2)
+        request = Mock(return_value=response(429, **{"Retry-After": "1"}))
+
+        assert scheduler.call("example.org", request).status_code == 429
+        assert request.call_count == 3
+
+    def test_retries_throttling_errors(self, blocks):
+        scheduler = RequestScheduler()
+        request = Mock(
+            side_effect=[ValueError("Issue with ghcr.io: Too Many Requests"), ["1.0"]]
+        )
+
+        assert scheduler.call("ghcr.io", request) == ["1.0"]
+        assert request.call_count == 2
+
+    def test_other_errors_not_retried(self, blocks):
+        scheduler = RequestScheduler()
+        request = Mock(side_effect=ValueError("Issue with ghcr.io: Not Found"))
+
+        with pytest.raises(ValueError, match="Not Found"):
+            scheduler.call("ghcr.io", request)
+        request.assert_called_once()
+
+    def test_exhausted_rate_limit_pauses_host(self, blocks):
+        scheduler = RequestScheduler()
+        request = Mock(
+            return_value=response(
+                **{"RateLimit-Remaining": "0;w=21600", "RateLimit-Reset": "30"}
+            )
+        )
+
+        scheduler.call("registry-1.docker.io", request)
+
+        assert blocks == [30.0]
+
+    def test_remaining_rate_limit_ignored(self, blocks):
+        scheduler = RequestScheduler()
+        request = Mock(
+            return_value=response(
+                **{"RateLimit-Remaining": "76;w=21600", "RateLimit-Reset": "30"}
+            )
+        )
+
+        scheduler.call("registry-1.docker.io", request)
+
+        assert blocks == []
+
+    def test_hold_slot(self):
+        scheduler = RequestScheduler(concurrency=1)
+        slots = scheduler.host("example.org")._slots
+        releases = []
+
+        scheduler.call("example.org", lambda: releases.append(scheduler.hold_slot()))
+
+        assert not slots.acquire(blocking=False)
+        releases[0]()
+        assert slots.acquire(blocking=False)
+
+    def test_hold_slot_outside_request(self):
+        RequestScheduler().hold_slot()()
+
+    def test_throttles_per_host(self):
+        scheduler = RequestScheduler()
+
+        assert scheduler.host("a.example.org") is scheduler.host("a.example.org")
+        assert scheduler.host("a.example.org") is not scheduler.host("b.example.org")
+
+
+class TestCircuitBreaker:
+    def test_opens_after_consecutive_failures(self):
+        scheduler = RequestScheduler(failure_threshold=2)
+        request = Mock(side_effect=TimeoutError("timed out"))
+
+        for _ in range(2):
+            with pytest.raises(TimeoutError):
+                scheduler.call("down.example.org", request)
+        with pytest.raises(ratelimit.HostUnavailableError):
+            scheduler.call("down.example.org", request)
+
+        assert request.call_count == 2
+        assert scheduler.unavailable_hosts() == ["down.example.org"]
+        # other hosts are not affected
+        assert scheduler.call("up.example.org", lambda: "ok") == "ok"
+
+    def test_success_resets_failures(self):
+        scheduler = RequestScheduler(failure_threshold=2)
+        request = Mock(side_effect=[ConnectionError(), "ok", ConnectionError()])
+
+        with pytest.raises(ConnectionError):
+            scheduler.call("example.org", request)
+        scheduler.call("example.org", request)
+        with pytest.raises(ConnectionError):
+            scheduler.call("example.org", request)
+
+        assert scheduler.unavailable_hosts() == []
+
+    def test_server_errors_count(self):
+        scheduler = RequestScheduler(failure_threshold=2)
+        request = Mock(return_value=response(500))
+
+        for _ in range(2):
+            assert scheduler.call("down.example.org", request).status_code == 500
+        with pytest.raises(ratelimit.HostUnavailableError):
+            scheduler.call("down.example.org", request)
+
+        assert request.call_count == 2
+
+    def test_outage_stops_retries(self, blocks):
+        scheduler = RequestScheduler(failure_threshold=2, retries=4)
+        request = Mock(return_value=response(503))
+
+        with pytest.raises(ratelimit.HostUnavailableError):
+            scheduler.call("down.example.org", request)
+
+        assert request.call_count == 2
+        assert scheduler.unavailable_hosts() == ["down.example.org"]
+
+    def test_throttling_does_not_reset_failures(self, blocks):
+        scheduler = RequestScheduler(failure_threshold=2, retries=0)
+
+        scheduler.call("example.org", Mock(return_value=response(502)))
+        scheduler.call("example.org", Mock(return_value=response(429)))
+        scheduler.call("example.org", Mock(return_value=response(502)))
+
+        assert scheduler.unavailable_hosts() == ["example.org"]
+
+    def test_other_errors_do_not_count(self):
+        scheduler = RequestScheduler(failure_threshold=1)
+
+        with pytest.raises(ValueError):
+            scheduler.call("example.org", Mock(side_effect=ValueError("Not Found")))
+
+        assert scheduler.unavailable_hosts() == []
+
+    def test_probes_after_cooldown(self):
+        scheduler = RequestScheduler(failure_threshold=1, cooldown=0)
+        with pytest.raises(TimeoutError):
+            scheduler.call("example.org", Mock(side_effect=TimeoutError()))
+
+        assert scheduler.call("example.org", lambda: "ok") == "ok"
+        assert scheduler.unavailable_hosts() == []
+
+
+class TestHostThrottle:
+    def test_rate(self):
+        throttle = HostThrottle(concurrency=10, rate=50, burst=1)
+
+        started = time.monotonic()
+        for _ in range(6):
+            throttle.acquire()
+            throttle.release()
+
+        # the first token is available at once, the next five take 1/50s each
+        assert time.monotonic() - started >= 0.09
+
+    def test_concurrency(self):
+        throttle = HostThrottle(concurrency=2, rate=1000)
+        running = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def work():
+            nonlocal running, peak
+            throttle.acquire()
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            throttle.release()
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert peak == 2
+
+    def test_block_for(self):
+        throttle = HostThrottle(concurrency=1, rate=1000)
+
+        throttle.block_for(0.05)
+        started = time.monotonic()
+        throttle.acquire()
+        throttle.release()
+
+        assert time.monotonic() - started >= 0.04
+
+
+@pytest.mark.parametrize(
+    ("headers", "expected"),
+    [
+        ({}, None),
+        ({"Retry-After": "12"}, 12.0),
+        ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+        ({"Retry-After": "soon"}, None),
+    ],
+)
+def test_retry_after(headers, expected):
+    assert ratelimit._retry_after(headers) == expected
+
+
+def test_github_rate_limit_reset_is_epoch():
+    reset = ratelimit._rate_limit_reset(
+        {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 60)}
+    )
+
+    assert reset is not None and 55 <= reset <= 60
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [(None, 4), ("1", 1), ("16", 16)],
+)
+def test_concurrency_from_env(monkeypatch, value, expected):
+    if value is not None:
+        monkeypatch.setenv("HELMUPDATER_HOST_CONCURRENCY", value)
+
+    limit = ratelimit._limit_from_env("HELMUPDATER_HOST_CONCURRENCY", int, 4, 1, False)
+
+    assert limit == expected
+
+
+@pytest.mark.parametrize(
+    ("name", "value"),
+    [
+        ("HELMUPDATER_HOST_CONCURRENCY", "0"),
+        ("HELMUPDATER_HOST_CONCURRENCY", "1.5"),
+        ("HELMUPDATER_HOST_RATE", "0"),
+        ("HELMUPDATER_HOST_RATE", "-1"),
+        ("HELMUPDATER_HOST_RATE", "nan"),
+        ("HELMUPDATER_HOST_RATE", "fast"),
+    ],
+)
+def test_invalid_limit_from_env(monkeypatch, name, value):
+    monkeypatch.setenv(name, value)
+    convert, minimum, strict = {
+        "HELMUPDATER_HOST_CONCURRENCY": (int, 1, False),
+        "HELMUPDATER_HOST_RATE": (float, 0.0, True),
+    }[name]
+
+    with pytest.raises(ValueError, match=name):
+        ratelimit._limit_from_env(name, convert, 10, minimum, strict)
@@ -0,0 +1,158 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from helmupdater import batch, chart, history
+
+AVAILABLE = [
+    ("bitnami", "postgresql"),
+    ("bitnami", "redis"),
+    ("grafana", "loki"),
+    ("grafana", "tempo"),
+    ("zalando", "postgres-operator"),
+]
+
+
+def _chart_info(chart_name: str, version: str = "1.0.0") -> chart.ChartMetadata:
+    return chart.ChartMetadata(
+        repo="https://example.com/charts",
+        chart=chart_name,
+        version=version,
+        chartHash=chart.PLACEHOLDER_HASH,
+    )
+
+
+class TestSelect:
+    @pytest.mark.parametrize(
+        ("selectors", "expected"),
+        [
+            (["grafana/loki"], [("grafana", "loki")]),
+            (["bitnami/*"], [("bitnami", "postgresql"), ("bitnami", "redis")]),
+            (
+                ["*/postgres*"],
+                [("bitnami", "postgresql"), ("zalando", "postgres-operator")],
+            ),
+            (["re:grafana/(loki|tempo)"], [("grafana", "loki"), ("grafana", "tempo")]),
+            (["re:.*/t.*"], [("grafana", "tempo")]),
+            (
+                ["grafana/tempo", "grafana/*"],
+                [("grafana", "tempo"), ("grafana", "loki")],
+            ),
+        ],
+    )
+    def test_select(self, selectors, expected):
+        assert batch.select(AVAILABLE, selectors) == expected
+
+    def test_regex_fully_matched(self):
+        with pytest.raises(ValueError, match="No charts match"):
+            batch.select(AVAILABLE, ["re:grafana/lo"])
+
+    @pytest.mark.parametrize("selector", ["grafana/mimir", "*/mimir*"])
+    def test_no_match(self, selector):
+        with pytest.raises(ValueError, match="No charts match"):
+            batch.select(AVAILABLE, [selector])
+
+    @pytest.mark.parametrize("selector", ["loki", "*", "re:("])
+    def test_invalid(self, selector):
+        with pytest.raises(ValueError):
+            batch.select(AVAILABLE, [selector])
+
+    def test_is_selector(self):
+        assert batch.is_selector("bitnami/*")
+        assert batch.is_selector("re:bitnami/redis")
+        assert not batch.is_selector("bitnami/redis")
+
+
+class TestResolve:
+    def test_names_read_from_files(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        for chart_name in ("loki", "tempo"):
+            path = chart.create_chart_directory("grafana", chart_name) / "default.nix"
+            chart.write_chart_file(path, _chart_info(chart_name))
+
+        with patch("helmupdater.batch.nix") as mock_nix:
+            charts = batch.resolve(["grafana/tempo", "grafana/loki"])
+
+        assert list(charts) == [("grafana", "tempo"), ("grafana", "loki")]
+        assert charts["grafana", "loki"] == _chart_info("loki")
+        mock_nix.get_charts.assert_not_called()
+        mock_nix.get_chart.assert_not_called()
+
+    def test_missing_name(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        with pytest.raises(ValueError, match="No charts match"):
+            batch.resolve(["grafana/loki"])
+
+    @patch("helmupdater.batch.nix.get_charts")
+    def test_patterns_evaluated_once(self, mock_get_charts):
+        mock_get_charts.return_value = {
+            "grafana": {"loki": _chart_info("loki"), "tempo": _chart_info("tempo")},
+            "bitnami": {"redis": _chart_info("redis")},
+        }
+
+        charts = batch.resolve(["grafana/*", "bitnami/redis"])
+
+        assert list(charts) == [
+            ("grafana", "loki"),
+            ("grafana", "tempo"),
+            ("bitnami", "redis"),
+        ]
+        mock_get_charts.assert_called_once()
+
+
+class TestBatch:
+    @pytest.fixture
+    @staticmethod
+    def run():
+        run = batch.Batch("update", jobs=4)
+        yield run
+        run.close()
+
+    def test_run(self, run):
+        charts = {
+            ("grafana", "loki"): _chart_info("loki"),
+            ("grafana", "tempo"): _chart_info("tempo"),
+        }
+
+        def check(repo_name, chart_name, chart_info):
+            history.add("registry_requests", 1)
+            if chart_name == "tempo":
+                raise RuntimeError("boom")
+            return chart_info.model_copy(update={"version": "1.0.1"})
+
+        results = run.run(charts, check)
+
+        assert results["grafana", "loki"].version == "1.0.1"
+        assert isinstance(results["grafana", "tempo"], RuntimeError)
+        rows = history.connect().execute(
+            "SELECT chart, outcome, new_version, error, registry_requests "
+            "FROM charts ORDER BY chart"
+        )
+        assert [tuple(row) for row in rows] == [
+            ("grafana/loki", "updated", "1.0.1", None, 1),
+            ("grafana/tempo", "failed", None, "boom", 1),
+        ]
+
+    def test_run_concurrently(self, run):
+        charts = {("grafana", name): _chart_info(name) for name in ("a", "b", "c")}
+        barrier = threading.Barrier(len(charts), timeout=5)
+
+        def check(repo_name, chart_name, chart_info):
+            barrier.wait()
+            return chart_info
+
+        results = run.run(charts, check)
+
+        assert results == charts
+
+    @patch("helmupdater.batch.registry.create")
+    def test_registry_shared(self, mock_create, run):
+        mock_create.side_effect = lambda url, name: MagicMock()
+
+        first = run.registry("https://example.com/charts", "grafana")
+
+        assert run.registry("https://example.com/charts", "grafana") is first
+        assert run.registry("https://example.org/charts", "bitnami") is not first
+        assert mock_create.call_count == 2
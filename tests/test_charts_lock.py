@@ -0,0 +1,296 @@
+import json
+import subprocess
+import threading
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from helmupdater import chart, charts_lock, cli, locks
+
+
+def _chart_info(chart_name: str, version: str = "1.0.0") -> chart.ChartMetadata:
+    return chart.ChartMetadata(
+        repo="https://example.com/charts",
+        chart=chart_name,
+        version=version,
+        chartHash=chart.PLACEHOLDER_HASH,
+    )
+
+
+def _entry(chart_name: str, version: str = "1.0.0") -> dict[str, str]:
+    return _chart_info(chart_name, version).model_dump()
+
+
+def _git(*args: str) -> None:
+    run = ["git", "-c", "user.name=test", "-c", "user.email=test@example.org"]
+    subprocess.run([*run, *args], check=True, capture_output=True)
+
+
+def _git_output(*args: str) -> str:
+    return subprocess.run(
+        ["git", *args], capture_output=True, text=True, check=True
+    ).stdout
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _git("init", "-q")
+    return tmp_path
+
+
+@pytest.fixture
+def lock_file(repo):
+    charts_lock.write({"grafana": {"loki": _entry("loki")}})
+    _git("add", charts_lock.LOCK_FILE)
+    return repo / charts_lock.LOCK_FILE
+
+
+def _write_chart_file(repo, repo_name: str, chart_name: str) -> None:
+    chart_path = repo / "charts" / repo_name / chart_name / "default.nix"
+    chart_path.parent.mkdir(parents=True)
+    chart_path.write_text(
+        "".join(f'{key} = "{value}";\n' for key, value in _chart_info(chart_name))
+    )
+
+
+class TestLockFile:
+    def test_disabled_without_file(self, repo):
+        charts_lock.put("grafana", "loki", _chart_info("loki"))
+
+        assert not charts_lock.enabled()
+        assert charts_lock.load() is None
+        assert charts_lock.get("grafana", "loki") is None
+        assert not (repo / charts_lock.LOCK_FILE).exists()
+
+    def test_write_and_get(self, lock_file):
+        assert charts_lock.enabled()
+        assert charts_lock.get("grafana", "loki") == _chart_info("loki")
+        assert charts_lock.get("grafana", "tempo") is None
+
+    def test_render_sorted(self, lock_file):
+        charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+        charts_lock.put("bitnami", "redis", _chart_info("redis"))
+
+        content = lock_file.read_text()
+        data = json.loads(content)
+        assert data["version"] == charts_lock.FORMAT_VERSION
+        assert list(data["charts"]) == ["bitnami", "grafana"]
+        assert list(data["charts"]["grafana"]) == ["loki", "tempo"]
+        assert list(data["charts"]["grafana"]["loki"]) == [
+            "chart",
+            "chartHash",
+            "repo",
+            "version",
+        ]
+        assert content == charts_lock.render(charts_lock.parse(content))
+
+    def test_put_written_immediately(self, lock_file):
+        charts_lock.put("grafana", "loki", _chart_info("loki", "2.0.0"))
+
+        data = json.loads(lock_file.read_text())
+        assert data["charts"]["grafana"]["loki"]["version"] == "2.0.0"
+
+    def test_deferred_written_once(self, lock_file):
+        with patch("helmupdater.charts_lock.utils.write_atomic") as mock_write:
+            with charts_lock.deferred():
+                charts_lock.put("grafana", "loki", _chart_info("loki", "2.0.0"))
+                charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+
+                assert charts_lock.get("grafana", "tempo") == _chart_info("tempo")
+                mock_write.assert_not_called()
+
+        mock_write.assert_called_once()
+        assert '"tempo"' in mock_write.call_args.args[1]
+
+    def test_flush_within_deferred(self, lock_file):
+        with charts_lock.deferred():
+            charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+            charts_lock.flush()
+
+            assert "tempo" in json.loads(lock_file.read_text())["charts"]["grafana"]
+
+    def test_remove(self, lock_file):
+        charts_lock.remove("grafana", "loki")
+
+        assert json.loads(lock_file.read_text())["charts"] == {}
+
+    def test_reloaded_when_changed_on_disk(self, lock_file):
+        assert charts_lock.get("grafana", "loki") == _chart_info("loki")
+
+        content = charts_lock.render({"grafana": {"loki": _entry("loki", "3.0.0")}})
+        lock_file.write_text(content)
+
+        assert charts_lock.get("grafana", "loki").version == "3.0.0"
+
+    def test_changes_of_other_processes_kept(self, lock_file):
+        with charts_lock.deferred():
+            charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+            charts_lock.remove("grafana", "loki")
+            # Another process writes the lock file in the meantime
+            other = {
+                "bitnami": {"redis": _entry("redis")},
+                "grafana": {"loki": _entry("loki", "2.0.0"), "mimir": _entry("mimir")},
+            }
+            lock_file.write_text(charts_lock.render(other))
+
+            assert charts_lock.get("bitnami", "redis") == _chart_info("redis")
+            assert charts_lock.get("grafana", "loki") is None
+
+        assert charts_lock.parse(lock_file.read_text()) == {
+            "bitnami": {"redis": _entry("redis")},
+            "grafana": {"mimir": _entry("mimir"), "tempo": _entry("tempo")},
+        }
+
+    def test_flush_waits_for_other_processes(self, lock_file):
+        with charts_lock.deferred():
+            charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+            with locks.lock_file_lock():
+                flush = threading.Thread(target=charts_lock.flush)
+                flush.start()
+                flush.join(0.2)
+                assert flush.is_alive()
+                assert "tempo" not in lock_file.read_text()
+            flush.join()
+
+        assert "tempo" in lock_file.read_text()
+
+    def test_unknown_version(self, repo):
+        (repo / charts_lock.LOCK_FILE).write_text('{"version": 2, "charts": {}}')
+        _git("add", charts_lock.LOCK_FILE)
+
+        with pytest.raises(ValueError, match="format version 2"):
+            charts_lock.load()
+
+    def test_untracked(self, repo):
+        (repo / charts_lock.LOCK_FILE).write_text(charts_lock.render({}))
+
+        with pytest.raises(ValueError, match="isn't tracked by git"):
+            charts_lock.load()
+        with pytest.raises(ValueError, match="isn't tracked by git"):
+            charts_lock.enabled()
+
+    def test_conflict(self, lock_file, repo):
+        _write_chart_file(repo, "grafana", "loki")
+
+        with pytest.raises(charts_lock.ConflictError, match="grafana/loki: defined"):
+            charts_lock.get("grafana", "loki")
+
+
+class TestCommitted:
+    @pytest.fixture(autouse=True)
+    def identity(self, monkeypatch):
+        for variable in ("GIT_AUTHOR", "GIT_COMMITTER"):
+            monkeypatch.setenv(f"{variable}_NAME", "test")
+            monkeypatch.setenv(f"{variable}_EMAIL", "test@example.org")
+
+    @pytest.fixture
+    def committed(self, lock_file, repo):
+        _git("commit", "-q", "-m", "init")
+        return lock_file
+
+    def test_committed_content_single_chart(self, committed):
+        charts_lock.put("grafana", "loki", _chart_info("loki", "2.0.0"))
+        charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+
+        content = charts_lock.committed_content("grafana", "loki")
+
+        assert charts_lock.parse(content) == {
+            "grafana": {"loki": _entry("loki", "2.0.0")}
+        }
+
+    def test_committed_content_removed_chart(self, committed):
+        charts_lock.remove("grafana", "loki")
+
+        content = charts_lock.committed_content("grafana", "loki")
+
+        assert charts_lock.parse(content) == {}
+
+    def test_committed_content_not_committed(self, lock_file):
+        assert charts_lock.committed_content("grafana", "loki") is None
+
+    def test_changed_since(self, committed):
+        charts_lock.put("grafana", "loki", _chart_info("loki", "2.0.0"))
+        charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+        charts_lock.put("bitnami", "redis", _chart_info("redis"))
+
+        assert charts_lock.changed_since("HEAD") == [
+            ("bitnami", "redis"),
+            ("grafana", "loki"),
+            ("grafana", "tempo"),
+        ]
+
+    def test_commit_chart(self, committed):
+        with charts_lock.deferred():
+            chart.write_chart_file(
+                chart.get_chart_path("grafana", "loki"), _chart_info("loki", "2.0.0")
+            )
+            charts_lock.put("grafana", "tempo", _chart_info("tempo"))
+
+            chart.commit("grafana", "loki", "grafana/loki: update to 2.0.0")
+
+        committed = charts_lock.parse(
+            _git_output("show", f"HEAD:{charts_lock.LOCK_FILE}")
+        )
+        assert committed == {"grafana": {"loki": _entry("loki", "2.0.0")}}
+        files = _git_output("show", "--name-only", "--format=", "HEAD").split()
+        assert files == [charts_lock.LOCK_FILE]
+        status = _git_output("status", "--porcelain", "--untracked-files=no")
+        # tempo isn't committed yet
+        assert status == f" M {charts_lock.LOCK_FILE}\n"
+
+    def test_commit_chart_moved_to_lock(self, lock_file, repo):
+        _write_chart_file(repo, "grafana", "tempo")
+        _git("add", "charts")
+        _git("commit", "-q", "-m", "init")
+        chart_path = chart.get_chart_path("grafana", "tempo")
+
+        chart.write_chart_file(chart_path, _chart_info("tempo", "2.0.0"))
+        chart.commit("grafana", "tempo", "grafana/tempo: update to 2.0.0")
+
+        assert not (repo / "charts" / "grafana").exists()
+        committed = charts_lock.parse(
+            _git_output("show", f"HEAD:{charts_lock.LOCK_FILE}")
+        )
+        assert committed["grafana"]["tempo"] == _entry("tempo", "2.0.0")
+        files = _git_output("show", "--name-status", "--format=", "HEAD").splitlines()
+        assert files == [
+            f"M\t{charts_lock.LOCK_FILE}",
+            "D\tcharts/grafana/tempo/default.nix",
+        ]
+        assert _git_output("status", "--porcelain", "--untracked-files=no") == ""
+
+
+class TestLockCommand:
+    def test_lock_moves_chart_files(self, lock_file, repo):
+        _write_chart_file(repo, "grafana", "tempo")
+        _git("add", "charts")
+
+        result = CliRunner().invoke(cli.app, ["lock"])
+
+        assert result.exit_code == 0, result.output
+        assert charts_lock.parse(lock_file.read_text()) == {
+            "grafana": {"loki": _entry("loki"), "tempo": _entry("tempo")}
+        }
+        assert not (repo / "charts" / "grafana").exists()
+        status = _git_output("status", "--porcelain", "--untracked-files=no")
+        assert status == f"A  {charts_lock.LOCK_FILE}\n"
+        result = CliRunner().invoke(cli.app, ["lock", "--check"])
+        assert result.exit_code == 0, result.output
+
+    def test_check_fails_on_chart_file(self, lock_file, repo):
+        _write_chart_file(repo, "grafana", "tempo")
+
+        result = CliRunner().invoke(cli.app, ["lock", "--check"])
+
+        assert result.exit_code == 1
+        assert "out of date" in result.output
+
+    def test_untracked_lock_rejected(self, repo):
+        (repo / charts_lock.LOCK_FILE).write_text(charts_lock.render({}))
+
+        result = CliRunner().invoke(cli.app, ["lock", "--check"])
+
+        assert result.exit_code == 1
+        assert "isn't tracked by git" in result.output
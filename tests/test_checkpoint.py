@@ -0,0 +1,152 @@
+import json
+import os
+import signal
+import subprocess
+import time
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+from helmupdater import chart, checkpoint, cli, history, schedule
+from helmupdater.checkpoint import ChartOutcome, Checkpoint
+
+
+class TestCheckpoint:
+    def test_empty(self, tmp_path):
+        checkpoint = Checkpoint(tmp_path / "checkpoint.json")
+
+        assert checkpoint.get("local", "nginx") is None
+        assert not checkpoint.path.exists()
+
+    def test_record(self, tmp_path):
+        path = tmp_path / "checkpoint.json"
+        checkpoint = Checkpoint(path)
+
+        outcome = ChartOutcome(
+            status="done",
+            version="1.0.1",
+            chartHash="sha256-2Wu51wd842yLn8ZRO9NunjzJhIqGkqEsU4qHzKKXjFY=",
+        )
+        checkpoint.record("local", "nginx", outcome)
+        checkpoint.record(
+            "local", "podinfo", ChartOutcome(status="failed", error="timed out")
+        )
+        checkpoint.save()
+
+        assert json.loads(path.read_text()) == {
+            "local/nginx": {
+                "status": "done",
+                "version": "1.0.1",
+                "chartHash": "sha256-2Wu51wd842yLn8ZRO9NunjzJhIqGkqEsU4qHzKKXjFY=",
+            },
+            "local/podinfo": {"status": "failed", "error": "timed out"},
+        }
+
+    def test_resume(self, tmp_path):
+        path = tmp_path / "checkpoint.json"
+        with Checkpoint(path).saved() as progress:
+            progress.record("local", "nginx", ChartOutcome(status="skipped"))
+
+        resumed = Checkpoint(path)
+
+        assert resumed.get("local", "nginx") == ChartOutcome(status="skipped")
+        assert resumed.get("local", "podinfo") is None
+
+    def test_saved_in_batches(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(checkpoint, "SAVE_INTERVAL", 3)
+        path = tmp_path / "checkpoint.json"
+        progress = Checkpoint(path)
+
+        for name in ("a", "b"):
+            progress.record("local", name, ChartOutcome(status="skipped"))
+        assert not path.exists()
+
+        progress.record("local", "c", ChartOutcome(status="skipped"))
+        assert set(json.loads(path.read_text())) == {"local/a", "local/b", "local/c"}
+
+    def test_saved_on_sigterm(self, tmp_path):
+        path = tmp_path / "checkpoint.json"
+
+        with pytest.raises(SystemExit), Checkpoint(path).saved() as progress:
+            progress.record("local", "nginx", ChartOutcome(status="skipped"))
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        assert Checkpoint(path).get("local", "nginx") == ChartOutcome(status="skipped")
+        assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
+
+
+def _chart_info(chart_name: str) -> chart.ChartMetadata:
+    return chart.ChartMetadata(
+        repo="https://example.com/charts",
+        chart=chart_name,
+        version="1.0.0",
+        chartHash=chart.PLACEHOLDER_HASH,
+    )
+
+
+class TestUpdateAll:
+    CHARTS = {"local": {name: _chart_info(name) for name in ("a", "b", "c")}}
+
+    @pytest.fixture(autouse=True)
+    @staticmethod
+    def charts(tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        # The schedule is derived from the git history
+        git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.org"]
+        subprocess.run([*git, "init", "-q"], check=True)
+        subprocess.run(
+            [*git, "commit", "-q", "--allow-empty", "-m", "init"], check=True
+        )
+        with patch("helmupdater.cli.nix.get_charts", return_value=TestUpdateAll.CHARTS):
+            yield
+
+    @staticmethod
+    def update_all(*args: str) -> list[str]:
+        """Run update-all, returning the charts it checked."""
+        checked = []
+
+        def update(repo_name, chart_name, chart_info):
+            checked.append(chart_name)
+            time.sleep(0.3)
+            return chart_info
+
+        with patch("helmupdater.cli.chart.update", side_effect=update):
+            result = CliRunner().invoke(cli.app, ["update-all", *args])
+        assert result.exit_code == 0, result.output
+        return checked
+
+    def test_resume_after_time_budget(self, tmp_path):
+        path = tmp_path / "checkpoint.json"
+
+        first = self.update_all(
+            "--all", "--time-budget", "0.15", "--checkpoint", str(path)
+        )
+
+        assert len(first) == 1
+        assert Checkpoint(path).get("local", first[0]).status == "done"
+
+        second = self.update_all("--all", "--checkpoint", str(path))
+
+        assert sorted(first + second) == ["a", "b", "c"]
+        assert len(Checkpoint(path).outcomes) == 3
+
+    def test_skipped_charts_recorded(self):
+        failures = schedule.NegativeCache()
+        failures.record_failure("local", "b", "boom", missing=True)
+        failures.save()
+
+        checked = self.update_all()
+
+        rows = history.connect().execute("SELECT chart, outcome, error FROM charts")
+        outcomes = {row["chart"]: (row["outcome"], row["error"]) for row in rows}
+        assert "b" not in checked
+        assert outcomes["local/b"][0] == "skipped"
+        assert outcomes["local/b"][1].endswith("boom")
+        assert len(outcomes) == 3
+
+    def test_resume_finished_run(self, tmp_path):
+        path = tmp_path / "checkpoint.json"
+        self.update_all("--all", "--checkpoint", str(path))
+
+        assert self.update_all("--all", "--checkpoint", str(path)) == []
@@ -0,0 +1,34 @@
+from helmupdater import eval_cache, utils
+
+
+def test_get_missing():
+    assert eval_cache.get("chartsMetadata", "key") is None
+
+
+def test_put_and_get():
+    eval_cache.put("chartsMetadata", "key", {"local": {}})
+
+    assert eval_cache.get("chartsMetadata", "key") == {"local": {}}
+    assert eval_cache.get("chartsMetadata", "other") is None
+
+
+def test_no_key():
+    eval_cache.put("chartsMetadata", None, {"local": {}})
+
+    assert eval_cache.get("chartsMetadata", None) is None
+
+
+def test_invalidate_keeps_other_entries():
+    eval_cache.put("chartsMetadata", "key", {"local": {}})
+    eval_cache.put("currentSystem", "Linux/x86_64", "x86_64-linux")
+
+    eval_cache.invalidate("chartsMetadata")
+
+    assert eval_cache.get("chartsMetadata", "key") is None
+    assert eval_cache.get("currentSystem", "Linux/x86_64") == "x86_64-linux"
+
+
+def test_corrupt_file():
+    (utils.cache_dir() / "eval.json").write_text("{")
+
+    assert eval_cache.get("chartsMetadata", "key") is None
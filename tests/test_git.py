@@ -1,5 +1,7 @@
+import subprocess
 from pathlib import Path
-from unittest.mock import patch
+from subprocess import CalledProcessError, CompletedProcess
+from unittest.mock import ANY, patch
 
 import pytest
 
@@ -32,6 +34,55 @@ class TestCommit:
             "git", "commit", "-m", "local/nginx: update to 1.0.1"
         )
 
+    @patch("helmupdater.git.run_cmd")
+    def test_commit_only_paths(self, mock_run_cmd):
+        git.commit("local/nginx: update to 1.0.1", "charts/local/nginx/default.nix")
+
+        mock_run_cmd.assert_called_once_with(
+            "git",
+            "commit",
+            "-m",
+            "local/nginx: update to 1.0.1",
+            "--",
+            "charts/local/nginx/default.nix",
+        )
+
+    @patch("helmupdater.git.time.sleep")
+    @patch("helmupdater.git.run_cmd")
+    def test_commit_retries_on_index_lock(self, mock_run_cmd, mock_sleep):
+        locked = CalledProcessError(
+            128, "git", stderr="fatal: Unable to create '.git/index.lock': File exists."
+        )
+        mock_run_cmd.side_effect = [locked, locked, None]
+
+        git.commit("local/nginx: update to 1.0.1")
+
+        assert mock_run_cmd.call_count == 3
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [0.1, 0.2]
+
+    @patch("helmupdater.git.time.sleep")
+    @patch("helmupdater.git.run_cmd")
+    def test_commit_gives_up_on_index_lock(self, mock_run_cmd, mock_sleep):
+        mock_run_cmd.side_effect = CalledProcessError(
+            128, "git", stderr="fatal: Unable to create '.git/index.lock': File exists."
+        )
+
+        with pytest.raises(CalledProcessError):
+            git.commit("local/nginx: update to 1.0.1")
+
+        assert mock_run_cmd.call_count == git.INDEX_LOCK_RETRIES + 1
+
+    @patch("helmupdater.git.time.sleep")
+    @patch("helmupdater.git.run_cmd")
+    def test_commit_other_error_not_retried(self, mock_run_cmd, mock_sleep):
+        mock_run_cmd.side_effect = CalledProcessError(1, "git", stderr="nothing added")
+
+        with pytest.raises(CalledProcessError):
+            git.commit("local/nginx: update to 1.0.1")
+
+        mock_run_cmd.assert_called_once()
+        mock_sleep.assert_not_called()
+
 
 class TestAddAndCommit:
     @patch("helmupdater.git.has_changes", return_value=True)
@@ -42,7 +93,9 @@ class TestAddAndCommit:
 
         mock_has_changes.assert_called_once_with("charts/local/nginx/default.nix")
         mock_add_file.assert_called_once_with("charts/local/nginx/default.nix")
-        mock_commit.assert_called_once_with("Update nginx")
+        mock_commit.assert_called_once_with(
+            "Update nginx", "charts/local/nginx/default.nix"
+        )
 
     @patch("helmupdater.git.has_changes", return_value=False)
     @patch("helmupdater.git.commit")
@@ -113,3 +166,362 @@ class TestStagedFile:
 
         mock_add_file.assert_called_once()
         mock_reset.assert_called_once_with(test_path)
+
+
+class TestStagedFiles:
+    @patch("helmupdater.git.run_cmd")
+    def test_staged_files(self, mock_run_cmd):
+        paths = ["charts/local/nginx/default.nix", Path("charts/local/podinfo")]
+
+        with git.staged_files(paths) as staged:
+            assert staged == paths
+            mock_run_cmd.assert_called_once_with(
+                "git", "add", "charts/local/nginx/default.nix", "charts/local/podinfo"
+            )
+
+        mock_run_cmd.assert_called_with(
+            "git", "reset", "charts/local/nginx/default.nix", "charts/local/podinfo"
+        )
+
+    @patch("helmupdater.git.run_cmd")
+    def test_staged_files_empty(self, mock_run_cmd):
+        with git.staged_files([]):
+            pass
+
+        mock_run_cmd.assert_not_called()
+
+
+class TestChangedFiles:
+    @patch("helmupdater.git.run_cmd")
+    def test_changed_files(self, mock_run_cmd):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[],
+            returncode=0,
+            stdout="charts/local/nginx/default.nix\0charts/local/podinfo/default.nix\0",
+            stderr="",
+        )
+
+        result = git.changed_files("origin/master")
+
+        assert result == [
+            "charts/local/nginx/default.nix",
+            "charts/local/podinfo/default.nix",
+        ]
+        mock_run_cmd.assert_called_once_with(
+            "git",
+            "diff",
+            "--name-only",
+            "-z",
+            "--no-renames",
+            "--diff-filter=d",
+            "origin/master",
+            "--",
+            "charts/",
+        )
+
+    @patch("helmupdater.git.run_cmd")
+    def test_changed_files_none(self, mock_run_cmd):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="", stderr=""
+        )
+
+        assert git.changed_files("HEAD~1") == []
+
+
+class TestContentKey:
+    @pytest.fixture
+    def repo(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        chart_path = tmp_path / "charts" / "local" / "nginx" / "default.nix"
+        chart_path.parent.mkdir(parents=True)
+        chart_path.write_text("{}")
+        (tmp_path / "flake.lock").write_text("{}")
+        run = ["git", "-c", "user.name=test", "-c", "user.email=test@example.org"]
+        subprocess.run([*run, "init", "-q"], check=True)
+        subprocess.run([*run, "add", "."], check=True)
+        subprocess.run([*run, "commit", "-q", "-m", "init"], check=True)
+        return chart_path
+
+    def test_stable_for_same_content(self, repo):
+        assert git.content_key("charts", "flake.lock") == git.content_key(
+            "charts", "flake.lock"
+        )
+
+    def test_changes_with_unstaged_edit(self, repo):
+        key = git.content_key("charts", "flake.lock")
+
+        repo.write_text('{ version = "1.0.1"; }')
+
+        assert git.content_key("charts", "flake.lock") != key
+
+    def test_ignores_untracked_files(self, repo, tmp_path):
+        key = git.content_key("charts", "flake.lock")
+
+        (tmp_path / "charts" / "local" / "untracked.nix").write_text("{}")
+
+        assert git.content_key("charts", "flake.lock") == key
+
+    def test_missing_path(self, repo):
+        assert git.content_key("charts", "missing") is None
+
+
+class TestFileHistory:
+    @pytest.fixture
+    def commit(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        subprocess.run(["git", "init", "-q"], check=True)
+
+        def commit(path: str, content: str | None) -> str:
+            file_path = tmp_path / path
+            if content is None:
+                file_path.unlink()
+            else:
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                file_path.write_text(content)
+            run = ["git", "-c", "user.name=test", "-c", "user.email=test@example.org"]
+            subprocess.run([*run, "add", "-A"], check=True)
+            subprocess.run([*run, "commit", "-q", "-m", path], check=True)
+            return git.head_commit()
+
+        return commit
+
+    def test_head_commit_outside_repository(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        assert git.head_commit() is None
+
+    def test_file_history(self, commit):
+        commit("charts/a/nginx/default.nix", '{\n  version = "1";\n}\n')
+        first = commit("charts/a/podinfo/default.nix", "{ }\n")
+        commit("charts/a/nginx/default.nix", '{\n  version = "2";\n}\n')
+        commit("README.md", "readme\n")
+        commit("charts/a/podinfo/default.nix", None)
+
+        pathspec = ":(glob)charts/*/*/default.nix"
+        assert git.file_history(pathspec) == [
+            '{\n  version = "1";\n}\n',
+            "{ }\n",
+            '{\n  version = "2";\n}\n',
+        ]
+        assert git.file_history(pathspec, since=first) == ['{\n  version = "2";\n}\n']
+
+    def test_unknown_since(self, commit):
+        commit("charts/a/nginx/default.nix", "{ }\n")
+
+        with pytest.raises(CalledProcessError):
+            git.file_history("charts", since="0" * 40)
+
+
+class TestStatusSnapshot:
+    STATUS_OUTPUT = (
+        "1 .M N... 100644 100644 100644 587be 587be charts/local/nginx/default.nix\0"
+        "2 R. N... 100644 100644 100644 975fb 975fb R100 charts/local/new name.nix\0"
+        "charts/local/old name.nix\0"
+        "? charts/remote/dummy/default.nix\0"
+    )
+
+    @pytest.fixture
+    def snapshot(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        chart_dir = tmp_path / "charts" / "local" / "podinfo"
+        chart_dir.mkdir(parents=True)
+        (chart_dir / "default.nix").write_text("original")
+
+        with patch("helmupdater.git.run_cmd") as mock_run_cmd:
+            mock_run_cmd.return_value = CompletedProcess(
+                args=[], returncode=0, stdout=self.STATUS_OUTPUT, stderr=""
+            )
+            snapshot = git.StatusSnapshot()
+
+        mock_run_cmd.assert_called_once_with(
+            "git",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=all",
+            "--",
+            "charts/",
+        )
+        return snapshot
+
+    def test_parse(self, snapshot):
+        assert snapshot.changed == {
+            "charts/local/nginx/default.nix",
+            "charts/local/new name.nix",
+            "charts/local/old name.nix",
+            "charts/remote/dummy/default.nix",
+        }
+
+    def test_has_changes(self, snapshot, tmp_path):
+        assert snapshot.has_changes("charts/local/nginx/default.nix")
+        assert snapshot.has_changes(tmp_path / "charts/remote/dummy/default.nix")
+        assert not snapshot.has_changes("charts/local/podinfo/default.nix")
+
+    def test_record_write(self, snapshot):
+        chart_path = Path("charts/local/podinfo/default.nix")
+
+        snapshot.record_write(chart_path, "placeholder")
+        chart_path.write_text("placeholder")
+        assert snapshot.has_changes(chart_path)
+
+        snapshot.record_write(chart_path, "original")
+        chart_path.write_text("original")
+        assert not snapshot.has_changes(chart_path)
+
+    def test_record_write_new_file(self, snapshot):
+        chart_path = Path("charts/local/redis/default.nix")
+
+        snapshot.record_write(chart_path, "new")
+        assert snapshot.has_changes(chart_path)
+
+    @patch("helmupdater.git.run_cmd")
+    def test_record_write_dirty_file_falls_back(self, mock_run_cmd, snapshot):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout="", stderr=""
+        )
+
+        snapshot.record_write("charts/local/nginx/default.nix", "content")
+
+        assert not snapshot.has_changes("charts/local/nginx/default.nix")
+        mock_run_cmd.assert_called_once_with(
+            "git", "status", "--porcelain", "charts/local/nginx/default.nix"
+        )
+
+    def test_record_commit(self, snapshot):
+        chart_path = Path("charts/local/podinfo/default.nix")
+        snapshot.record_write(chart_path, "updated")
+        chart_path.write_text("updated")
+
+        snapshot.record_commit(chart_path)
+
+        assert not snapshot.has_changes(chart_path)
+
+    @patch("helmupdater.git.run_cmd")
+    def test_outside_pathspec_falls_back(self, mock_run_cmd, snapshot):
+        mock_run_cmd.return_value = CompletedProcess(
+            args=[], returncode=0, stdout=" M flake.lock\n", stderr=""
+        )
+
+        assert snapshot.has_changes("flake.lock")
+        mock_run_cmd.assert_called_once_with(
+            "git", "status", "--porcelain", "flake.lock"
+        )
+
+
+class TestHasChanges:
+    @patch("helmupdater.git._snapshot", None)
+    @patch("helmupdater.git.StatusSnapshot")
+    def test_snapshot_taken_once(self, mock_snapshot_cls):
+        mock_snapshot_cls.return_value.has_changes.return_value = True
+
+        assert git.has_changes("charts/local/nginx/default.nix")
+        assert git.has_changes("charts/local/podinfo/default.nix")
+
+        mock_snapshot_cls.assert_called_once_with()
+
+    @patch("helmupdater.git._snapshot", None)
+    def test_track_write_without_snapshot(self, tmp_path):
+        git.track_write(tmp_path / "default.nix", "content")
+
+        assert git._snapshot is None
+
+
+class TestCommitContents:
+    @pytest.fixture
+    def repo(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        for variable in ("GIT_AUTHOR", "GIT_COMMITTER"):
+            monkeypatch.setenv(f"{variable}_NAME", "test")
+            monkeypatch.setenv(f"{variable}_EMAIL", "test@example.org")
+        subprocess.run(["git", "init", "-q"], check=True)
+        return tmp_path
+
+    def test_commit_contents(self, repo):
+        (repo / "b.txt").write_text("staged\n")
+        subprocess.run(["git", "add", "b.txt"], check=True)
+
+        assert git.commit_contents("first", {"a.txt": "a\n"})
+        assert not git.commit_contents("again", {"a.txt": "a\n"})
+
+        assert git.show_file("a.txt") == "a\n"
+        assert git.show_file("b.txt") is None
+        assert git.log_subjects(".") == [(ANY, "first")]
+
+    def test_commit_removed_file(self, repo):
+        (repo / "b.txt").write_text("b\n")
+        git.commit_contents("first", {"a.txt": "a\n", "b.txt": "b\n"})
+        (repo / "b.txt").unlink()
+
+        assert git.commit_contents("second", {"a.txt": "a\n", "b.txt": None})
+        assert not git.commit_contents("again", {"b.txt": None})
+
+        assert git.show_file("a.txt") == "a\n"
+        assert git.show_file("b.txt") is None
+        assert not git.is_tracked("b.txt")
+
+    def _hook(self, repo, name, script):
+        hook = repo / ".git" / "hooks" / name
+        hook.write_text(f"#!/bin/sh\n{script}\n")
+        hook.chmod(0o755)
+
+    def test_runs_hooks(self, repo):
+        self._hook(repo, "pre-commit", "git diff --cached --name-only > staged")
+        self._hook(repo, "commit-msg", 'echo "Signed-off-by: test" >> "$1"')
+        self._hook(repo, "post-commit", "touch committed")
+        (repo / "b.txt").write_text("staged\n")
+        subprocess.run(["git", "add", "b.txt"], check=True)
+
+        git.commit_contents("first", {"a.txt": "a\n"})
+
+        # The hook saw the commit's index, not the staged b.txt
+        assert (repo / "staged").read_text() == "a.txt\n"
+        message = subprocess.run(
+            ["git", "log", "-1", "--format=%B"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        assert message == "first\nSigned-off-by: test\n\n"
+        assert (repo / "committed").exists()
+
+    def test_failing_hook_aborts(self, repo):
+        self._hook(repo, "pre-commit", "exit 1")
+
+        with pytest.raises(CalledProcessError):
+            git.commit_contents("first", {"a.txt": "a\n"})
+
+        assert git.head_commit() is None
+
+    def test_signs_if_configured(self, repo):
+        subprocess.run(["git", "config", "commit.gpgSign", "true"], check=True)
+        subprocess.run(["git", "config", "gpg.program", "false"], check=True)
+
+        # Signing is attempted, and fails with this gpg
+        with pytest.raises(CalledProcessError, match="commit-tree"):
+            git.commit_contents("first", {"a.txt": "a\n"})
+
+    def test_head_moved_while_committing(self, repo):
+        git.commit_contents("first", {"a.txt": "a\n"})
+        commit_tree = git._commit_tree
+
+        def other_commit_first(*args):
+            # Another process commits between reading HEAD and moving it
+            if git.show_file("b.txt") is None:
+                (repo / "b.txt").write_text("b\n")
+                subprocess.run(["git", "add", "b.txt"], check=True)
+                subprocess.run(["git", "commit", "-q", "-m", "other"], check=True)
+            return commit_tree(*args)
+
+        with (
+            patch("helmupdater.git._commit_tree", side_effect=other_commit_first),
+            patch("helmupdater.git.time.sleep"),
+        ):
+            assert git.commit_contents("second", {"a.txt": "a2\n"})
+
+        assert git.show_file("a.txt") == "a2\n"
+        assert git.show_file("b.txt") == "b\n"
+        assert [subject for _, subject in git.log_subjects(".")] == [
+            "first",
+            "other",
+            "second",
+        ]
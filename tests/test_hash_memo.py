@@ -0,0 +1,51 @@
+from helmupdater import hash_memo
+from helmupdater.chart.chart_metadata import ChartMetadata
+
+REPO = "https://example.com/charts"
+
+
+def _chart(version: str, chart_hash: str) -> ChartMetadata:
+    return ChartMetadata(
+        repo=REPO, chart="nginx", version=version, chartHash=chart_hash
+    )
+
+
+class TestHashMemo:
+    def test_empty(self):
+        assert (
+            hash_memo.lookup(REPO, "nginx", "1.0.0", "sha256:a", history=True) is None
+        )
+        assert hash_memo.seeded_commit() is None
+
+    def test_lookup_by_digest(self):
+        hash_memo.record(REPO, "nginx", "1.0.0", "sha256:a", "sha256-A")
+
+        assert hash_memo.lookup(REPO, "nginx", "1.0.0", "sha256:a") == "sha256-A"
+        # The same archive published elsewhere
+        assert hash_memo.lookup("oci://ghcr.io/x", "nginx", "1.0.0", "sha256:a") == (
+            "sha256-A"
+        )
+        assert hash_memo.lookup(REPO, "nginx", "1.0.0", "sha256:b") is None
+
+    def test_history(self):
+        hash_memo.seed(
+            "abc", [_chart("1.0.0", "sha256-old"), _chart("1.0.0", "sha256-A")]
+        )
+
+        assert hash_memo.seeded_commit() == "abc"
+        assert hash_memo.lookup(REPO, "nginx", "1.0.0", "sha256:a") is None
+        assert (
+            hash_memo.lookup(REPO + "/", "nginx", "1.0.0", "sha256:a", history=True)
+            == "sha256-A"
+        )
+
+    def test_republished_archive_not_matched(self):
+        hash_memo.record(REPO, "nginx", "1.0.0", "sha256:a", "sha256-A")
+        hash_memo.seed("abc", [_chart("1.0.0", "sha256-A")])
+
+        assert (
+            hash_memo.lookup(REPO, "nginx", "1.0.0", "sha256:b", history=True) is None
+        )
+        assert hash_memo.lookup(REPO, "nginx", "1.0.0", None, history=True) == (
+            "sha256-A"
+        )
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+from helmupdater import history
+
+
+@pytest.fixture
+def run():
+    run = history.RunHistory("update-all")
+    yield run
+    run.close()
+
+
+class TestRunHistory:
+    def test_records_chart(self, run):
+        with run.chart(
+            "local", "nginx", "https://example.com/charts", "1.0.0"
+        ) as record:
+            history.add("registry_requests", 1)
+            history.add("registry_bytes", 1024)
+            with history.timed("hash_seconds"):
+                pass
+            record.outcome = "updated"
+            record.new_version = "1.0.1"
+
+        [row] = history.connect().execute("SELECT * FROM charts").fetchall()
+        assert row["run_id"] == run.run_id
+        assert row["chart"] == "local/nginx"
+        assert row["host"] == "example.com"
+        assert row["outcome"] == "updated"
+        assert (row["old_version"], row["new_version"]) == ("1.0.0", "1.0.1")
+        assert row["registry_requests"] == 1
+        assert row["registry_bytes"] == 1024
+        assert row["hash_seconds"] >= 0
+
+    def test_failed_by_default(self, run):
+        with (
+            pytest.raises(RuntimeError),
+            run.chart("local", "nginx", "https://example.com", "1.0.0"),
+        ):
+            raise RuntimeError("boom")
+
+        [row] = history.connect().execute("SELECT outcome FROM charts").fetchall()
+        assert row["outcome"] == "failed"
+
+    @pytest.mark.parametrize(
+        ("version", "outcome"), [("1.0.1", "updated"), ("1.0.0", "unchanged")]
+    )
+    def test_resolve(self, run, version, outcome):
+        with run.chart("local", "nginx", "https://example.com", "1.0.0") as record:
+            record.resolve(version)
+
+        [row] = history.connect().execute("SELECT * FROM charts").fetchall()
+        assert (row["outcome"], row["new_version"]) == (outcome, version)
+
+    def test_skip(self, run):
+        run.skip(
+            [
+                ("local", "nginx", "https://example.com", "1.0.0"),
+                ("local", "podinfo", "https://example.com", "2.0.0"),
+            ],
+            "not due for a check",
+        )
+
+        rows = history.connect().execute(
+            "SELECT chart, outcome, old_version, error FROM charts ORDER BY chart"
+        )
+        assert [tuple(row) for row in rows] == [
+            ("local/nginx", "skipped", "1.0.0", "not due for a check"),
+            ("local/podinfo", "skipped", "2.0.0", "not due for a check"),
+        ]
+
+    def test_metrics_outside_of_chart_ignored(self, run):
+        history.add("registry_requests", 1)
+
+        assert history.connect().execute("SELECT * FROM charts").fetchall() == []
+
+
+class TestQueries:
+    @pytest.fixture
+    @staticmethod
+    def connection(run):
+        for chart, host, seconds, outcome in [
+            ("a/nginx", "a.example.com", 1.0, "unchanged"),
+            ("a/nginx", "a.example.com", 3.0, "failed"),
+            ("b/redis", "b.example.com", 0.5, "updated"),
+        ]:
+            repo_name, chart_name = chart.split("/")
+            with run.chart(repo_name, chart_name, f"https://{host}", "1.0.0") as record:
+                history.add("registry_requests", 2)
+                history.add("registry_seconds", seconds)
+                history.add("hash_seconds", seconds * 10)
+                record.outcome = outcome
+        connection = history.connect()
+        yield connection
+        connection.close()
+
+    def test_host_latency(self, connection):
+        latency = history.host_latency(connection, 0, time.time() + 1)
+
+        assert latency == {"a.example.com": [0.5, 1.5], "b.example.com": [0.25]}
+        assert history.host_latency(connection, 0, 1) == {}
+
+    def test_top_charts(self, connection):
+        top = history.top_charts(connection, 0, limit=1)
+
+        assert top["nix"] == [{"chart": "a/nginx", "total": 40.0, "checks": 2}]
+        assert top["failures"] == [{"chart": "a/nginx", "total": 1, "checks": 2}]
+
+    def test_outcomes(self, connection):
+        assert history.outcomes(connection, 0) == {
+            "unchanged": 1,
+            "failed": 1,
+            "updated": 1,
+        }
+
+    def test_percentile(self):
+        assert history.percentile([1.0], 95) == 1.0
+        assert history.percentile([1.0, 2.0, 3.0], 50) == 2.0
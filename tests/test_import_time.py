@@ -0,0 +1,56 @@
+"""
+Import-time regression tests.
+
+Commands that don't talk to a registry (`--help`, `build`, ...) must not pay for
+importing the registry stack. See also `benchmarks/import_time.py`.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import helmupdater
+
+HEAVY_MODULES = ["chevron", "oras", "pydantic", "requests", "yaml"]
+
+
+def _imported_modules(statement: str) -> set[str]:
+    env = dict(os.environ, PYTHONPATH=str(Path(helmupdater.__file__).parents[1]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    # Lines look like: "import time:       192 |      56526 |         oras.client"
+    return {
+        line.rpartition("|")[2].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "import helmupdater.cli",
+        "from helmupdater import chart, git, nix, registry",
+    ],
+)
+def test_no_heavy_imports(statement):
+    modules = _imported_modules(statement)
+
+    assert modules.isdisjoint(HEAVY_MODULES)
+
+
+def test_registry_imported_on_use():
+    modules = _imported_modules(
+        "from helmupdater import registry; registry.create('http://localhost', 'l')"
+    )
+
+    assert "requests" in modules
+    assert "oras" not in modules
@@ -0,0 +1,62 @@
+import multiprocessing
+import time
+
+import pytest
+
+from helmupdater import locks
+
+
+def test_lock_dir_per_checkout(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = locks.lock_dir()
+    (tmp_path / "other").mkdir()
+    monkeypatch.chdir(tmp_path / "other")
+
+    assert locks.lock_dir() != first
+    assert first.is_dir()
+
+
+def test_chart_lock_non_blocking():
+    with locks.chart_lock("local", "nginx"):
+        with pytest.raises(locks.LockedError):
+            with locks.chart_lock("local", "nginx", blocking=False):
+                pass
+
+        # other charts are not affected
+        with locks.chart_lock("local", "podinfo", blocking=False):
+            pass
+
+    with locks.chart_lock("local", "nginx", blocking=False):
+        pass
+
+
+def test_chart_lock_names_unambiguous():
+    with locks.chart_lock("a-b", "c"):
+        with locks.chart_lock("a", "b-c", blocking=False):
+            pass
+
+
+def _hold_lock(path, acquired, release):
+    with locks.file_lock(path):
+        acquired.set()
+        release.wait(5)
+
+
+def test_file_lock_between_processes(tmp_path):
+    path = tmp_path / "chart.lock"
+    context = multiprocessing.get_context("spawn")
+    acquired, release = context.Event(), context.Event()
+    process = context.Process(target=_hold_lock, args=(path, acquired, release))
+    process.start()
+    try:
+        assert acquired.wait(10)
+        with pytest.raises(locks.LockedError):
+            with locks.file_lock(path, blocking=False):
+                pass
+    finally:
+        release.set()
+        process.join(10)
+
+    started = time.monotonic()
+    with locks.file_lock(path):
+        assert time.monotonic() - started < 5
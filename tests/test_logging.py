@@ -0,0 +1,102 @@
+import io
+import json
+
+import pytest
+
+from helmupdater import history, profiling
+from helmupdater.logging import (
+    LogFormat,
+    configure_logging,
+    event,
+    events_enabled,
+    get_logger,
+    stop_logging,
+)
+
+
+@pytest.fixture
+def json_lines():
+    stream = io.StringIO()
+    configure_logging(log_format=LogFormat.JSON, stream=stream)
+
+    def read() -> list[dict]:
+        stop_logging()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield read
+    configure_logging()
+
+
+class TestJsonFormat:
+    def test_log_lines(self, json_lines):
+        get_logger().info("local/nginx: checking for updates", attempt=1)
+
+        [line] = json_lines()
+        assert line["event"] == "local/nginx: checking for updates"
+        assert line["level"] == "info"
+        assert line["attempt"] == 1
+        assert "timestamp" in line
+
+    def test_level_filtered(self, json_lines):
+        get_logger().debug("hidden")
+
+        assert json_lines() == []
+
+    def test_events(self, json_lines):
+        assert events_enabled()
+        event("run.finished", command="update-all", updated=2)
+
+        [line] = json_lines()
+        assert line["event"] == "run.finished"
+        assert line["updated"] == 2
+
+    def test_phase_events(self, json_lines):
+        with profiling.phase("registry", "local/nginx"):
+            pass
+        with pytest.raises(RuntimeError), profiling.phase("git"):
+            raise RuntimeError("boom")
+
+        registry, git = json_lines()
+        assert registry["event"] == "phase.finished"
+        assert (registry["repo"], registry["chart"]) == ("local", "nginx")
+        assert registry["phase"] == "registry"
+        assert registry["seconds"] >= 0
+        assert registry["error"] is None
+        assert (git["repo"], git["phase"], git["error"]) == (None, "git", "boom")
+
+    def test_chart_events(self, json_lines):
+        run = history.RunHistory("update")
+        with run.chart("local", "nginx", "https://example.com", "1.0.0") as record:
+            history.add("registry_requests", 1)
+            record.outcome = "updated"
+            record.new_version = "1.0.1"
+        run.close()
+
+        started, finished = json_lines()
+        assert started == {
+            **started,
+            "event": "chart.started",
+            "repo": "local",
+            "chart": "nginx",
+            "version": "1.0.0",
+        }
+        assert finished["event"] == "chart.finished"
+        assert (finished["repo"], finished["chart"]) == ("local", "nginx")
+        assert finished["outcome"] == "updated"
+        assert (finished["old_version"], finished["new_version"]) == (
+            "1.0.0",
+            "1.0.1",
+        )
+        assert finished["registry_requests"] == 1
+        assert finished["host"] == "example.com"
+
+
+class TestConsoleFormat:
+    def test_no_events(self, capsys):
+        configure_logging()
+
+        assert not events_enabled()
+        event("run.finished", command="update-all")
+        assert profiling.phase("git") is profiling.phase("metadata")
+
+        assert capsys.readouterr().out == ""
@@ -0,0 +1,118 @@
+import pytest
+
+from helmupdater import metrics
+from helmupdater.utils import run_cmd
+
+
+@pytest.fixture
+def collector(tmp_path):
+    metrics.start(tmp_path / "helmupdater.prom")
+    yield metrics.collector
+    metrics.collector = None
+
+
+def _series(text: str) -> dict[str, str]:
+    return dict(
+        line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#")
+    )
+
+
+class TestCollector:
+    def test_counter(self, collector):
+        metrics.inc("charts", result="checked")
+        metrics.inc("charts", 2, result="checked")
+        metrics.inc("charts", result="failed")
+
+        text = collector.render()
+
+        assert "# HELP helmupdater_charts " in text
+        assert "# TYPE helmupdater_charts gauge" in text
+        series = _series(text)
+        assert series['helmupdater_charts{result="checked"}'] == "3"
+        assert series['helmupdater_charts{result="failed"}'] == "1"
+
+    def test_histogram(self, collector):
+        metrics.observe("registry_request_duration_seconds", 0.02, host="a")
+        metrics.observe("registry_request_duration_seconds", 0.3, host="a")
+        metrics.observe("registry_request_duration_seconds", 1000, host="a")
+
+        series = _series(collector.render())
+
+        name = "helmupdater_registry_request_duration_seconds"
+        assert series[f'{name}_bucket{{host="a",le="0.01"}}'] == "0"
+        assert series[f'{name}_bucket{{host="a",le="0.025"}}'] == "1"
+        assert series[f'{name}_bucket{{host="a",le="0.5"}}'] == "2"
+        assert series[f'{name}_bucket{{host="a",le="300"}}'] == "2"
+        assert series[f'{name}_bucket{{host="a",le="+Inf"}}'] == "3"
+        assert series[f'{name}_count{{host="a"}}'] == "3"
+        assert float(series[f'{name}_sum{{host="a"}}']) == pytest.approx(1000.32)
+
+    def test_bucket_bound_inclusive(self, collector):
+        metrics.observe("phase_duration_seconds", 0.1, phase="git")
+
+        series = _series(collector.render())
+
+        name = "helmupdater_phase_duration_seconds_bucket"
+        assert series[f'{name}{{phase="git",le="0.05"}}'] == "0"
+        assert series[f'{name}{{phase="git",le="0.1"}}'] == "1"
+
+    def test_run_metrics(self, collector):
+        series = _series(collector.render())
+
+        assert float(series["helmupdater_run_duration_seconds"]) >= 0
+        assert float(series["helmupdater_last_run_timestamp_seconds"]) > 0
+
+    def test_metrics_without_values_left_out(self, collector):
+        assert "registry_errors_total" not in collector.render()
+
+    def test_label_escaped(self, collector):
+        metrics.inc("registry_errors_total", host='a"b\\c\nd')
+
+        assert 'host="a\\"b\\\\c\\nd"' in collector.render()
+
+    def test_unknown_metric(self, collector):
+        with pytest.raises(ValueError, match="unknown metric"):
+            metrics.inc("charts_total")
+
+    def test_timer(self, collector):
+        with metrics.timer("phase_duration_seconds", phase="hashing"):
+            pass
+
+        series = _series(collector.render())
+        assert series['helmupdater_phase_duration_seconds_count{phase="hashing"}'] == (
+            "1"
+        )
+
+
+class TestModule:
+    def test_disabled_by_default(self):
+        assert metrics.collector is None
+        metrics.inc("charts", result="checked")
+        metrics.observe("phase_duration_seconds", 1.0, phase="git")
+
+    def test_stop_writes_file(self, tmp_path):
+        path = tmp_path / "helmupdater.prom"
+        metrics.start(path)
+        metrics.inc("charts", result="updated")
+
+        metrics.stop()
+
+        assert metrics.collector is None
+        assert 'helmupdater_charts{result="updated"} 1' in path.read_text()
+
+    def test_stop_without_start(self):
+        metrics.stop()
+
+    def test_run_cmd_counted(self, collector):
+        run_cmd("true")
+        run_cmd("false", raise_on_error=False)
+
+        series = _series(collector.render())
+        assert series['helmupdater_subprocesses_total{command="true"}'] == "1"
+        assert series['helmupdater_subprocesses_total{command="false"}'] == "1"
+        assert (
+            float(
+                series['helmupdater_subprocess_duration_seconds_total{command="true"}']
+            )
+            >= 0
+        )
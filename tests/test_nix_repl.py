@@ -0,0 +1,102 @@
+import sys
+import textwrap
+
+import pytest
+
+from helmupdater import nix_repl
+from helmupdater.nix_repl import NixRepl, NixReplError
+
+# Mimics `nix repl`: a prompt without newline, values printed as nix strings
+FAKE_REPL = textwrap.dedent(
+    """
+    import json, sys
+
+    VALUES = {
+        "builtins.currentSystem": "x86_64-linux",
+        "chartsMetadata.local": {"nginx": {"version": "1.0.0"}},
+    }
+    for line in sys.stdin:
+        sys.stdout.write("nix-repl> ")
+        line = line.strip()
+        if line.startswith(":lf"):
+            print("Added 3 variables.")
+        elif line.startswith('"'):
+            print(line)
+        elif line.startswith("builtins.toJSON ("):
+            expr = line[len("builtins.toJSON (") : -1]
+            if expr not in VALUES:
+                print(f"error: attribute '{expr}' missing")
+                continue
+            value = json.dumps(VALUES[expr])
+            print('"' + value.replace("\\\\", "\\\\\\\\").replace('"', '\\\\"') + '"')
+        sys.stdout.flush()
+    """
+)
+
+
+@pytest.fixture
+def repl(tmp_path, monkeypatch):
+    script = tmp_path / "fake_repl.py"
+    script.write_text(FAKE_REPL)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(NixRepl, "command", (sys.executable, str(script)))
+    session = NixRepl()
+    yield session
+    session.close()
+
+
+def test_eval_json(repl):
+    assert repl.eval_json("builtins.currentSystem") == "x86_64-linux"
+    assert repl.eval_json("chartsMetadata.local") == {"nginx": {"version": "1.0.0"}}
+
+
+def test_process_is_reused(repl):
+    repl.eval_json("builtins.currentSystem")
+    process = repl._process
+
+    repl.eval_json("builtins.currentSystem")
+
+    assert repl._process is process
+
+
+def test_restarts_when_charts_change(repl, tmp_path):
+    repl.eval_json("builtins.currentSystem")
+    process = repl._process
+
+    chart_path = tmp_path / "charts" / "local" / "nginx" / "default.nix"
+    chart_path.parent.mkdir(parents=True)
+    chart_path.write_text("{}")
+    repl.eval_json("builtins.currentSystem")
+
+    assert repl._process is not process
+    assert process.poll() is not None
+
+
+def test_restarts_when_flake_changes(repl, tmp_path):
+    repl.eval_json("builtins.currentSystem")
+    process = repl._process
+
+    (tmp_path / "flake.nix").write_text("{ outputs = _: { }; }")
+    repl.eval_json("builtins.currentSystem")
+
+    assert repl._process is not process
+
+
+def test_eval_error(repl):
+    with pytest.raises(NixReplError, match="attribute 'missing' missing"):
+        repl.eval_json("missing")
+
+    # the session is still usable afterwards
+    assert repl.eval_json("builtins.currentSystem") == "x86_64-linux"
+
+
+@pytest.mark.parametrize(
+    ("literal", "expected"),
+    [
+        ('"plain"', "plain"),
+        (r'"{\"a\":\"b\\\\c\"}"', r'{"a":"b\\c"}'),
+        (r'"line\nbreak \${x}"', "line\nbreak ${x}"),
+    ],
+)
+def test_parse_nix_string(literal, expected):
+    assert nix_repl._parse_nix_string(literal) == expected
@@ -0,0 +1,116 @@
+import concurrent.futures
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+import yaml
+
+import helmupdater
+from helmupdater import parsing
+from helmupdater.parsing import ExecutorKind
+
+INDEX = """\
+apiVersion: v1
+entries:
+  nginx:
+  - version: 1.0.1
+    digest: abc
+  - version: 1.0.0
+generated: "2026-01-01T00:00:00Z"
+"""
+
+
+@pytest.fixture
+def executor_kind(monkeypatch):
+    def use(kind: ExecutorKind) -> None:
+        monkeypatch.setattr(parsing, "kind", kind)
+        monkeypatch.setattr(parsing, "MIN_PARALLEL_SIZE", 0)
+
+    yield use
+    parsing.shutdown()
+
+
+class TestResolveKind:
+    def test_requested(self):
+        assert parsing.resolve_kind(ExecutorKind.INLINE) == ExecutorKind.INLINE
+
+    def test_free_threaded(self, monkeypatch):
+        monkeypatch.setattr(sys, "_is_gil_enabled", lambda: False, raising=False)
+
+        assert parsing.resolve_kind() == ExecutorKind.THREADS
+
+    def test_interpreters(self, monkeypatch):
+        monkeypatch.setattr(sys, "_is_gil_enabled", lambda: True, raising=False)
+        monkeypatch.setattr(
+            concurrent.futures, "InterpreterPoolExecutor", object, raising=False
+        )
+
+        assert parsing.resolve_kind() == ExecutorKind.INTERPRETERS
+
+    def test_processes(self, monkeypatch):
+        monkeypatch.setattr(sys, "_is_gil_enabled", lambda: True, raising=False)
+        monkeypatch.delattr(concurrent.futures, "InterpreterPoolExecutor", False)
+
+        assert parsing.resolve_kind() == ExecutorKind.PROCESSES
+
+
+class TestLoadYaml:
+    def test_parse_yaml(self):
+        assert parsing.parse_yaml(INDEX) == yaml.safe_load(INDEX)
+
+    def test_small_inline(self, monkeypatch):
+        monkeypatch.setattr(parsing, "run", None)
+
+        assert parsing.load_yaml(INDEX)["entries"]["nginx"][0]["digest"] == "abc"
+
+    @pytest.mark.parametrize(
+        "kind", [ExecutorKind.INLINE, ExecutorKind.THREADS, ExecutorKind.PROCESSES]
+    )
+    def test_executors(self, executor_kind, kind):
+        executor_kind(kind)
+
+        assert parsing.load_yaml(INDEX) == yaml.safe_load(INDEX)
+
+    def test_executor_reused(self, executor_kind):
+        executor_kind(ExecutorKind.THREADS)
+
+        parsing.load_yaml(INDEX)
+        executor = parsing._executor
+        parsing.load_yaml(INDEX)
+
+        assert parsing._executor is executor
+
+    def test_errors_raised(self, executor_kind):
+        executor_kind(ExecutorKind.PROCESSES)
+
+        with pytest.raises(yaml.YAMLError):
+            parsing.load_yaml("entries: [")
+
+
+def test_shutdown_at_exit():
+    script = textwrap.dedent(
+        """
+        import atexit, sys
+
+        # Runs after the handlers of modules imported below
+        atexit.register(lambda: print(sys.modules["helmupdater.parsing"]._executor))
+
+        from helmupdater import parsing
+
+        parsing.kind = parsing.ExecutorKind.THREADS
+        parsing.run(len, "abc")
+        """
+    )
+    env = dict(os.environ, PYTHONPATH=str(Path(helmupdater.__file__).parents[1]))
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+
+    assert result.stdout == "None\n"
@@ -0,0 +1,70 @@
+import pstats
+import threading
+
+import pytest
+
+from helmupdater import profiling
+
+
+@pytest.fixture
+def session(tmp_path):
+    profiling.start(tmp_path / "profile")
+    yield tmp_path / "profile"
+    profiling.stop()
+
+
+class TestProfiling:
+    def test_disabled(self):
+        assert profiling.phase("registry") is profiling.phase("git", "local/nginx")
+
+    def test_profiles_written(self, session):
+        with profiling.phase("metadata"):
+            pass
+        for _ in range(2):
+            with profiling.phase("registry", "local/nginx"):
+                data = [str(i) for i in range(10000)]
+                with profiling.phase("versions", "local/nginx"):
+                    sorted(data)
+
+        profiling.stop()
+
+        assert sorted(str(p.relative_to(session)) for p in session.rglob("*.*")) == [
+            "local/nginx.registry.pstats",
+            "local/nginx.versions.pstats",
+            "run.metadata.pstats",
+            "summary.txt",
+        ]
+        functions = pstats.Stats(str(session / "local/nginx.versions.pstats")).stats
+        assert any(
+            name == "<built-in method builtins.sorted>" for *_, name in functions
+        )
+
+        summary = (session / "summary.txt").read_text()
+        assert summary.index("(run)") < summary.index("local/nginx")
+        assert summary.index("  registry: 2 call(s)") < summary.index("  versions:")
+        assert "test_profiling.py" in summary
+
+    def test_profile_names_unambiguous(self, session):
+        for chart in ("a_b/c", "a/b_c"):
+            with profiling.phase("git", chart):
+                pass
+
+        profiling.stop()
+
+        assert (session / "a_b" / "c.git.pstats").exists()
+        assert (session / "a" / "b_c.git.pstats").exists()
+
+    def test_other_threads_timed(self, session):
+        def hash_chart():
+            with profiling.phase("hashing", "local/nginx"):
+                [str(i) for i in range(10000)]
+
+        thread = threading.Thread(target=hash_chart)
+        thread.start()
+        thread.join()
+
+        profiling.stop()
+
+        summary = (session / "summary.txt").read_text()
+        assert "  hashing: 1 call(s)" in summary
+        assert "peak 0.0 B" in summary
@@ -0,0 +1,179 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from helmupdater import schedule
+from helmupdater.chart import ChartMetadata
+
+DAY = schedule.DAY
+NOW = 1_000 * DAY
+
+
+def _chart(name: str) -> ChartMetadata:
+    return ChartMetadata(
+        repo="http://localhost:45010",
+        chart=name,
+        version="1.0.0",
+        chartHash="sha256-AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=",
+    )
+
+
+CHARTS = {"local": {name: _chart(name) for name in ("daily", "yearly", "new")}}
+
+LOG = [
+    (NOW - 400 * DAY, "local/yearly: init at 1.0.0"),
+    (NOW - 30 * DAY, "local/yearly: update to 1.1.0"),
+    (NOW - 3 * DAY, "local/daily: init at 1.0.0"),
+    (NOW - 2 * DAY, "local/daily: update to 1.0.1"),
+    (NOW - 2 * DAY, "flake.lock: update"),
+    (NOW - 1 * DAY, "local/daily: update to 1.0.2"),
+    (NOW, "local/new: init at 1.0.0"),
+]
+
+
+@pytest.fixture
+def scheduler():
+    with patch("helmupdater.schedule.git.log_subjects", return_value=LOG):
+        yield schedule.Scheduler(now=NOW)
+
+
+class TestReleaseHistory:
+    @patch("helmupdater.schedule.git.log_subjects", return_value=LOG)
+    def test_release_history(self, mock_log_subjects):
+        history = schedule.release_history()
+
+        assert history == {
+            ("local", "yearly"): [NOW - 400 * DAY, NOW - 30 * DAY],
+            ("local", "daily"): [NOW - 3 * DAY, NOW - 2 * DAY, NOW - DAY],
+            ("local", "new"): [NOW],
+        }
+
+    @pytest.mark.parametrize(
+        "timestamps,expected",
+        [
+            ([], None),
+            ([10], None),
+            ([10, 20], 10),
+            ([0, 10, 30, 130], 20),
+        ],
+    )
+    def test_release_cadence(self, timestamps, expected):
+        assert schedule.release_cadence(timestamps) == expected
+
+
+class TestScheduler:
+    def test_all_due_without_state(self, scheduler):
+        assert set(scheduler.plan(CHARTS)) == {
+            ("local", "daily"),
+            ("local", "yearly"),
+            ("local", "new"),
+        }
+
+    def test_plan_order(self, scheduler):
+        assert scheduler.plan(CHARTS) == [
+            ("local", "new"),
+            ("local", "daily"),
+            ("local", "yearly"),
+        ]
+
+    def test_check_interval(self, scheduler):
+        assert scheduler.check_interval("local", "daily") == DAY * 0.25
+        assert scheduler.check_interval("local", "yearly") == 7 * DAY
+        assert scheduler.check_interval("local", "new") == 0
+
+    def test_recently_checked_not_due(self, scheduler):
+        for repo_name, chart_name in scheduler.plan(CHARTS):
+            scheduler.last_checked[f"{repo_name}/{chart_name}"] = NOW - DAY
+
+        assert scheduler.plan(CHARTS) == [("local", "new"), ("local", "daily")]
+        assert len(scheduler.plan(CHARTS, check_all=True)) == 3
+
+    def test_save(self, scheduler, cache_dir):
+        scheduler.mark_checked("local", "daily")
+        scheduler.save()
+
+        state = json.loads((cache_dir / "schedule.json").read_text())
+        assert state == {"local/daily": NOW}
+
+        with patch("helmupdater.schedule.git.log_subjects", return_value=LOG):
+            reloaded = schedule.Scheduler(now=NOW)
+        assert not reloaded.is_due("local", "daily")
+
+    def test_concurrent_runs_merged(self, scheduler):
+        with patch("helmupdater.schedule.git.log_subjects", return_value=LOG):
+            other = schedule.Scheduler(now=NOW + 1)
+        scheduler.mark_checked("local", "daily")
+        other.mark_checked("local", "yearly")
+
+        scheduler.save()
+        other.save()
+
+        assert other.last_checked == {"local/daily": NOW, "local/yearly": NOW + 1}
+
+
+class TestNegativeCache:
+    def test_missing_chart_skipped_at_once(self):
+        failures = schedule.NegativeCache(now=NOW)
+
+        failures.record_failure("local", "gone", "not found", missing=True)
+
+        assert failures.skipped_until("local", "gone") == NOW + DAY
+        assert failures.error("local", "gone") == "not found"
+
+    def test_failing_chart_skipped_after_several_runs(self):
+        for run in range(schedule.PERMANENT_FAILURES - 1):
+            failures = schedule.NegativeCache(now=NOW + run)
+            failures.record_failure("local", "broken", "bad version")
+            failures.save()
+            assert failures.skipped_until("local", "broken") is None
+
+        failures = schedule.NegativeCache(now=NOW)
+        failures.record_failure("local", "broken", "bad version")
+
+        assert failures.skipped_until("local", "broken") == NOW + DAY
+
+    def test_backoff_doubles_and_is_capped(self):
+        failures = schedule.NegativeCache(now=NOW)
+
+        periods = []
+        for _ in range(8):
+            failures.record_failure("local", "gone", "not found", missing=True)
+            periods.append(failures.skipped_until("local", "gone") - NOW)
+
+        assert periods[:3] == [DAY, 2 * DAY, 4 * DAY]
+        assert periods[-1] == schedule.MAX_FAILURE_BACKOFF
+
+    def test_skip_expires(self):
+        failures = schedule.NegativeCache(now=NOW)
+        failures.record_failure("local", "gone", "not found", missing=True)
+        failures.save()
+
+        assert (
+            schedule.NegativeCache(now=NOW + DAY).skipped_until("local", "gone") is None
+        )
+
+    def test_success_clears(self):
+        failures = schedule.NegativeCache(now=NOW)
+        failures.record_failure("local", "gone", "not found", missing=True)
+
+        failures.record_success("local", "gone")
+
+        assert failures.skipped_until("local", "gone") is None
+        assert failures.error("local", "gone") is None
+
+    def test_concurrent_runs_merged(self):
+        failures = schedule.NegativeCache(now=NOW)
+        failures.record_failure("local", "fixed", "not found", missing=True)
+        failures.save()
+        first = schedule.NegativeCache(now=NOW)
+        second = schedule.NegativeCache(now=NOW)
+
+        first.record_failure("local", "gone", "not found", missing=True)
+        second.record_success("local", "fixed")
+        first.save()
+        second.save()
+
+        reloaded = schedule.NegativeCache(now=NOW)
+        assert reloaded.skipped_until("local", "gone") == NOW + DAY
+        assert reloaded.skipped_until("local", "fixed") is None
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+
+from helmupdater import utils
+
+
+class TestParseChartName:
+    def test_parse_chart_name(self):
+        assert utils.parse_chart_name("local/nginx") == ("local", "nginx")
+
+    @pytest.mark.parametrize("name", ["nginx", "local/nginx/extra"])
+    def test_parse_chart_name_invalid(self, name):
+        with pytest.raises(ValueError, match="Invalid chart name format"):
+            utils.parse_chart_name(name)
+
+
+class TestIsPattern:
+    @pytest.mark.parametrize(
+        "name,expected",
+        [("nginx", False), ("*", True), ("kube-?", True), ("[ab]*", True)],
+    )
+    def test_is_pattern(self, name, expected):
+        assert utils.is_pattern(name) is expected
+
+
+class TestCacheDir:
+    def test_cache_dir_from_env(self, cache_dir):
+        assert utils.cache_dir() == cache_dir
+        assert cache_dir.is_dir()
+
+    def test_cache_dir_xdg(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("HELMUPDATER_CACHE_DIR")
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+
+        assert utils.cache_dir() == tmp_path / "xdg" / "helmupdater"
+
+
+class TestWriteAtomic:
+    def test_write_atomic(self, tmp_path):
+        path = tmp_path / "state.json"
+        path.write_text("old")
+
+        utils.write_atomic(path, "new")
+
+        assert path.read_text() == "new"
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_write_atomic_str_path(self, tmp_path):
+        utils.write_atomic(str(tmp_path / "state.json"), "new")
+
+        assert Path(tmp_path / "state.json").read_text() == "new"
+
+    def test_write_atomic_keeps_mode(self, tmp_path):
+        path = tmp_path / "default.nix"
+        path.write_text("old")
+        path.chmod(0o640)
+
+        utils.write_atomic(path, "new")
+
+        assert path.stat().st_mode & 0o777 == 0o640
+
+    def test_write_atomic_new_file_readable(self, tmp_path):
+        path = tmp_path / "default.nix"
+
+        utils.write_atomic(path, "new")
+
+        assert path.stat().st_mode & 0o777 == 0o644